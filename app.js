@@ -3711,6 +3711,7 @@ async function analyzeSubmission(submissionId) {
                 
                 // Send the API request
                 const apiUrl = 'http://localhost:8000/api/analyze';
+                const idempotencyKey = `analyze-${submissionId}-${window.crypto && crypto.randomUUID ? crypto.randomUUID() : Date.now()}`;
                 console.log(`Sending request to ${apiUrl}`);
                 
                 // Display detailed info about the request
@@ -3722,13 +3723,29 @@ async function analyzeSubmission(submissionId) {
                     taskId: assignment.id
                 });
                 
-                const response = await fetch(apiUrl, {
-                method: 'POST',
-                    body: formData,
-                    // Allow credentials and set proper CORS headers
-                    credentials: 'include',
-                    mode: 'cors'
-            });
+                // Network errors are retried with the same Idempotency-Key: the server finishes a
+                // keyed analysis even if the connection drops, and answers a resend of it with the
+                // stored result instead of analyzing again
+                let response;
+                for (let attempt = 1; ; attempt++) {
+                    try {
+                        response = await fetch(apiUrl, {
+                            method: 'POST',
+                            body: formData,
+                            headers: { 'Idempotency-Key': idempotencyKey },
+                            // Allow credentials and set proper CORS headers
+                            credentials: 'include',
+                            mode: 'cors'
+                        });
+                        break;
+                    } catch (networkError) {
+                        if (attempt >= 3) {
+                            throw networkError;
+                        }
+                        console.warn(`Network error, resending the analysis request (attempt ${attempt + 1})`, networkError);
+                        await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+                    }
+                }
             
                 if (!response.ok) {
                     throw new Error(`API error: ${response.status} ${response.statusText}`);
@@ -0,0 +1,117 @@
+"""
+Admission control of /api/analyze. A request is admitted while the requests of this process in
+flight stay under a limit and the interactive model calls waiting for a slot stay under theirs;
+the in-flight limit shrinks as the observed upstream latency grows past its target, so a slow
+provider sheds load instead of piling up requests that time out on the client and still spend
+tokens. Shed requests get a 503 with Retry-After, or run as a queued job when the client asked
+for it (Prefer: respond-async) or ADMISSION_OVERLOAD_ACTION=job.
+"""
+import os
+import math
+import threading
+from typing import Any, Dict, Tuple
+
+# Concurrent /api/analyze requests of this process while the upstream answers within the target
+admission_max_in_flight = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32"))
+# What is still admitted however slow the upstream gets
+admission_min_in_flight = int(os.getenv("ADMISSION_MIN_IN_FLIGHT", "4"))
+# Upstream latency (seconds, smoothed) above which the in-flight limit is scaled down
+admission_target_latency = float(os.getenv("ADMISSION_TARGET_LATENCY", "20"))
+# Interactive model calls waiting for a scheduler slot
+admission_max_llm_waiting = int(os.getenv("ADMISSION_MAX_LLM_WAITING", "64"))
+# Jobs waiting on the broker; enqueues beyond it are refused
+admission_max_job_queue = int(os.getenv("ADMISSION_MAX_JOB_QUEUE", "1000"))
+# reject: 503 with Retry-After; job: queue the analysis and answer 202 with the job's status URL
+admission_overload_action = os.getenv("ADMISSION_OVERLOAD_ACTION", "reject").lower()
+admission_max_retry_after = int(os.getenv("ADMISSION_MAX_RETRY_AFTER", "120"))
+
+OK, BUSY, OVERLOADED = "ok", "busy", "overloaded"
+
+# Weight of the newest observation in the smoothed latency
+LATENCY_SMOOTHING = 0.2
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight: int, min_in_flight: int, target_latency: float, max_llm_waiting: int):
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min_in_flight
+        self.target_latency = target_latency
+        self.max_llm_waiting = max_llm_waiting
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.latency = None
+        self.admitted = 0
+        self.rejected = 0
+        self.redirected = 0
+
+    def observe_latency(self, seconds: float):
+        """Record the duration of an upstream call."""
+        with self._lock:
+            self.latency = seconds if self.latency is None else self.latency + LATENCY_SMOOTHING * (seconds - self.latency)
+
+    def _limit(self) -> int:
+        if not self.latency or self.latency <= self.target_latency:
+            return self.max_in_flight
+        return max(self.min_in_flight, int(self.max_in_flight * self.target_latency / self.latency))
+
+    def _load(self, llm_waiting: int) -> Dict[str, Any]:
+        limit = self._limit()
+        reasons = []
+        if self.in_flight >= limit:
+            reasons.append("in_flight")
+        if llm_waiting >= self.max_llm_waiting:
+            reasons.append("llm_queue")
+        if reasons:
+            state = OVERLOADED
+        elif self.in_flight >= 0.75 * limit or (self.latency or 0) > self.target_latency:
+            state = BUSY
+        else:
+            state = OK
+        return {
+            "state": state,
+            "reasons": reasons,
+            "in_flight": self.in_flight,
+            "in_flight_limit": limit,
+            "llm_waiting": llm_waiting,
+            "upstream_latency_s": round(self.latency, 3) if self.latency is not None else None
+        }
+
+    def load(self, llm_waiting: int) -> Dict[str, Any]:
+        with self._lock:
+            return self._load(llm_waiting)
+
+    def try_admit(self, llm_waiting: int) -> Tuple[bool, Dict[str, Any]]:
+        """Admit a request (to be released when it finishes) unless the server is overloaded; returns (admitted, load)."""
+        with self._lock:
+            load = self._load(llm_waiting)
+            if load["state"] == OVERLOADED:
+                self.rejected += 1
+                return False, load
+            self.in_flight += 1
+            self.admitted += 1
+            return True, load
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def count_redirect(self):
+        with self._lock:
+            self.rejected -= 1
+            self.redirected += 1
+
+    def retry_after(self, llm_waiting: int, llm_capacity: int) -> int:
+        """Seconds until the model calls ahead have drained: rounds of llm_capacity calls at the observed latency."""
+        with self._lock:
+            latency = self.latency or self.target_latency
+        seconds = latency * (1 + llm_waiting / max(llm_capacity, 1))
+        return min(max(1, math.ceil(seconds)), admission_max_retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"admitted": self.admitted, "rejected": self.rejected, "redirected": self.redirected}
+
+
+admission = AdmissionController(
+    admission_max_in_flight, admission_min_in_flight, admission_target_latency, admission_max_llm_waiting
+)
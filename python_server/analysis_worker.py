@@ -0,0 +1,47 @@
+"""
+Analysis worker: pulls jobs queued by /api/jobs/analyze from the broker and runs the analysis
+pipeline. Start as many as needed on the host of the API server: they share its submissions
+directory and its SQLite store (SHARED_CACHE_PATH, on a local disk):
+
+    JOB_BROKER_URL=redis://broker:6379/0 python analysis_worker.py
+
+The worker ID (WORKER_ID, by default host and process ID) names the list holding the jobs it is
+working on. A worker restarted under the same ID first puts its unfinished jobs back in the queue;
+those of a worker that does not come back (or comes back under a new process ID) are put back by
+the other workers once its heartbeat expires (JOB_WORKER_HEARTBEAT_TTL).
+"""
+import os
+import socket
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from main_functional import job_broker, run_analysis_job, preload_app_state
+from job_broker import process_jobs
+from shared_cache import check_local_filesystem
+from worker_pools import shutdown_pools
+
+logger = logging.getLogger("proofmate.analysis_worker")
+
+worker_id = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def main():
+    if job_broker.local:
+        logger.error("JOB_BROKER_URL is memory://: jobs are run by the API process itself, a separate worker would never see them")
+        return
+    check_local_filesystem()
+    preload_app_state()
+    try:
+        asyncio.run(process_jobs(job_broker, run_analysis_job, worker_id))
+    except KeyboardInterrupt:
+        logger.info(f"Worker {worker_id} stopped")
+    finally:
+        shutdown_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Import-time benchmark of the server: imports main_functional in fresh interpreters and reports
+the wall time together with the slowest top-level imports (from python -X importtime).
+
+    python benchmark_startup.py [--runs 5] [--top 15] [--module main_functional]
+
+Run it before and after touching the imports; anything only some requests need (the report
+and LLM stacks) should stay out of the list.
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+TIMER = "import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+
+
+def import_once(module):
+    """Import the module in a new interpreter; returns (seconds, importtime lines)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", TIMER.format(module=module)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+    )
+    lines = [line for line in result.stderr.splitlines() if line.startswith("import time:")]
+    return float(result.stdout.strip().splitlines()[-1]), lines
+
+
+def slowest_imports(lines, module, top):
+    """Cumulative time of the modules imported directly by the benchmarked module, slowest first."""
+    imports, children = [], []
+    for line in lines:
+        _, cumulative_us, name = line.split("|")
+        if not cumulative_us.strip().isdigit():
+            continue
+        # importtime lists a module after its own imports, indented by two spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children.append((int(cumulative_us) / 1e6, name.strip()))
+        elif depth == 0:
+            if name.strip() == module:
+                imports = children
+            children = []
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of the server")
+    parser.add_argument("--module", default="main_functional")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    # The first run warms the bytecode and OS file caches and is not counted
+    import_once(args.module)
+    timings, lines = [], []
+    for _ in range(args.runs):
+        seconds, lines = import_once(args.module)
+        timings.append(seconds)
+
+    print(f"import {args.module}: median {statistics.median(timings):.3f}s, "
+          f"min {min(timings):.3f}s, max {max(timings):.3f}s over {args.runs} runs")
+    print("Slowest direct imports (cumulative):")
+    for seconds, name in slowest_imports(lines, args.module, args.top):
+        print(f"  {seconds:7.3f}s  {name}")
+
+
+if __name__ == "__main__":
+    main()
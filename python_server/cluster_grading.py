@@ -0,0 +1,78 @@
+import math
+import logging
+import numpy as np
+from collections import Counter
+from typing import List, Dict, Any
+
+from similarity_index import normalize_code
+
+logger = logging.getLogger("proofmate.cluster_grading")
+
+
+def submission_tokens(cells: List[Dict[str, Any]]) -> List[str]:
+    """Code token unigrams and bigrams of a parsed notebook."""
+    tokens = []
+    for cell in cells:
+        if cell.get("type") == "code":
+            cell_tokens = normalize_code(cell.get("content", ""))
+            tokens.extend(cell_tokens)
+            tokens.extend(f"{a} {b}" for a, b in zip(cell_tokens, cell_tokens[1:]))
+    return tokens
+
+
+def tfidf_vectors(token_lists: List[List[str]]) -> np.ndarray:
+    """L2-normalized TF-IDF matrix (one row per submission) with sublinear term frequency."""
+    vocabulary = {}
+    counts = []
+    for tokens in token_lists:
+        counter = Counter(tokens)
+        counts.append(counter)
+        for token in counter:
+            vocabulary.setdefault(token, len(vocabulary))
+
+    matrix = np.zeros((len(token_lists), max(len(vocabulary), 1)), dtype=np.float32)
+    for row, counter in enumerate(counts):
+        for token, count in counter.items():
+            matrix[row, vocabulary[token]] = 1.0 + math.log(count)
+
+    document_frequency = np.count_nonzero(matrix, axis=0)
+    idf = np.log((1.0 + len(token_lists)) / (1.0 + document_frequency)) + 1.0
+    matrix *= idf.astype(np.float32)
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def similarity_matrix(vectors: np.ndarray) -> np.ndarray:
+    """Cosine similarity of all submission pairs; submissions without code are similar to each other."""
+    similarity = vectors @ vectors.T
+    empty = ~vectors.any(axis=1)
+    similarity[np.ix_(empty, empty)] = 1.0
+    return similarity
+
+
+def cluster_submissions(vectors: np.ndarray, threshold: float) -> List[Dict[str, Any]]:
+    """
+    Greedy star clustering: the submission with the most unassigned neighbours above
+    the threshold becomes a representative and takes those neighbours as members.
+    """
+    similarity = similarity_matrix(vectors)
+    neighbours = similarity >= threshold
+    unassigned = np.ones(len(vectors), dtype=bool)
+    clusters = []
+
+    while unassigned.any():
+        degrees = (neighbours & unassigned).sum(axis=1)
+        degrees[~unassigned] = -1
+        representative = int(np.argmax(degrees))
+        members = np.flatnonzero(neighbours[representative] & unassigned)
+        unassigned[members] = False
+        clusters.append({
+            "representative": representative,
+            "members": [int(m) for m in members if m != representative],
+            "similarities": {int(m): float(similarity[representative, m]) for m in members if m != representative}
+        })
+
+    logger.info(f"Clustered {len(vectors)} submissions into {len(clusters)} clusters (threshold {threshold})")
+    return clusters
@@ -0,0 +1,186 @@
+"""
+Deadlines and cancellation of a request's work. The endpoint opens a scope carrying the
+request's deadline and a cancellation flag; both reach the threads running the blocking stages
+(asyncio.to_thread and the I/O pool copy the context), so a streamed model call stops mid-answer
+and the stages after it are skipped once the client has gone or the deadline has passed.
+"""
+import os
+import re
+import time
+import asyncio
+import threading
+import contextlib
+import contextvars
+from typing import Optional
+
+# Time budget of a synchronous analysis; a client may ask for less with X-Request-Timeout (seconds)
+analyze_deadline = float(os.getenv("ANALYZE_DEADLINE", "120"))
+
+DEADLINE, DISCONNECTED = "deadline", "disconnected"
+
+
+class Cancelled(Exception):
+    """The work of a request was stopped: its deadline passed or its client disconnected."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CancelScope:
+    def __init__(self, timeout: Optional[float] = None):
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self.reason: Optional[str] = None
+        self._cancelled = threading.Event()
+
+    def remaining(self) -> Optional[float]:
+        return self.deadline - time.monotonic() if self.deadline is not None else None
+
+    def cancel(self, reason: str):
+        if not self._cancelled.is_set():
+            self.reason = reason
+            self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._cancelled.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(DEADLINE)
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled(self.reason)
+
+
+_scope_var: contextvars.ContextVar[Optional[CancelScope]] = contextvars.ContextVar("cancel_scope", default=None)
+
+
+def open_scope(timeout: Optional[float] = None) -> CancelScope:
+    """Start a scope for the current request or job; the stages it runs see it as current_scope()."""
+    scope = CancelScope(timeout)
+    _scope_var.set(scope)
+    return scope
+
+
+def current_scope() -> Optional[CancelScope]:
+    return _scope_var.get()
+
+
+def check_cancelled():
+    """Raise Cancelled between stages if the current request was cancelled or is past its deadline."""
+    scope = _scope_var.get()
+    if scope is not None:
+        scope.check()
+
+
+def call_timeout(limit: float) -> float:
+    """
+    Timeout of an outbound call: its own limit, or what is left of the request's deadline if that
+    is less. Raises Cancelled instead of starting a call for a cancelled request.
+    """
+    scope = _scope_var.get()
+    if scope is None:
+        return limit
+    scope.check()
+    remaining = scope.remaining()
+    return limit if remaining is None else min(limit, remaining)
+
+
+def request_timeout(header_value: Optional[str], limit: float) -> float:
+    """The deadline of a request: the limit, or the client's X-Request-Timeout if shorter."""
+    try:
+        requested = float(header_value) if header_value else limit
+    except ValueError:
+        requested = limit
+    return min(max(requested, 0), limit)
+
+
+class DisconnectWatcher:
+    """
+    ASGI middleware for the paths matching the given patterns: once the app has read the request
+    body (at once for a GET, which has none), it keeps listening on the connection and sets the
+    asyncio.Event in request.state.disconnected when the client goes away. (Request.is_disconnected
+    cannot see that through @app.middleware layers.)
+    """
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = [re.compile(path) for path in paths]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not any(path.fullmatch(scope["path"]) for path in self.paths):
+            await self.app(scope, receive, send)
+            return
+        disconnected = asyncio.Event()
+        scope.setdefault("state", {})["disconnected"] = disconnected
+        listener = None
+
+        async def listen():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        async def receive_body():
+            nonlocal listener
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False) and listener is None:
+                listener = asyncio.create_task(listen())
+            return message
+
+        body_read = False
+
+        async def receive_without_body():
+            # The listener owns the connection; the app gets the empty body, then the disconnect
+            nonlocal body_read
+            if not body_read:
+                body_read = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        if scope["method"] in ("GET", "HEAD"):
+            listener = asyncio.create_task(listen())
+        try:
+            await self.app(scope, receive_without_body if listener is not None else receive_body, send)
+        finally:
+            if listener is not None:
+                listener.cancel()
+
+
+@contextlib.asynccontextmanager
+async def cancellation_guard(scope: CancelScope, disconnected: Optional[asyncio.Event] = None):
+    """
+    Cancel the current task when the scope's deadline passes or (if given) the disconnected event
+    is set, and raise Cancelled in its place. The scope is cancelled first, so that the stages
+    running in threads stop too; so they do when the task is cancelled by anything else.
+    """
+    if scope.deadline is None and disconnected is None:
+        yield scope
+        return
+    task = asyncio.current_task()
+    stopped = False
+
+    async def watch():
+        nonlocal stopped
+        try:
+            await asyncio.wait_for((disconnected or asyncio.Event()).wait(), scope.remaining())
+            scope.cancel(DISCONNECTED)
+        except asyncio.TimeoutError:
+            scope.cancel(DEADLINE)
+        stopped = True
+        task.cancel()
+
+    watcher = asyncio.create_task(watch())
+    try:
+        yield scope
+    except asyncio.CancelledError:
+        scope.cancel(DISCONNECTED)
+        # Task.uncancel (3.11+) tells our cancellation from one requested by someone else as well;
+        # before 3.11 the cancellation is taken for ours whenever the watcher has fired
+        if stopped and (not hasattr(task, "uncancel") or task.uncancel() == 0):
+            raise Cancelled(scope.reason)
+        raise
+    finally:
+        watcher.cancel()
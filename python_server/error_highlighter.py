@@ -0,0 +1,230 @@
+import re
+import difflib
+import logging
+from typing import List, Dict, Any, Optional, Tuple
+
+from similarity_index import normalize_code
+from task_segmenter import align_tasks
+
+logger = logging.getLogger("proofmate.error_highlighter")
+
+ANSI_ESCAPE_RE = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+# IPython 8: "Cell In[5], line 3"; older IPython: "----> 3 x = 1 / 0"; sandbox runs: File "<cell>", line 3
+IPYTHON_FRAME_RE = re.compile(r'Cell In\s*\[\d*\],\s*line (\d+)')
+IPYTHON_ARROW_RE = re.compile(r'^-*>\s*(\d+)', re.MULTILINE)
+SANDBOX_FRAME_RE = re.compile(r'File "<cell>", line (\d+)')
+# The same markers main.py looks for in checked notebooks
+ERROR_MARKER_RE = re.compile(r'ОШИБКА|ERROR')
+# "строка 3", "строки 3-5", "line 3", "lines 3–5"
+LINE_REFERENCE_RE = re.compile(r'(?:строк[аеиу]?|line|lines)\s*(\d+)(?:\s*[-–—]\s*(\d+))?', re.IGNORECASE)
+WORD_RE = re.compile(r'[A-Za-z_]\w*')
+
+MAX_SUGGESTION_LINES = 3
+
+
+def highlight(cell_index: int, line_start: int, line_end: int, error_type: str, error_message: str, suggestion: str) -> Dict[str, Any]:
+    return {
+        "cell_index": cell_index,
+        "line_start": line_start,
+        "line_end": line_end,
+        "error_type": error_type,
+        "error_message": error_message,
+        "suggestion": suggestion
+    }
+
+
+def traceback_line(traceback_text: str) -> Optional[int]:
+    """Line of the cell in which an error was raised, from an IPython or sandbox traceback."""
+    text = ANSI_ESCAPE_RE.sub("", traceback_text)
+    for pattern in (IPYTHON_FRAME_RE, SANDBOX_FRAME_RE, IPYTHON_ARROW_RE):
+        match = pattern.search(text)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def clamp_line(line: int, source: str) -> int:
+    return min(max(line, 1), max(len(source.splitlines()), 1))
+
+
+def traceback_highlights(cell: Dict[str, Any], cell_run: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Highlights for the errors a cell raised: from its saved outputs and from a sandboxed run of it."""
+    errors = []
+    for output in cell.get("outputs", []):
+        if output.get("output_type") == "error":
+            traceback_text = "\n".join(output.get("traceback", []))
+            errors.append((f"{output.get('ename')}: {output.get('evalue')}", traceback_text))
+    if cell_run and not cell_run.get("ok") and cell_run.get("error"):
+        errors.append((cell_run["error"], cell_run.get("traceback", "")))
+
+    highlights = []
+    for message, traceback_text in errors:
+        line = traceback_line(traceback_text)
+        if line is None:
+            continue
+        line = clamp_line(line, cell.get("content", ""))
+        highlights.append(highlight(
+            cell["index"], line, line, "runtime_error", ANSI_ESCAPE_RE.sub("", message),
+            f"Исправьте ошибку выполнения в строке {line}"
+        ))
+    return highlights
+
+
+def marker_highlights(cell: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Highlights for lines marked with ОШИБКА/ERROR in the notebook."""
+    highlights = []
+    for line_number, line in enumerate(cell.get("content", "").splitlines(), start=1):
+        if ERROR_MARKER_RE.search(line):
+            highlights.append(highlight(
+                cell["index"], line_number, line_number, "marked_error", line.strip(),
+                "Проверьте фрагмент, отмеченный как ошибочный"
+            ))
+    return highlights
+
+
+def diff_hunks(student_source: str, reference_source: str) -> List[Tuple[int, int, List[str]]]:
+    """
+    Line ranges of the student cell that differ from the reference cell, ignoring
+    whitespace, comments and blank lines. Returns (line_start, line_end, reference lines) with 1-based lines.
+    """
+    student_lines = [(number, line.strip()) for number, line in enumerate(student_source.splitlines(), start=1)
+                     if normalize_code(line, keep_numbers=True)]
+    reference_lines = [line.strip() for line in reference_source.splitlines() if normalize_code(line, keep_numbers=True)]
+
+    matcher = difflib.SequenceMatcher(
+        None,
+        [" ".join(normalize_code(line, keep_numbers=True)) for _, line in student_lines],
+        [" ".join(normalize_code(line, keep_numbers=True)) for line in reference_lines],
+        autojunk=False
+    )
+    hunks = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if i1 == i2:
+            # Lines the student is missing: point at the line where they belong
+            if not student_lines:
+                continue
+            anchor = student_lines[min(i1, len(student_lines) - 1)][0]
+            hunks.append((anchor, anchor, reference_lines[j1:j2]))
+        else:
+            hunks.append((student_lines[i1][0], student_lines[i2 - 1][0], reference_lines[j1:j2]))
+    return hunks
+
+
+def align_code_cells(student_cells: List[Dict[str, Any]], reference_cells: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """Student code cell index -> reference code cell, paired by order within each task."""
+    pairs = {}
+    for unit in align_tasks(student_cells, reference_cells):
+        student_code = [cell for cell in unit["student_cells"] if cell.get("type") == "code"]
+        reference_code = [cell for cell in unit["reference_cells"] if cell.get("type") == "code"]
+        for student_cell, reference_cell in zip(student_code, reference_code):
+            pairs[student_cell["index"]] = reference_cell
+    return pairs
+
+
+def pick_hunk(comment: str, hunks: List[Tuple[int, int, List[str]]], source_lines: List[str]) -> Tuple[int, int, List[str]]:
+    """The hunk a comment is about: the one sharing most identifiers with it, the first one on a tie."""
+    comment_words = set(WORD_RE.findall(comment))
+
+    def overlap(hunk):
+        line_start, line_end, reference = hunk
+        words = set(WORD_RE.findall(" ".join(source_lines[line_start - 1:line_end] + reference)))
+        return len(words & comment_words)
+
+    return max(hunks, key=lambda hunk: (overlap(hunk), -hunk[0]))
+
+
+def reference_suggestion(reference_lines: List[str]) -> str:
+    if not reference_lines:
+        return "Сравните с эталонным решением: в эталоне этих строк нет"
+    shown = reference_lines[:MAX_SUGGESTION_LINES]
+    more = " ..." if len(reference_lines) > MAX_SUGGESTION_LINES else ""
+    return "Сравните с эталонным решением: " + "; ".join(shown) + more
+
+
+def comment_highlights(cell: Dict[str, Any], comments: List[str], reference_cell: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Place the LLM comments of a cell on line ranges: explicit line references first,
+    otherwise the diff hunk against the aligned reference cell the comment matches best.
+    """
+    source = cell.get("content", "")
+    source_lines = source.splitlines()
+    hunks = diff_hunks(source, reference_cell.get("content", "")) if reference_cell else []
+
+    highlights = []
+    for comment in comments:
+        line_reference = LINE_REFERENCE_RE.search(comment)
+        if line_reference and source_lines:
+            line_start = clamp_line(int(line_reference.group(1)), source)
+            line_end = clamp_line(int(line_reference.group(2) or line_reference.group(1)), source)
+            highlights.append(highlight(
+                cell["index"], line_start, max(line_start, line_end), "reviewer_comment", comment,
+                "Исправьте указанные строки"
+            ))
+        elif hunks:
+            line_start, line_end, reference_lines = pick_hunk(comment, hunks, source_lines)
+            highlights.append(highlight(
+                cell["index"], line_start, line_end, "reference_mismatch", comment,
+                reference_suggestion(reference_lines)
+            ))
+    return highlights
+
+
+def mismatch_highlights(cell: Dict[str, Any], reference_cell: Optional[Dict[str, Any]], message: str) -> List[Dict[str, Any]]:
+    """Highlights for a cell whose computed value differs from the reference: its diff hunks, or its last line."""
+    source = cell.get("content", "")
+    hunks = diff_hunks(source, reference_cell.get("content", "")) if reference_cell else []
+    if not hunks and source.strip():
+        last_line = len(source.splitlines())
+        hunks = [(last_line, last_line, [])]
+    return [
+        highlight(cell["index"], line_start, line_end, "wrong_result", message, reference_suggestion(reference_lines))
+        for line_start, line_end, reference_lines in hunks
+    ]
+
+
+def build_error_highlights(student_cells: List[Dict[str, Any]], reference_cells: List[Dict[str, Any]],
+                           cell_annotations: List[Dict[str, Any]],
+                           student_run: Optional[Dict[str, Any]] = None,
+                           execution_check: Optional[Dict[str, Any]] = None,
+                           symbolic_check: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Compute line-level error highlights locally, without any LLM calls: tracebacks and
+    ОШИБКА/ERROR markers, cells whose results differ from the reference, and the LLM's
+    cell comments placed on the lines in which the cell differs from the reference.
+    """
+    cells_by_index = {cell["index"]: cell for cell in student_cells}
+    reference_pairs = align_code_cells(student_cells, reference_cells)
+    run_cells = (student_run or {}).get("cells", {})
+
+    highlights = []
+    for cell in student_cells:
+        if cell.get("type") == "code":
+            highlights.extend(traceback_highlights(cell, run_cells.get(cell["index"])))
+        highlights.extend(marker_highlights(cell))
+
+    wrong_cells = set((execution_check or {}).get("mismatched_cells", []))
+    wrong_cells.update(
+        task["cell_index"] for task in (symbolic_check or {}).get("tasks", [])
+        if task.get("verdict") == "different" and task.get("cell_index") is not None
+    )
+    for cell_index in sorted(wrong_cells):
+        if cell_index in cells_by_index:
+            highlights.extend(mismatch_highlights(
+                cells_by_index[cell_index], reference_pairs.get(cell_index),
+                "Результат ячейки не совпадает с эталонным"
+            ))
+
+    for annotation in cell_annotations:
+        cell = cells_by_index.get(annotation.get("cell_index"))
+        if cell is None or cell.get("type") != "code":
+            continue
+        highlights.extend(comment_highlights(cell, annotation.get("comments", []), reference_pairs.get(cell["index"])))
+
+    unique = {}
+    for item in highlights:
+        unique.setdefault((item["cell_index"], item["line_start"], item["line_end"], item["error_type"], item["error_message"]), item)
+    highlights = sorted(unique.values(), key=lambda item: (item["cell_index"], item["line_start"], item["line_end"]))
+    logger.debug(f"Computed {len(highlights)} error highlights locally")
+    return highlights
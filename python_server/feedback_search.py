@@ -0,0 +1,169 @@
+"""
+Text side of the feedback search: what of an analysis result is indexed, and how a teacher's query
+becomes an FTS5 match expression. SQLite's tokenizers know no Russian morphology, so the text is
+indexed word for word (unicode61 folds the case) and every query word is reduced to its stem
+(Snowball's Russian algorithm) and matched as a prefix: "определитель" finds "определителя" and
+"определителей", and snippet() still highlights the words as they were written.
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+# Indexed columns of an analysis result, in the order of the full-text table
+COLUMNS = ("error_summary", "detailed_feedback", "cell_annotations")
+# Relevance weight of a match in each column (bm25)
+COLUMN_WEIGHTS = (2.0, 1.5, 1.0)
+
+_WORD_RE = re.compile(r"\w+")
+
+# Words a query is not narrowed by: function words (from Snowball's Russian list, without the
+# ones that carry meaning in feedback, like "лучше" or "нельзя") and their English counterparts
+STOP_WORDS = frozenset("""
+    в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне
+    было вот от меня еще нет о об из ему теперь когда даже ну вдруг ли если уже или ни быть был
+    него до вас нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней
+    для мы тебя их чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того
+    потому этого какой ним здесь этом мой тем чтобы нее сейчас были куда зачем всех при наконец
+    другой хоть после над тот через эти нас про всего них какая разве эту моя впрочем свою этой
+    перед иногда чуть том такой им всю между это
+    a an the of in on at to for and or is are was be by with not it this that as from
+""".split())
+
+_VOWELS = "аеиоуыэюя"
+
+# Endings of the Russian Snowball stemmer, longest first. Endings of the *_AFTER_A groups are only
+# removed after "а" or "я", which stays.
+_PERFECTIVE_GERUND_AFTER_A = ("вшись", "вши", "в")
+_PERFECTIVE_GERUND = ("ывшись", "ившись", "ывши", "ивши", "ыв", "ив")
+_ADJECTIVE = (
+    "ими", "ыми", "его", "ого", "ему", "ому", "ее", "ие", "ые", "ое", "ей", "ий", "ый", "ой",
+    "ем", "им", "ым", "ом", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею"
+)
+_PARTICIPLE_AFTER_A = ("ем", "нн", "вш", "ющ", "щ")
+_PARTICIPLE = ("ивш", "ывш", "ующ")
+_REFLEXIVE = ("ся", "сь")
+_VERB_AFTER_A = ("ете", "йте", "ешь", "нно", "ла", "на", "ли", "ем", "ло", "но", "ет", "ют", "ны", "ть", "й", "л", "н")
+_VERB = (
+    "уйте", "ейте", "ила", "ыла", "ена", "ите", "или", "ыли", "ило", "ыло", "ено", "ует", "уют",
+    "ены", "ить", "ыть", "ишь", "ей", "уй", "ил", "ыл", "им", "ым", "ен", "ят", "ит", "ыт", "ую", "ю"
+)
+_NOUN = (
+    "иями", "ями", "ами", "ией", "иям", "ием", "иях", "ев", "ов", "ие", "ье", "еи", "ии", "ей",
+    "ой", "ий", "ям", "ем", "ам", "ом", "ах", "ях", "ию", "ью", "ия", "ья", "а", "е", "и", "й",
+    "о", "у", "ы", "ь", "ю", "я"
+)
+_SUPERLATIVE = ("ейше", "ейш")
+_DERIVATIONAL = ("ость", "ост")
+
+
+def _regions(word: str):
+    """Start of RV (after the first vowel) and of R2 (the second region after a vowel-consonant pair)."""
+    rv = next((i + 1 for i, char in enumerate(word) if char in _VOWELS), len(word))
+    starts = []
+    for i in range(1, len(word)):
+        if word[i - 1] in _VOWELS and word[i] not in _VOWELS:
+            starts.append(i + 1)
+            if len(starts) == 2:
+                break
+    r2 = starts[1] if len(starts) == 2 else len(word)
+    return rv, r2
+
+
+def _strip(word: str, start: int, endings, after_a: bool = False) -> Optional[str]:
+    """The word without the first of the endings found in word[start:], or None."""
+    region = word[start:]
+    for ending in endings:
+        if region.endswith(ending):
+            stem = word[:-len(ending)]
+            if not after_a:
+                return stem
+            if len(region) > len(ending) and stem[-1] in "ая":
+                return stem
+    return None
+
+
+def _strip_any(word: str, start: int, groups) -> Optional[str]:
+    """Try (endings, after_a) groups together: the longest ending found wins."""
+    best = None
+    for endings, after_a in groups:
+        stem = _strip(word, start, endings, after_a)
+        if stem is not None and (best is None or len(stem) < len(best)):
+            best = stem
+    return best
+
+
+def stem(word: str) -> str:
+    """Snowball stem of a Russian word (lower case, ё as е); other words come back unchanged."""
+    word = word.lower().replace("ё", "е")
+    rv, r2 = _regions(word)
+    if rv >= len(word):
+        return word
+
+    # Step 1: a perfective gerund, or else a reflexive ending followed by an adjectival, verb or noun ending
+    stripped = _strip_any(word, rv, ((_PERFECTIVE_GERUND_AFTER_A, True), (_PERFECTIVE_GERUND, False)))
+    if stripped is not None:
+        word = stripped
+    else:
+        word = _strip(word, rv, _REFLEXIVE) or word
+        adjective = _strip(word, rv, _ADJECTIVE)
+        if adjective is not None:
+            word = _strip_any(adjective, rv, ((_PARTICIPLE_AFTER_A, True), (_PARTICIPLE, False))) or adjective
+        else:
+            word = (_strip_any(word, rv, ((_VERB_AFTER_A, True), (_VERB, False)))
+                    or _strip(word, rv, _NOUN)
+                    or word)
+
+    # Step 2
+    if word[rv:].endswith("и"):
+        word = word[:-1]
+
+    # Step 3: a derivational ending in R2
+    if r2 < len(word):
+        word = _strip(word, r2, _DERIVATIONAL) or word
+
+    # Step 4: a superlative ending, a double н or a soft sign
+    word = _strip(word, rv, _SUPERLATIVE) or word
+    if word[rv:].endswith("нн"):
+        word = word[:-1]
+    elif word[rv:].endswith("ь"):
+        word = word[:-1]
+    return word
+
+
+def normalize(text: str) -> str:
+    """Indexed text: ё is written as е, as the stems are."""
+    return text.replace("ё", "е").replace("Ё", "Е")
+
+
+def match_query(query: str) -> Optional[str]:
+    """
+    FTS5 expression finding the documents that contain every significant word of the query in
+    some form; one-letter and stop words are left out (a document need not contain "в" or "и"),
+    and a query without any other word gives None. The words are quoted, so the query's own
+    punctuation is not taken for FTS5 syntax.
+    """
+    terms = []
+    for word in _WORD_RE.findall(query):
+        if len(word) < 2 or normalize(word.lower()) in STOP_WORDS:
+            continue
+        word_stem = stem(word)
+        # A stem of one letter would match half the dictionary
+        terms.append(f'"{word_stem}"*' if len(word_stem) > 1 else f'"{word.lower()}"')
+    return " AND ".join(terms) if terms else None
+
+
+def feedback_columns(analysis_result: Dict[str, Any]) -> List[str]:
+    """The indexed text of an analysis result, one string per column of COLUMNS."""
+    feedback = analysis_result.get("detailed_feedback") or {}
+    feedback_lines = [
+        str(item) for key in ("strengths", "weaknesses", "suggestions") for item in feedback.get(key) or []
+    ]
+    annotation_lines = [
+        f"Ячейка {annotation.get('cell_index')}: {comment}"
+        for annotation in analysis_result.get("cell_annotations") or []
+        for comment in annotation.get("comments") or []
+    ]
+    return [
+        normalize(str(analysis_result.get("error_summary") or "")),
+        normalize("\n".join(feedback_lines)),
+        normalize("\n".join(annotation_lines))
+    ]
@@ -0,0 +1,107 @@
+"""
+Idempotency keys: the first request with a given Idempotency-Key stores its response, retries
+with the same key get that response back instead of running again. Records live in the shared
+SQLite file, so a retry that lands on another worker process is recognized too. A key reused
+with a different request (its fingerprint differs) is an error; a key whose first request is
+still running is reported as pending.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from shared_cache import connection_with
+
+logger = logging.getLogger("proofmate.idempotency")
+
+# How long a stored response is replayed
+idempotency_ttl = int(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+# A request still marked running after this long is presumed dead and its key is reused
+idempotency_pending_ttl = int(os.getenv("IDEMPOTENCY_PENDING_TTL", "600"))
+max_key_length = 255
+
+NEW, REPLAY, PENDING, MISMATCH = "new", "replay", "pending", "mismatch"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    status_code INTEGER,
+    body TEXT,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idempotency_expiry ON idempotency (expires_at);
+"""
+
+def fingerprint(*parts: Any) -> str:
+    """Digest of what identifies a request: the same key must come with the same fingerprint."""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, namespace: str, ttl: int, pending_ttl: int):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def begin(self, key: str, request_fingerprint: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Look the key up and claim it if it is free. Returns (NEW, None) for the first request,
+        (REPLAY, {"status_code", "body"}) for a finished one, (PENDING, None) or (MISMATCH, None).
+        Storage errors are logged and the request runs as if it had no key.
+        """
+        now = time.time()
+        try:
+            conn = connection_with(SCHEMA)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM idempotency WHERE expires_at < ?", (now,))
+                row = conn.execute(
+                    "SELECT fingerprint, status_code, body FROM idempotency WHERE key = ?", (self._key(key),)
+                ).fetchone()
+                if row is None:
+                    conn.execute(
+                        "INSERT INTO idempotency (key, fingerprint, expires_at) VALUES (?, ?, ?)",
+                        (self._key(key), request_fingerprint, now + self.pending_ttl)
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"Idempotency store failed, running the request without its key: {str(e)}")
+            return NEW, None
+
+        if row is None:
+            return NEW, None
+        stored_fingerprint, status_code, body = row
+        if stored_fingerprint != request_fingerprint:
+            return MISMATCH, None
+        if status_code is None:
+            return PENDING, None
+        return REPLAY, {"status_code": status_code, "body": json.loads(body)}
+
+    def complete(self, key: str, status_code: int, body: Any):
+        """Store the response of the request that claimed the key."""
+        try:
+            connection_with(SCHEMA).execute(
+                "UPDATE idempotency SET status_code = ?, body = ?, expires_at = ? WHERE key = ?",
+                (status_code, json.dumps(body, ensure_ascii=False), time.time() + self.ttl, self._key(key))
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to store the response for an idempotency key: {str(e)}")
+
+    def abandon(self, key: str):
+        """Release the key of a request that failed, so that a retry runs it again."""
+        try:
+            connection_with(SCHEMA).execute(
+                "DELETE FROM idempotency WHERE key = ? AND status_code IS NULL", (self._key(key),)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to release an idempotency key: {str(e)}")
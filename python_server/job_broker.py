@@ -0,0 +1,335 @@
+"""
+Analysis jobs behind a pluggable broker: the API processes enqueue, worker processes
+(analysis_worker.py) pull jobs, run the analysis pipeline and store the result for the API to serve.
+
+JOB_BROKER_URL selects the broker:
+    memory://            in-process queue; the API process runs the workers itself (tests, one
+                         server process)
+    redis://host:6379/0  Redis lists and hashes; needs the redis package. Any number of API and
+                         worker processes share the queue, all on one host: the submissions
+                         directory and the SQLite store (SHARED_CACHE_PATH) must be on its local
+                         disk, and a SHARED_CACHE_PATH on a network filesystem is refused
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, Tuple, Callable, Awaitable
+
+from priority_scheduler import PRIORITY_CLASSES, BATCH, WeightedRotation, priority_weights
+
+logger = logging.getLogger("proofmate.job_broker")
+
+job_broker_url = os.getenv("JOB_BROKER_URL", "memory://")
+# Concurrent jobs per worker process (each mostly waits for the model)
+job_worker_concurrency = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+# Finished jobs (and their results) are kept this long
+job_result_ttl = int(os.getenv("JOB_RESULT_TTL", str(24 * 3600)))
+# How long a worker blocks waiting for a job before checking whether it should stop
+job_claim_timeout = int(os.getenv("JOB_CLAIM_TIMEOUT", "1"))
+# A Redis worker checks the priority queues this often while they are all empty
+job_claim_poll_interval = float(os.getenv("JOB_CLAIM_POLL_INTERVAL", "0.2"))
+# Workers renew a heartbeat three times per this period; the jobs of one silent for longer are put back
+job_worker_heartbeat_ttl = int(os.getenv("JOB_WORKER_HEARTBEAT_TTL", "30"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+class InProcessBroker:
+    """
+    Jobs in queues of this process, one per priority class: a stand-in for Redis in tests and on
+    one box. Claims take from the classes in proportion to their weights (PRIORITY_WEIGHTS).
+    """
+
+    local = True
+
+    def __init__(self):
+        self._pending = {priority: deque() for priority in PRIORITY_CLASSES}
+        self._rotation = WeightedRotation(priority_weights)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+
+    def _expire(self, now):
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.get("finished_at") and now - job["finished_at"] > job_result_ttl]:
+            del self._jobs[job_id]
+
+    def enqueue(self, job_id: str, payload: Dict[str, Any], priority: str = BATCH):
+        now = time.time()
+        with self._ready:
+            self._expire(now)
+            self._jobs[job_id] = {
+                "job_id": job_id, "status": QUEUED, "priority": priority, "enqueued_at": now, "payload": payload
+            }
+            self._pending[priority].append(job_id)
+            self._ready.notify()
+
+    def claim(self, worker_id: str, timeout: float) -> Optional[Tuple[str, Dict[str, Any]]]:
+        with self._ready:
+            if not self._ready.wait_for(lambda: any(self._pending.values()), timeout):
+                return None
+            priority = self._rotation.pick([priority for priority in PRIORITY_CLASSES if self._pending[priority]])
+            job_id = self._pending[priority].popleft()
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(status=RUNNING, started_at=time.time(), worker=worker_id)
+            return job_id, job.pop("payload")
+
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(status=DONE, finished_at=time.time(), result=result)
+
+    def fail(self, job_id: str, worker_id: str, error: Dict[str, Any]):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(status=FAILED, finished_at=time.time(), error=error)
+
+    def cancel(self, job_id: str) -> bool:
+        """Drop a job that is still queued; returns whether it was."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != QUEUED:
+                return False
+            self._pending[job["priority"]].remove(job_id)
+            job.pop("payload", None)
+            job.update(status=CANCELLED, finished_at=time.time())
+            return True
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return {key: value for key, value in job.items() if key != "payload"} if job else None
+
+    def queue_depth(self, priority: Optional[str] = None) -> int:
+        with self._lock:
+            return sum(len(self._pending[name]) for name in PRIORITY_CLASSES if priority in (None, name))
+
+    def recover(self, worker_id: str) -> int:
+        return 0
+
+    def heartbeat(self, worker_id: str):
+        pass
+
+    def reap(self, worker_id: str) -> int:
+        return 0
+
+
+class RedisBroker:
+    """
+    Jobs in Redis: a pending list per priority class, one processing list per worker (a job is
+    moved there atomically when claimed) and a hash per job. Each worker takes from the classes
+    in proportion to their weights. Workers keep a heartbeat key alive; the jobs of a worker whose
+    heartbeat expired (it crashed, or was restarted under another ID) are put back by the others.
+    """
+
+    WORKERS_KEY = "proofmate:workers"
+
+    local = False
+
+    def __init__(self, url: str):
+        import redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self._rotation = WeightedRotation(priority_weights)
+
+    @staticmethod
+    def _pending_key(priority):
+        return f"proofmate:jobs:pending:{priority}"
+
+    @staticmethod
+    def _job_key(job_id):
+        return f"proofmate:job:{job_id}"
+
+    @staticmethod
+    def _processing_key(worker_id):
+        return f"proofmate:jobs:processing:{worker_id}"
+
+    @staticmethod
+    def _heartbeat_key(worker_id):
+        return f"proofmate:worker:{worker_id}:heartbeat"
+
+    def enqueue(self, job_id: str, payload: Dict[str, Any], priority: str = BATCH):
+        pipe = self.redis.pipeline()
+        pipe.hset(self._job_key(job_id), mapping={
+            "status": QUEUED, "priority": priority, "enqueued_at": time.time(),
+            "payload": json.dumps(payload, ensure_ascii=False)
+        })
+        pipe.lpush(self._pending_key(priority), job_id)
+        pipe.execute()
+
+    def _claim_next(self, worker_id):
+        pipe = self.redis.pipeline()
+        for priority in PRIORITY_CLASSES:
+            pipe.llen(self._pending_key(priority))
+        waiting = [priority for priority, depth in zip(PRIORITY_CLASSES, pipe.execute()) if depth]
+        if not waiting:
+            return None
+        # Another worker may take the last job first; the next round looks again
+        return self.redis.rpoplpush(self._pending_key(self._rotation.pick(waiting)), self._processing_key(worker_id))
+
+    def claim(self, worker_id: str, timeout: float) -> Optional[Tuple[str, Dict[str, Any]]]:
+        # A blocking pop serves one list only, so the priority lists are polled
+        deadline = time.monotonic() + timeout
+        job_id = self._claim_next(worker_id)
+        while job_id is None and time.monotonic() < deadline:
+            time.sleep(job_claim_poll_interval)
+            job_id = self._claim_next(worker_id)
+        if job_id is None:
+            return None
+        payload = self.redis.hget(self._job_key(job_id), "payload")
+        if payload is None:
+            self.redis.lrem(self._processing_key(worker_id), 1, job_id)
+            return None
+        self.redis.hset(self._job_key(job_id), mapping={"status": RUNNING, "started_at": time.time(), "worker": worker_id})
+        return job_id, json.loads(payload)
+
+    def _finish(self, job_id, worker_id, fields):
+        pipe = self.redis.pipeline()
+        pipe.hset(self._job_key(job_id), mapping={**fields, "finished_at": time.time()})
+        # The notebooks are not needed any more
+        pipe.hdel(self._job_key(job_id), "payload")
+        pipe.expire(self._job_key(job_id), job_result_ttl)
+        pipe.lrem(self._processing_key(worker_id), 1, job_id)
+        pipe.execute()
+
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]):
+        self._finish(job_id, worker_id, {"status": DONE, "result": json.dumps(result, ensure_ascii=False)})
+
+    def fail(self, job_id: str, worker_id: str, error: Dict[str, Any]):
+        self._finish(job_id, worker_id, {"status": FAILED, "error": json.dumps(error, ensure_ascii=False)})
+
+    def cancel(self, job_id: str) -> bool:
+        """Drop a job that is still queued; returns whether it was (a worker may have claimed it meanwhile)."""
+        priority = self.redis.hget(self._job_key(job_id), "priority") or BATCH
+        if not self.redis.lrem(self._pending_key(priority), 1, job_id):
+            return False
+        pipe = self.redis.pipeline()
+        pipe.hset(self._job_key(job_id), mapping={"status": CANCELLED, "finished_at": time.time()})
+        pipe.hdel(self._job_key(job_id), "payload")
+        pipe.expire(self._job_key(job_id), job_result_ttl)
+        pipe.execute()
+        return True
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        fields = self.redis.hgetall(self._job_key(job_id))
+        if not fields:
+            return None
+        job = {"job_id": job_id, "status": fields["status"], "priority": fields.get("priority", BATCH)}
+        for key in ("enqueued_at", "started_at", "finished_at"):
+            if key in fields:
+                job[key] = float(fields[key])
+        if "worker" in fields:
+            job["worker"] = fields["worker"]
+        for key in ("result", "error"):
+            if key in fields:
+                job[key] = json.loads(fields[key])
+        return job
+
+    def queue_depth(self, priority: Optional[str] = None) -> int:
+        pipe = self.redis.pipeline()
+        for name in PRIORITY_CLASSES:
+            if priority in (None, name):
+                pipe.llen(self._pending_key(name))
+        return sum(pipe.execute())
+
+    def recover(self, worker_id: str) -> int:
+        """Put back the jobs a previous run of this worker claimed but never finished, first in line of their class."""
+        recovered = 0
+        while True:
+            job_id = self.redis.rpop(self._processing_key(worker_id))
+            if job_id is None:
+                return recovered
+            priority = self.redis.hget(self._job_key(job_id), "priority") or BATCH
+            self.redis.rpush(self._pending_key(priority), job_id)
+            recovered += 1
+
+    def heartbeat(self, worker_id: str):
+        pipe = self.redis.pipeline()
+        pipe.sadd(self.WORKERS_KEY, worker_id)
+        pipe.set(self._heartbeat_key(worker_id), time.time(), ex=job_worker_heartbeat_ttl)
+        pipe.execute()
+
+    def reap(self, worker_id: str) -> int:
+        """Put back the unfinished jobs of the workers whose heartbeat has expired."""
+        recovered = 0
+        for other_id in self.redis.smembers(self.WORKERS_KEY):
+            if other_id == worker_id or self.redis.exists(self._heartbeat_key(other_id)):
+                continue
+            # Each job is popped by one reaper only, however many find the worker dead at once
+            count = self.recover(other_id)
+            if count:
+                logger.warning(f"Worker {other_id} stopped sending heartbeats, put back {count} of its jobs")
+            recovered += count
+            self.redis.srem(self.WORKERS_KEY, other_id)
+        return recovered
+
+
+def create_broker(url: Optional[str] = None):
+    url = url or job_broker_url
+    if url.startswith("memory://"):
+        return InProcessBroker()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported JOB_BROKER_URL: {url}")
+
+
+def job_error(error: Exception) -> Dict[str, Any]:
+    """What a failed job reports: the HTTP status and message the synchronous endpoint would have returned."""
+    return {
+        "status_code": getattr(error, "status_code", 500),
+        "detail": getattr(error, "detail", None) or f"Ошибка анализа: {str(error)}"
+    }
+
+
+async def process_jobs(broker, handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                       worker_id: str, concurrency: Optional[int] = None):
+    """
+    Run `concurrency` loops that claim jobs from the broker and pass their payloads to handler,
+    and a loop that keeps the worker's heartbeat alive and puts back the jobs of dead workers.
+    """
+    await asyncio.to_thread(broker.heartbeat, worker_id)
+    recovered = await asyncio.to_thread(broker.recover, worker_id)
+    if recovered:
+        logger.info(f"Worker {worker_id} put back {recovered} unfinished jobs")
+
+    async def heartbeat_loop():
+        while True:
+            await asyncio.sleep(job_worker_heartbeat_ttl / 3)
+            try:
+                await asyncio.to_thread(broker.heartbeat, worker_id)
+                await asyncio.to_thread(broker.reap, worker_id)
+            except Exception as e:
+                logger.warning(f"Worker {worker_id} heartbeat failed: {str(e)}")
+
+    async def claim_loop():
+        while True:
+            claimed = await asyncio.to_thread(broker.claim, worker_id, job_claim_timeout)
+            if claimed is None:
+                continue
+            job_id, payload = claimed
+            started = time.monotonic()
+            try:
+                result = await handler(payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {str(e)}")
+                await asyncio.to_thread(broker.fail, job_id, worker_id, job_error(e))
+                continue
+            await asyncio.to_thread(broker.complete, job_id, worker_id, result)
+            logger.info(f"Job {job_id} done in {time.monotonic() - started:.1f}s")
+
+    concurrency = concurrency or job_worker_concurrency
+    logger.info(f"Worker {worker_id} processing jobs with concurrency {concurrency}")
+    await asyncio.gather(heartbeat_loop(), *(claim_loop() for _ in range(concurrency)))
@@ -0,0 +1,41 @@
+import threading
+import logging
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger("proofmate.llm_usage")
+
+
+class UsageMetrics:
+    """Token usage reported by the API, including the prompt tokens served from the provider's prefix cache."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, usage: Optional[Dict[str, Any]]):
+        """Add the "usage" object of a chat completion response."""
+        if not usage:
+            return
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += usage.get("prompt_tokens") or 0
+            self.cached_tokens += cached
+            self.completion_tokens += usage.get("completion_tokens") or 0
+        logger.debug(f"Token usage: {usage.get('prompt_tokens')} prompt ({cached} cached), {usage.get('completion_tokens')} completion")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_prompt_tokens": self.cached_tokens,
+                "completion_tokens": self.completion_tokens,
+                "prompt_cache_hit_rate": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+            }
+
+
+usage_metrics = UsageMetrics()
@@ -0,0 +1,156 @@
+"""
+Local stand-in for an OpenAI-compatible batch API (/v1/files and /v1/batches), for testing
+the offline batch mode without a provider account.
+
+Each request of a batch is forwarded to LOCAL_BATCH_UPSTREAM (an OpenAI-compatible base URL)
+when it is set; otherwise it gets a fixed analysis in the format parse_ai_response expects.
+
+    python local_batch_server.py
+    OFFLINE_BATCH_API_BASE=http://localhost:8100 python main_functional.py
+"""
+import os
+import json
+import time
+import uuid
+import threading
+import requests
+import uvicorn
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi.responses import Response
+from pydantic import BaseModel
+from typing import Dict, Any, Optional
+
+storage_dir = os.path.abspath(os.getenv("LOCAL_BATCH_DIR", "local_batch_data"))
+upstream = os.getenv("LOCAL_BATCH_UPSTREAM")
+# Artificial delay per request, to exercise polling
+request_delay = float(os.getenv("LOCAL_BATCH_REQUEST_DELAY", "0"))
+
+app = FastAPI(title="ProofMate - Local Batch API")
+
+files: Dict[str, Dict[str, Any]] = {}
+batches: Dict[str, Dict[str, Any]] = {}
+lock = threading.Lock()
+
+STUB_RESPONSE = """## Краткое резюме
+Ответ локального пакетного сервера: решение проверено без обращения к модели.
+
+## Сильные стороны
+- Решение загружено и обработано
+
+## Области для улучшения
+- Требуется проверка настоящей моделью
+
+## Комментарии к ячейкам
+Ячейка 0: ответ сформирован локальным сервером
+
+## Оценка и уверенность
+Оценка: 5
+Уверенность: 0.5
+"""
+
+
+class BatchCreate(BaseModel):
+    input_file_id: str
+    endpoint: str
+    completion_window: str = "24h"
+    metadata: Optional[Dict[str, str]] = None
+
+
+def store_file(content: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+    file_id = f"file-{uuid.uuid4().hex[:24]}"
+    with open(os.path.join(storage_dir, file_id), "wb") as f:
+        f.write(content)
+    info = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+            "filename": filename, "purpose": purpose}
+    with lock:
+        files[file_id] = info
+    return info
+
+
+def complete(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Answer one chat completion request of a batch: upstream if configured, the stub otherwise."""
+    if upstream:
+        response = requests.post(
+            f"{upstream.rstrip('/')}/chat/completions", json=body, timeout=120,
+            headers={"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"}
+        )
+        return {"status_code": response.status_code, "body": response.json()}
+
+    prompt = body["messages"][-1]["content"]
+    return {"status_code": 200, "body": {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "model": body.get("model"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": STUB_RESPONSE}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": len(prompt) // 3, "completion_tokens": len(STUB_RESPONSE) // 3,
+                  "total_tokens": (len(prompt) + len(STUB_RESPONSE)) // 3}
+    }}
+
+
+def process_batch(batch_id: str):
+    batch = batches[batch_id]
+    with open(os.path.join(storage_dir, batch["input_file_id"]), "r", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+
+    batch.update(status="in_progress", in_progress_at=int(time.time()))
+    batch["request_counts"]["total"] = len(lines)
+    output, errors = [], []
+    for line in lines:
+        time.sleep(request_delay)
+        try:
+            response = complete(line["body"])
+            output.append({"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": line["custom_id"], "response": response, "error": None})
+            batch["request_counts"]["completed" if response["status_code"] == 200 else "failed"] += 1
+        except Exception as e:
+            errors.append({"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": line.get("custom_id"), "response": None,
+                           "error": {"code": "request_failed", "message": str(e)}})
+            batch["request_counts"]["failed"] += 1
+
+    batch["status"] = "finalizing"
+    batch["output_file_id"] = store_file("".join(json.dumps(r) + "\n" for r in output).encode("utf-8"), "output.jsonl", "batch_output")["id"]
+    if errors:
+        batch["error_file_id"] = store_file("".join(json.dumps(r) + "\n" for r in errors).encode("utf-8"), "errors.jsonl", "batch_output")["id"]
+    batch.update(status="completed", completed_at=int(time.time()))
+
+
+@app.post("/v1/files")
+async def upload_file(file: UploadFile = File(...), purpose: str = Form(...)):
+    return store_file(await file.read(), file.filename, purpose)
+
+
+@app.get("/v1/files/{file_id}/content")
+async def file_content(file_id: str):
+    if file_id not in files:
+        raise HTTPException(status_code=404, detail="No such file")
+    with open(os.path.join(storage_dir, file_id), "rb") as f:
+        return Response(content=f.read(), media_type="application/jsonl")
+
+
+@app.post("/v1/batches")
+async def create_batch(request: BatchCreate):
+    if request.input_file_id not in files:
+        raise HTTPException(status_code=404, detail="No such input file")
+    batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+    batch = {
+        "id": batch_id, "object": "batch", "endpoint": request.endpoint, "input_file_id": request.input_file_id,
+        "completion_window": request.completion_window, "status": "validating", "created_at": int(time.time()),
+        "output_file_id": None, "error_file_id": None, "metadata": request.metadata or {},
+        "request_counts": {"total": 0, "completed": 0, "failed": 0}
+    }
+    with lock:
+        batches[batch_id] = batch
+    threading.Thread(target=process_batch, args=(batch_id,), daemon=True).start()
+    return batch
+
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    if batch_id not in batches:
+        raise HTTPException(status_code=404, detail="No such batch")
+    return batches[batch_id]
+
+
+os.makedirs(storage_dir, exist_ok=True)
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("LOCAL_BATCH_PORT", "8100")))
@@ -0,0 +1,205 @@
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+import contextvars
+import multiprocessing
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional
+
+# Log file, rolled over at LOG_MAX_BYTES with LOG_BACKUP_COUNT old files kept
+log_file = os.getenv("LOG_FILE", "python_server_log.txt")
+log_max_bytes = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+log_backup_count = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# "json" writes one object per line, "text" the classic human-readable lines
+log_format = os.getenv("LOG_FORMAT", "json").lower()
+log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-logger levels, e.g. "proofmate.similarity_index=DEBUG,httpx=WARNING"
+log_levels = os.getenv("LOG_LEVELS", "httpx=WARNING")
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# IDs of the request and task being handled, attached to every record emitted on their behalf
+request_id_var = contextvars.ContextVar("request_id", default=None)
+task_id_var = contextvars.ContextVar("task_id", default=None)
+
+_listeners = []
+_handlers = []
+_process_queue = None
+# Set while the process is about to fork: listeners are created but not started
+_held = False
+
+
+class ContextFilter(logging.Filter):
+    """Stamp records with the request and task IDs of the code that emitted them."""
+
+    def filter(self, record):
+        if getattr(record, "request_id", None) is None:
+            record.request_id = request_id_var.get()
+        if getattr(record, "task_id", None) is None:
+            record.task_id = task_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "process": record.process,
+            "thread": record.threadName
+        }
+        for field in ("request_id", "task_id"):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without formatting or writing anything in the caller.
+    Unlike the stock QueueHandler, the traceback is kept apart from the message so that the
+    JSON formatter can put it in its own field.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+def apply_levels(root_level: str, levels: Dict[str, int]):
+    logging.getLogger().setLevel(root_level)
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+
+def install_queue_handler(log_queue):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = ContextQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    root.addHandler(handler)
+
+
+def configure_logging():
+    """
+    Route all logging through a queue: callers only enqueue records, a listener thread formats
+    them and writes to the console and the size-rotated log file. Safe to call more than once.
+    """
+    if _listeners:
+        return
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=log_max_bytes, backupCount=log_backup_count, encoding="utf-8"
+    )
+    console_handler = logging.StreamHandler(sys.stderr)
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+        _handlers.append(handler)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    if not _held:
+        listener.start()
+    _listeners.append(listener)
+
+    install_queue_handler(log_queue)
+    apply_levels(log_level, parse_levels(log_levels))
+    atexit.register(stop_logging)
+
+
+def process_log_queue():
+    """
+    Queue through which pool processes send their records to this process, where they are
+    written by the same handlers. Created (with its listener) on first use.
+    """
+    global _process_queue
+    if _process_queue is None:
+        _process_queue = multiprocessing.Queue()
+        if _handlers:
+            listener = logging.handlers.QueueListener(_process_queue, *_handlers, respect_handler_level=True)
+            if not _held:
+                listener.start()
+            _listeners.append(listener)
+    return _process_queue
+
+
+def init_worker_logging(log_queue):
+    """ProcessPoolExecutor initializer: log through the parent's queue instead of its files."""
+    install_queue_handler(log_queue)
+    apply_levels(log_level, parse_levels(log_levels))
+
+
+def hold_listeners():
+    """
+    Stop the listener threads until release_listeners(), for a process about to fork: a child
+    must not inherit a thread's locks. Records logged meanwhile wait in the queues.
+    """
+    global _held
+    _held = True
+    for listener in _listeners:
+        if listener._thread is not None:
+            listener.stop()
+
+
+def release_listeners():
+    """Start the listener threads again and write what was logged while they were held."""
+    global _held
+    _held = False
+    for listener in _listeners:
+        if listener._thread is None:
+            listener.start()
+
+
+def stop_logging():
+    """Flush the queued records and stop the listener threads."""
+    release_listeners()
+    while _listeners:
+        _listeners.pop().stop()
+
+
+def bind_log_context(request_id: Optional[str] = None, task_id: Optional[str] = None):
+    """Set the IDs attached to the records of the current request (and the tasks it starts)."""
+    if request_id is not None:
+        request_id_var.set(request_id)
+    if task_id is not None:
+        task_id_var.set(str(task_id))
+
+
+def log_context() -> Dict[str, Any]:
+    return {"request_id": request_id_var.get(), "task_id": task_id_var.get()}
+
+
+def call_with_log_context(context: Dict[str, Any], func, *args, **kwargs):
+    """Run func in a pool process with the log context of the request that submitted it."""
+    # Pool processes are reused across requests, so the IDs are always overwritten
+    request_id_var.set(context.get("request_id"))
+    task_id_var.set(context.get("task_id"))
+    return func(*args, **kwargs)
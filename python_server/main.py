@@ -15,6 +15,7 @@ from dotenv import load_dotenv
 import uvicorn
 import openai
 from fastapi.responses import JSONResponse
+from topic_classifier import get_topic_classifier
 
 # Setup logging
 logging.basicConfig(
@@ -101,27 +102,7 @@ def extract_code_cells(notebook: Dict[str, Any]) -> List[str]:
 
 # Helper function to detect mathematical topics
 def detect_topic(notebook: Dict[str, Any]) -> str:
-    text_content = ""
-    
-    # Extract all text from the notebook
-    for cell in notebook.cells:
-        text_content += cell.source + "\n"
-    
-    # Check for keywords related to different topics
-    text_content = text_content.lower()
-    
-    if any(kw in text_content for kw in ["matrix", "vector", "determinant", "eigenvalue", "linear system", "transformation", "basis", "span", "subspace", "orthogonal", "projection"]):
-        return "linear_algebra"
-    elif any(kw in text_content for kw in ["ellipse", "parabola", "hyperbola", "conic", "focus", "directrix", "eccentricity"]):
-        return "analytic_geometry"
-    elif any(kw in text_content for kw in ["derivative", "integral", "limit", "continuous", "differentiable", "extrema", "convergence", "series"]):
-        return "calculus"
-    elif any(kw in text_content for kw in ["probability", "random", "distribution", "expectation", "variance", "bayes", "hypothesis", "confidence"]):
-        return "probability"
-    elif any(kw in text_content for kw in ["graph", "vertex", "edge", "tree", "path", "connectivity", "cycle", "traversal"]):
-        return "graph_theory"
-    else:
-        return "general_mathematics"
+    return get_topic_classifier().classify(cell.source for cell in notebook.cells)
 
 # Helper function to extract custom error markers
 def extract_error_markers(notebook: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -16,6 +16,7 @@ import re
 import logging
 from datetime import datetime
 import io
+from topic_classifier import get_topic_classifier
 
 # Configure logging
 logging.basicConfig(
@@ -130,28 +131,7 @@ def extract_cells_from_notebook(notebook_content):
 
 def detect_math_topic(cells):
     """Detect the mathematical topic from notebook cells."""
-    # Join all cell contents for topic detection
-    full_content = " ".join([cell.get('content', '') for cell in cells])
-    
-    # Simple keyword-based topic detection
-    topics = {
-        'linear_algebra': ['matrix', 'vector', 'eigenvalue', 'eigenvector', 'determinant', 'linear system'],
-        'calculus': ['derivative', 'integral', 'limit', 'differential', 'integration'],
-        'geometry': ['ellipse', 'circle', 'parabola', 'hyperbola', 'conic section', 'triangle'],
-        'statistics': ['probability', 'distribution', 'mean', 'variance', 'regression', 'hypothesis'],
-        'number_theory': ['prime', 'divisor', 'modulo', 'congruence', 'diophantine']
-    }
-    
-    topic_counts = {}
-    for topic, keywords in topics.items():
-        count = sum(1 for keyword in keywords if keyword.lower() in full_content.lower())
-        topic_counts[topic] = count
-    
-    # Return the topic with the most keyword matches
-    if all(count == 0 for count in topic_counts.values()):
-        return "general_mathematics"
-    
-    return max(topic_counts.items(), key=lambda x: x[1])[0]
+    return get_topic_classifier().classify(cell.get('content', '') for cell in cells)
 
 def create_prompt_for_topic(topic, student_cells, reference_cells):
     """Create a specialized prompt based on the detected mathematical topic."""
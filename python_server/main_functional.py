@@ -1,67 +1,204 @@
 import os
 import json
-import nbformat
 import logging
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List, Dict, Any, Optional
-import uvicorn
 from pydantic import BaseModel
 from dotenv import load_dotenv
-import openai
-import requests
 import re
 import io
-import pandas as pd
+import numpy as np
 from fastapi.responses import Response
 from datetime import datetime
-import openpyxl
-from openpyxl.styles import PatternFill, Alignment
 import glob
 import uuid
 import shutil
+import hashlib
+import time
+import copy
+from urllib.parse import quote
+import asyncio
+import sqlite3
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("python_server_log.txt"),
-        logging.StreamHandler()
-    ]
+# Load environment variables (before the local modules, which read their settings on import)
+load_dotenv()
+
+from logging_setup import configure_logging, bind_log_context, log_context
+from llm_usage import usage_metrics
+from shared_cache import SharedCache, check_local_filesystem
+import task_events
+import submission_catalog
+from feedback_search import match_query
+from idempotency import (
+    IdempotencyStore, fingerprint, idempotency_ttl, idempotency_pending_ttl, max_key_length, NEW, REPLAY, MISMATCH
+)
+from job_broker import create_broker, new_job_id, process_jobs
+from priority_scheduler import (
+    PRIORITY_CLASSES, INTERACTIVE, BATCH, bind_priority, run_llm_call, llm_scheduler
+)
+from admission_control import admission, admission_overload_action, admission_max_job_queue
+from request_limits import RequestBodyLimit
+from deadlines import (
+    Cancelled, DEADLINE, analyze_deadline, open_scope, check_cancelled, call_timeout,
+    request_timeout, cancellation_guard, DisconnectWatcher
+)
+from offline_batch import (
+    BatchClient, batch_request_line, write_batch_file, iter_batch_results, offline_batch_poll_seconds,
+    batch_ledger, claim_ingestion, release_ingestion, unfinished_batches, STORING
+)
+from submission_packing import (
+    packing_enabled, is_small, plan_packs, split_packed_response, STUDENT_DELIMITER
+)
+from model_cascade import (
+    analysis_model, cascade_enabled, cascade_small_model, escalation_reasons, cascade_metrics
+)
+from error_highlighter import build_error_highlights
+from worker_pools import run_io, run_cpu, shutdown_pools
+from cluster_grading import submission_tokens, tfidf_vectors, cluster_submissions
+from notebook_executor import execute_notebooks, compare_executions, sandbox_isolated
+from symbolic_checker import check_task_answers
+from task_segmenter import split_into_tasks, align_tasks, cells_repr, merge_task_analyses, has_code
+from topic_classifier import get_topic_classifier
+from similarity_index import (
+    get_submission_index, index_submission, minhash_signature, code_cell_hashes, changed_cells, save_similarity_sidecar
 )
-logger = logging.getLogger("proofmate")
 
-# Load environment variables
-load_dotenv()
+# Configure logging: records are written by a background listener, JSON lines with rotation
+configure_logging()
+logger = logging.getLogger("proofmate")
 
 # Set OpenAI API key and base URL
 api_key = os.getenv("OPENAI_API_KEY")
 api_base = os.getenv("OPENAI_API_BASE")
 
-# Configure OpenAI client
-openai.api_key = api_key
-openai.base_url = api_base
-
 # Get other environment variables
 node_server_url = os.getenv("NODE_SERVER_URL", "http://localhost:5000")
 environment = os.getenv("ENVIRONMENT", "development")
 
-logger.info(f"OpenAI API Key: {api_key[:5]}...{api_key[-5:] if api_key else None}")
+if not api_key:
+    logger.warning("OPENAI_API_KEY is not set")
 logger.info(f"OpenAI Base URL: {api_base}")
 logger.info(f"Environment: {environment}")
 logger.info(f"Node Server URL: {node_server_url}")
 
+# Completions are streamed, so that a cancelled request stops the model mid-answer. Some
+# OpenAI-compatible proxies reject stream_options (or streaming): a 400 that names them makes
+# this process send the calls without them from then on
+llm_stream = os.getenv("LLM_STREAM", "true").lower() == "true"
+llm_stream_usage = llm_stream
+
+# Upload limits: request bodies are cut off while they are received (see request_limits), each
+# notebook is then read in chunks and hashed; batch uploads get their own, larger limit
+max_upload_bytes = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+max_batch_upload_bytes = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(500 * 1024 * 1024)))
+upload_chunk_size = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# Caches shared by all worker processes: model responses keyed by the content hashes of the
+# uploaded notebooks (or of the prompt), parsed reference notebooks and built Excel reports
+response_cache_size = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+reference_cache_size = int(os.getenv("REFERENCE_CACHE_SIZE", "64"))
+report_cache_size = int(os.getenv("REPORT_CACHE_SIZE", "16"))
+response_cache = SharedCache("response", response_cache_size)
+reference_cache = SharedCache("reference", reference_cache_size)
+report_cache = SharedCache("report", report_cache_size)
+# Responses of /api/analyze by Idempotency-Key, so that client retries do not analyze again
+analyze_idempotency = IdempotencyStore("analyze", idempotency_ttl, idempotency_pending_ttl)
+idempotency_poll_interval = float(os.getenv("IDEMPOTENCY_POLL_INTERVAL", "0.5"))
+
+# Near-duplicate submissions reuse an earlier analysis of the same task
+near_duplicate_threshold = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.9"))
+near_duplicate_max_changed_cells = int(os.getenv("NEAR_DUPLICATE_MAX_CHANGED_CELLS", "3"))
+similarity_report_threshold = float(os.getenv("SIMILARITY_REPORT_THRESHOLD", "0.8"))
+
+# Sandboxed execution of student and reference code as a deterministic pre-grader
+execution_enabled = os.getenv("EXECUTION_ENABLED", "false").lower() == "true"
+# Grading by matching results alone trusts the run, so it needs the confined sandbox
+execution_fast_path = os.getenv("EXECUTION_FAST_PATH", "true").lower() == "true" and sandbox_isolated()
+
+# Multi-task notebooks are analyzed task by task, with the LLM calls running concurrently
+task_segmentation_enabled = os.getenv("TASK_SEGMENTATION", "true").lower() == "true"
+task_llm_concurrency = int(os.getenv("TASK_LLM_CONCURRENCY", "8"))
+
+# Resubmissions of the same student re-analyze only what changed since the previous submission
+incremental_reanalysis_enabled = os.getenv("INCREMENTAL_REANALYSIS", "true").lower() == "true"
+resubmission_max_changed_cells = int(os.getenv("RESUBMISSION_MAX_CHANGED_CELLS", "5"))
+
+# Analysis jobs: queued on the broker (JOB_BROKER_URL) and run by worker processes; with the
+# in-process broker this process runs them itself
+job_broker = create_broker()
+local_job_workers = []
+# With a remote broker /api/analyze enqueues too and waits for the result this long
+analyze_job_timeout = float(os.getenv("ANALYZE_JOB_TIMEOUT", "300"))
+job_poll_interval = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
+# Batch grading: full analysis only for one representative per solution cluster
+batch_cluster_threshold = float(os.getenv("BATCH_CLUSTER_THRESHOLD", "0.8"))
+batch_llm_concurrency = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+
 app = FastAPI(title="ProofMate - Notebook Analysis API")
 
-# Configure CORS
+# Lets a running analysis (or an event subscription) notice that its client has gone
+app.add_middleware(DisconnectWatcher, paths=[r"/api/analyze", r"/api/tasks/[^/]+/events"])
+
+@app.middleware("http")
+async def admit_analysis_requests(request, call_next):
+    """
+    Shed /api/analyze requests this process cannot serve in time, before their uploads are read:
+    503 with Retry-After, or (Prefer: respond-async, ADMISSION_OVERLOAD_ACTION=job) a queued job.
+    """
+    if request.method != "POST" or request.url.path != "/api/analyze":
+        return await call_next(request)
+    
+    admitted, load = admission.try_admit(llm_scheduler.waiting(INTERACTIVE))
+    if admitted:
+        try:
+            return await call_next(request)
+        finally:
+            admission.release()
+    
+    if admission_overload_action == "job" or "respond-async" in request.headers.get("prefer", ""):
+        logger.warning(f"Overloaded ({', '.join(load['reasons'])}), queueing the analysis as a job")
+        admission.count_redirect()
+        request.state.run_as_job = True
+        return await call_next(request)
+    
+    retry_after = admission.retry_after(load["llm_waiting"], llm_scheduler.capacity)
+    logger.warning(f"Overloaded ({', '.join(load['reasons'])}), rejecting the analysis request")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Сервер перегружен, повторите попытку позже", "retry_after": retry_after},
+        headers={"Retry-After": str(retry_after)}
+    )
+
+# Two notebooks plus multipart overhead for the single analyses, the batch limit for the batches
+app.add_middleware(RequestBodyLimit, limits={
+    r"/api/analyze": 2 * max_upload_bytes + 64 * 1024,
+    r"/api/jobs/analyze": 2 * max_upload_bytes + 64 * 1024,
+    r"/api/batch-analyze": max_batch_upload_bytes,
+    r"/api/tasks/[^/]+/offline-batch": max_batch_upload_bytes,
+})
+
+# Registered after the limits, so it runs before them and the records of the other middleware carry the ID too
+@app.middleware("http")
+async def bind_request_id(request, call_next):
+    """Tag the log records of a request with its ID (the caller's X-Request-ID, if any) and echo it back."""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    bind_log_context(request_id=request_id)
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+# Configure CORS. Outermost, so the responses the other middleware answer with themselves
+# (503, 413) get CORS headers too; the exposed headers are those a browser client needs to read
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "Location", "X-Request-ID", "Idempotent-Replayed", "Content-Disposition"],
 )
 
 # Models
@@ -83,9 +220,13 @@ class AnalysisResult(BaseModel):
 
 # Utility functions
 def extract_cells_from_notebook(notebook_content):
-    """Parse notebook and extract cells with their content and metadata."""
+    """Parse notebook (already decoded text or raw bytes) and extract cells with their content and metadata."""
     try:
-        nb = nbformat.reads(notebook_content.decode('utf-8'), as_version=4)
+        if isinstance(notebook_content, (bytes, bytearray)):
+            notebook_content = notebook_content.decode('utf-8')
+        import nbformat
+        
+        nb = nbformat.reads(notebook_content, as_version=4)
         cells = []
         
         for i, cell in enumerate(nb.cells):
@@ -110,95 +251,262 @@ def extract_cells_from_notebook(notebook_content):
 
 def detect_math_topic(cells):
     """Detect the mathematical topic from notebook cells."""
-    full_content = " ".join([cell.get('content', '') for cell in cells])
-    
-    topics = {
-        'linear_algebra': ['matrix', 'vector', 'eigenvalue', 'eigenvector', 'determinant', 'linear system'],
-        'calculus': ['derivative', 'integral', 'limit', 'differential', 'integration'],
-        'geometry': ['ellipse', 'circle', 'parabola', 'hyperbola', 'conic section'],
-        'statistics': ['probability', 'distribution', 'mean', 'variance', 'regression'],
-        'number_theory': ['prime', 'divisor', 'modulo', 'congruence', 'diophantine']
-    }
-    
-    topic_counts = {}
-    for topic, keywords in topics.items():
-        count = sum(1 for keyword in keywords if keyword.lower() in full_content.lower())
-        topic_counts[topic] = count
-    
-    if all(count == 0 for count in topic_counts.values()):
-        return "general_mathematics"
+    return get_topic_classifier().classify(cell.get('content', '') for cell in cells)
+
+# Prompts are laid out as static instructions -> reference -> student submission, with fixed
+# formatting, so that all analyses of one task share a long identical prefix the provider can cache
+ANALYSIS_SYSTEM_PROMPT = "Вы ИИ-ассистент, который анализирует математические решения в Jupyter ноутбуках."
+
+TOPIC_INSTRUCTIONS = {
+    'linear_algebra': "Обрати внимание на операции с матрицами, векторные пространства, собственные значения/векторы и линейные преобразования.",
+    'calculus': "Обрати внимание на вычисление производных, техники интегрирования, вычисление пределов и их применение.",
+    'geometry': "Обрати внимание на конические сечения, координатную геометрию, преобразования и геометрические построения.",
+    'statistics': "Обрати внимание на анализ данных, вероятностные расчеты, проверку гипотез и статистическое моделирование.",
+    'number_theory': "Обрати внимание на простые числа, делимость, модульную арифметику и алгебраические структуры.",
+    'general_mathematics': "Обрати внимание на правильность вычислений, математические рассуждения и реализацию алгоритмов."
+}
+
+ANALYSIS_INSTRUCTIONS = """Ты профессиональный математик и преподаватель, который анализирует работу студента.
+Ниже даны эталонное решение и решение студента. Проанализируй решение студента по сравнению с эталонным решением и предоставь детальный анализ по следующей структуре на русском языке:
+
+## Краткое резюме
+[Дай краткое и конкретное резюме об общем качестве решения и основных проблемах]
+
+## Сильные стороны
+[Перечисли 3-5 конкретных сильных сторон решения, каждый пункт должен быть уникальным]
+- Пункт 1
+- Пункт 2
+- и т.д.
+
+## Области для улучшения
+[Перечисли 3-5 конкретных слабых сторон или ошибок, каждый пункт должен быть уникальным]
+- Пункт 1
+- Пункт 2
+- и т.д.
+
+## Рекомендации
+[Перечисли 3-5 конкретных предложений по улучшению, каждый пункт должен быть уникальным]
+- Пункт 1
+- Пункт 2
+- и т.д.
+
+## Комментарии к ячейкам
+[Для каждой ячейки с проблемами дай конкретный комментарий о проблеме и как её решить]
+Ячейка X: [конкретный комментарий для ячейки X]
+Ячейка Y: [конкретный комментарий для ячейки Y]
+и т.д.
+
+## Оценка и уверенность
+Оценка: [Поставь оценку от 0 до 10, где 10 - идеальное решение]
+Уверенность: [Укажи уровень уверенности от 0 до 1, где 1 - полная уверенность]
+
+ВАЖНО:
+1. Каждый пункт в разделах "Сильные стороны", "Области для улучшения" и "Рекомендации" должен быть уникальным - НЕ ПОВТОРЯЙ одну и ту же мысль разными словами.
+2. Обязательно используй формат списков с тире (-) для всех перечислений.
+3. Давай конкретные и полезные комментарии для каждой проблемной ячейки.
+4. Отвечай ТОЛЬКО на русском языке.
+5. Следуй дополнительным указаниям, данным после решения студента."""
+
+DELTA_INSTRUCTIONS = """Ты профессиональный математик и преподаватель, который анализирует работу студента.
+Почти идентичное решение уже было проверено. Ниже даны эталонное решение, результаты предыдущей проверки и ячейки решения студента, которые отличаются от проверенного решения.
+Проанализируй ТОЛЬКО эти ячейки по сравнению с эталонным решением и скорректируй итоговую оценку всего решения.
+Используй следующую структуру на русском языке:
+
+## Краткое резюме
+[Кратко опиши, как изменения влияют на качество решения]
+
+## Сильные стороны
+- Пункт 1
+
+## Области для улучшения
+- Пункт 1
+
+## Рекомендации
+- Пункт 1
+
+## Комментарии к ячейкам
+Ячейка X: [конкретный комментарий для ячейки X]
+
+## Оценка и уверенность
+Оценка: [итоговая оценка всего решения от 0 до 10]
+Уверенность: [уровень уверенности от 0 до 1]"""
+
+def reference_block(reference_nb_repr):
+    return f"# Эталонное решение:\n```python\n{reference_nb_repr}\n```"
+
+def create_prompt_for_analysis(topic, reference_nb_repr, student_nb_repr, verification_notes=""):
+    """
+    Create the analysis prompt: static instructions, then the reference, then the student's
+    solution with the topic-specific and per-submission notes.
+    """
+    notes = "\n".join(part.strip() for part in [
+        TOPIC_INSTRUCTIONS.get(topic, TOPIC_INSTRUCTIONS['general_mathematics']), verification_notes
+    ] if part and part.strip())
     
-    return max(topic_counts.items(), key=lambda x: x[1])[0]
+    return (
+        f"{ANALYSIS_INSTRUCTIONS}\n\n"
+        f"{reference_block(reference_nb_repr)}\n\n"
+        f"# Решение студента:\n```python\n{student_nb_repr}\n```\n\n"
+        f"# Дополнительные указания:\n{notes}\n"
+    )
 
-def create_prompt_for_analysis(topic, reference_nb_repr, student_nb_repr):
-    """Create a specialized prompt based on the detected mathematical topic."""
+def describe_execution_check(execution_check, symbolic_check=None):
+    """Summarize the sandboxed execution and symbolic checks for the analysis prompt."""
+    lines = []
+    if execution_check and execution_check["checked_cells"]:
+        lines.append(f"Автоматическая проверка выполнения: сравнено ячеек с эталоном - {len(execution_check['checked_cells'])}.")
+        if execution_check["mismatched_cells"]:
+            lines.append(f"Результаты отличаются от эталонных в ячейках: {', '.join(map(str, execution_check['mismatched_cells']))}.")
+        if execution_check["failed_cells"]:
+            lines.append(f"Ячейки завершились ошибкой или не дали результата: {', '.join(map(str, execution_check['failed_cells']))}.")
+        if execution_check["all_match"]:
+            lines.append("Все проверенные результаты совпадают с эталонными.")
+        if execution_check["verified_tasks"]:
+            lines.append(f"Результаты подтверждены автоматически: {', '.join(label or 'всё решение' for label in execution_check['verified_tasks'])}.")
+        if execution_check["unchecked_tasks"]:
+            lines.append(f"Не проверены автоматически (нет числового результата в эталоне): "
+                         f"{', '.join(label or 'всё решение' for label in execution_check['unchecked_tasks'])}.")
     
-    topic_specific_instructions = {
-        'linear_algebra': "Обрати внимание на операции с матрицами, векторные пространства, собственные значения/векторы и линейные преобразования.",
-        'calculus': "Обрати внимание на вычисление производных, техники интегрирования, вычисление пределов и их применение.",
-        'geometry': "Обрати внимание на конические сечения, координатную геометрию, преобразования и геометрические построения.",
-        'statistics': "Обрати внимание на анализ данных, вероятностные расчеты, проверку гипотез и статистическое моделирование.",
-        'number_theory': "Обрати внимание на простые числа, делимость, модульную арифметику и алгебраические структуры.",
-        'general_mathematics': "Обрати внимание на правильность вычислений, математические рассуждения и реализацию алгоритмов."
+    verdict_texts = {
+        "identical": "ответ совпадает с эталонным",
+        "equivalent": "ответ математически эквивалентен эталонному, но записан в другой форме",
+        "different": "ответ НЕ совпадает с эталонным",
+        "missing": "ответ не найден",
+        "unknown": "автоматически сравнить не удалось"
     }
-    
-    return f"""
-    Ты профессиональный математик и преподаватель, который анализирует работу студента.
-    {topic_specific_instructions.get(topic, topic_specific_instructions['general_mathematics'])}
-    
-    # Эталонное решение:
-    ```python
-    {reference_nb_repr}
-    ```
-    
-    # Решение студента:
-    ```python
-    {student_nb_repr}
-    ```
-    
-    Проанализируй решение студента по сравнению с эталонным решением и предоставь детальный анализ по следующей структуре на русском языке:
-
-    ## Краткое резюме
-    [Дай краткое и конкретное резюме об общем качестве решения и основных проблемах]
-
-    ## Сильные стороны
-    [Перечисли 3-5 конкретных сильных сторон решения, каждый пункт должен быть уникальным]
-    - Пункт 1
-    - Пункт 2
-    - и т.д.
+    if symbolic_check and symbolic_check["tasks"]:
+        lines.append("Символьная проверка ответов (SymPy):")
+        for task in symbolic_check["tasks"]:
+            cell = f" (ячейка {task['cell_index']})" if task["cell_index"] is not None else ""
+            lines.append(f"- {task['task']}{cell}: {verdict_texts.get(task['verdict'], task['verdict'])}")
+    if symbolic_check and symbolic_check["unchecked_tasks"]:
+        lines.append(f"Символьно не проверялись (в эталоне нет итогового выражения): {', '.join(symbolic_check['unchecked_tasks'])}.")
+    return "\n".join(lines)
 
-    ## Области для улучшения
-    [Перечисли 3-5 конкретных слабых сторон или ошибок, каждый пункт должен быть уникальным]
-    - Пункт 1
-    - Пункт 2
-    - и т.д.
+def build_verified_analysis(execution_check, symbolic_check=None):
+    """Analysis for a submission whose computed results all match the reference, produced without an LLM call."""
+    if symbolic_check and symbolic_check["all_identical"]:
+        checked = len(symbolic_check["tasks"])
+    else:
+        checked = len(execution_check["checked_cells"])
+    return {
+        "error_summary": f"Автоматическая проверка: все вычисленные результаты ({checked}) совпадают с эталонным решением.",
+        "detailed_feedback": {
+            "strengths": [f"Результаты всех проверенных ячеек ({checked}) совпадают с эталонными"],
+            "weaknesses": [],
+            "suggestions": ["Ознакомьтесь с эталонным решением, чтобы сравнить подходы"]
+        },
+        "confidence_score": 1.0,
+        "grade": 10.0,
+        "cell_annotations": []
+    }
 
-    ## Рекомендации
-    [Перечисли 3-5 конкретных предложений по улучшению, каждый пункт должен быть уникальным]
-    - Пункт 1
-    - Пункт 2
-    - и т.д.
+def create_packed_prompt(topic, reference_nb_repr, student_reprs):
+    """
+    Create one prompt that grades several small submissions against the reference sent once.
+    Keeps the layout of create_prompt_for_analysis so the cached prefix is shared with single prompts.
+    """
+    students = "\n\n".join(
+        f"{STUDENT_DELIMITER.format(number=number)}\n```python\n{student_repr}\n```"
+        for number, student_repr in enumerate(student_reprs, start=1)
+    )
+    notes = "\n".join([
+        TOPIC_INSTRUCTIONS.get(topic, TOPIC_INSTRUCTIONS['general_mathematics']),
+        f"Даны решения {len(student_reprs)} разных студентов. Оценивай каждое решение независимо от остальных.",
+        f"Ответь отдельно для каждого студента: начни ответ для студента N со строки \"{STUDENT_DELIMITER.format(number='N')}\" "
+        f"и дай для него полный анализ по структуре выше. Номера ячеек указывай как в решении этого студента."
+    ])
+    
+    return (
+        f"{ANALYSIS_INSTRUCTIONS}\n\n"
+        f"{reference_block(reference_nb_repr)}\n\n"
+        f"# Решения студентов:\n{students}\n\n"
+        f"# Дополнительные указания:\n{notes}\n"
+    )
 
-    ## Комментарии к ячейкам
-    [Для каждой ячейки с проблемами дай конкретный комментарий о проблеме и как её решить]
-    Ячейка X: [конкретный комментарий для ячейки X]
-    Ячейка Y: [конкретный комментарий для ячейки Y]
-    и т.д.
+def create_delta_prompt(topic, reference_nb_repr, base_analysis, changed_student_cells, verification_notes=""):
+    """
+    Create a prompt that re-checks only the cells in which a submission differs
+    from an already analyzed near-identical one. Laid out like create_prompt_for_analysis.
+    """
+    changed_repr = "\n\n".join(
+        f"Ячейка {cell['index']}:\n{cell.get('content', '')}" for cell in changed_student_cells
+    )
+    base_weaknesses = "\n".join(f"- {w}" for w in base_analysis.get("detailed_feedback", {}).get("weaknesses", []))
+    notes = "\n".join(part.strip() for part in [f"Тема: {topic}.", verification_notes] if part and part.strip())
+    
+    return (
+        f"{DELTA_INSTRUCTIONS}\n\n"
+        f"{reference_block(reference_nb_repr)}\n\n"
+        f"# Предыдущая проверка:\n"
+        f"Оценка: {base_analysis.get('grade', 0)}\n"
+        f"Резюме: {base_analysis.get('error_summary', '')}\n"
+        f"Найденные ранее недостатки:\n{base_weaknesses or '- нет'}\n\n"
+        f"# Ячейки решения студента, которые отличаются от проверенного решения:\n```python\n{changed_repr}\n```\n\n"
+        f"# Дополнительные указания:\n{notes}\n"
+    )
 
-    ## Оценка и уверенность
-    Оценка: [Поставь оценку от 0 до 10, где 10 - идеальное решение]
-    Уверенность: [Укажи уровень уверенности от 0 до 1, где 1 - полная уверенность]
+def merge_delta_analysis(base_analysis, delta_analysis, changed_indices):
+    """Merge a delta analysis of the changed cells into the analysis of the base submission."""
+    merged = copy.deepcopy(base_analysis)
+    merged["error_summary"] = delta_analysis["error_summary"]
+    merged["grade"] = delta_analysis["grade"]
+    merged["confidence_score"] = min(base_analysis.get("confidence_score", 1.0), delta_analysis["confidence_score"])
+    
+    # New findings first, then the earlier ones that are not repeated
+    for key in ["strengths", "weaknesses", "suggestions"]:
+        items = []
+        seen = set()
+        for item in delta_analysis["detailed_feedback"].get(key, []) + base_analysis.get("detailed_feedback", {}).get(key, []):
+            normalized = item.lower().strip()
+            if normalized not in seen:
+                items.append(item)
+                seen.add(normalized)
+        merged["detailed_feedback"][key] = items[:5]
+    
+    # Annotations of unchanged cells stay valid, changed cells get the new ones
+    changed = set(changed_indices)
+    merged["cell_annotations"] = [
+        annotation for annotation in base_analysis.get("cell_annotations", [])
+        if annotation.get("cell_index") not in changed
+    ] + [
+        annotation for annotation in delta_analysis["cell_annotations"]
+        if annotation.get("cell_index") in changed
+    ]
+    merged["cell_annotations"].sort(key=lambda x: x.get("cell_index", 0))
+    return merged
 
-    ВАЖНО: 
-    1. Каждый пункт в разделах "Сильные стороны", "Области для улучшения" и "Рекомендации" должен быть уникальным - НЕ ПОВТОРЯЙ одну и ту же мысль разными словами.
-    2. Обязательно используй формат списков с тире (-) для всех перечислений.
-    3. Давай конкретные и полезные комментарии для каждой проблемной ячейки.
-    4. Отвечай ТОЛЬКО на русском языке.
+def remap_cell_annotations(analysis, old_indices, new_indices):
     """
+    Copy an analysis with its cell annotations moved from old to new notebook cell indices,
+    aligned by position. Annotations of old cells without a counterpart are dropped.
+    """
+    remapped = copy.deepcopy(analysis)
+    index_map = dict(zip(old_indices, new_indices))
+    removed = set(old_indices[len(new_indices):])
+    remapped["cell_annotations"] = [
+        {**annotation, "cell_index": index_map.get(annotation.get("cell_index"), annotation.get("cell_index"))}
+        for annotation in analysis.get("cell_annotations", [])
+        if annotation.get("cell_index") not in removed
+    ]
+    remapped["cell_annotations"].sort(key=lambda x: x.get("cell_index", 0))
+    return remapped
+
+def extract_scores(response_text):
+    """The grade and confidence the response actually states; a field it does not state is left out."""
+    scores = {}
+    # Support both English and Russian patterns
+    grade_match = re.search(r'(?:grade|оценка):?\s*(\d+(?:\.\d+)?)', response_text, re.IGNORECASE)
+    if grade_match:
+        scores["grade"] = float(grade_match.group(1))
+    confidence_match = re.search(r'(?:confidence|уверенность):?\s*(\d+(?:\.\d+)?)', response_text, re.IGNORECASE)
+    if confidence_match:
+        scores["confidence"] = float(confidence_match.group(1))
+    return scores
 
 def parse_ai_response(response_text):
     """Parse the AI response into structured feedback."""
-    logger.info("Parsing AI response")
+    logger.debug("Parsing AI response")
     
     # Extract summary - use the first paragraph that's not empty
     paragraphs = [p.strip() for p in response_text.split('\n\n') if p.strip()]
@@ -208,13 +516,10 @@ def parse_ai_response(response_text):
         # First paragraph might be too short, try the next one
         error_summary = paragraphs[1]
     
-    # Try to extract grade - support both English and Russian patterns
-    grade_match = re.search(r'(?:grade|оценка):?\s*(\d+(?:\.\d+)?)', response_text, re.IGNORECASE)
-    grade = float(grade_match.group(1)) if grade_match else 7.5  # Default grade
-    
-    # Try to extract confidence - support both English and Russian patterns
-    confidence_match = re.search(r'(?:confidence|уверенность):?\s*(\d+(?:\.\d+)?)', response_text, re.IGNORECASE)
-    confidence = float(confidence_match.group(1)) if confidence_match else 0.9  # Default confidence
+    # Grade and confidence, with defaults for what the response does not state
+    scores = extract_scores(response_text)
+    grade = scores.get("grade", 7.5)  # Default grade
+    confidence = scores.get("confidence", 0.9)  # Default confidence
     
     # Extract strengths - use unified set of patterns for Russian and English
     strengths = []
@@ -435,6 +740,8 @@ def call_openai_api_alternative(prompt, model="gpt-4o"):
     """
     Alternative method to call OpenAI API using requests library directly.
     """
+    import requests
+    
     api_key = os.getenv("OPENAI_API_KEY")
     base_url = os.getenv("OPENAI_API_BASE")
     
@@ -450,7 +757,7 @@ def call_openai_api_alternative(prompt, model="gpt-4o"):
     payload = {
         "model": model,
         "messages": [
-            {"role": "system", "content": "You are an AI assistant that analyzes Jupyter notebooks for mathematical problems."},
+            {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ],
         "temperature": 0.3
@@ -460,27 +767,452 @@ def call_openai_api_alternative(prompt, model="gpt-4o"):
         logger.info(f"Using alternative method to call OpenAI API with model: {model}")
         # Fix: Make sure to add a slash between base URL and chat/completions
         api_endpoint = f"{base_url}/chat/completions"
-        logger.info(f"API endpoint: {api_endpoint}")
+        logger.debug(f"API endpoint: {api_endpoint}")
         
-        response = requests.post(
-            api_endpoint, 
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
+        response = post_completion(requests, api_endpoint, headers, payload)
         
         if response.status_code == 200:
-            result = response.json()
-            content = result["choices"][0]["message"]["content"]
+            if payload.get("stream"):
+                content, usage = read_completion_stream(response)
+            else:
+                result = response.json()
+                content, usage = result["choices"][0]["message"]["content"], result.get("usage")
+            usage_metrics.record(usage)
             logger.info(f"✅ Alternative method successful")
             return content
         else:
             logger.error(f"❌ Alternative method failed with status {response.status_code}: {response.text}")
             return None
+    except Cancelled:
+        raise
     except Exception as e:
+        # A read timed out at the request's deadline
+        check_cancelled()
         logger.error(f"❌ Alternative method exception: {str(e)}")
         return None
 
+def post_completion(requests, api_endpoint, headers, payload):
+    """
+    POST a chat completion, streamed as far as the endpoint allows: a 400 about stream_options
+    (or streaming) is retried without them, and the process does without them from then on.
+    """
+    global llm_stream, llm_stream_usage
+    while True:
+        payload.pop("stream", None)
+        payload.pop("stream_options", None)
+        if llm_stream:
+            payload["stream"] = True
+        if llm_stream and llm_stream_usage:
+            payload["stream_options"] = {"include_usage": True}
+        response = requests.post(api_endpoint, headers=headers, json=payload, timeout=call_timeout(30), stream=llm_stream)
+        if response.status_code != 400 or not llm_stream or "stream" not in response.text:
+            return response
+        response.close()
+        if llm_stream_usage:
+            logger.warning("The completions endpoint rejected stream_options, streaming without usage reports")
+            llm_stream_usage = False
+        else:
+            logger.warning("The completions endpoint rejected streaming, calling it without")
+            llm_stream = False
+
+def read_completion_stream(response):
+    """
+    Collect a streamed chat completion (server-sent events). Between chunks the request's scope is
+    checked: a cancelled request closes the connection, which stops the generation upstream.
+    Returns (content, usage).
+    """
+    parts = []
+    usage = None
+    try:
+        # Small reads: a stream without chunked encoding would otherwise be read to its end at once
+        for line in response.iter_lines(chunk_size=128, decode_unicode=True):
+            check_cancelled()
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            usage = chunk.get("usage") or usage
+            for choice in chunk.get("choices") or []:
+                parts.append((choice.get("delta") or {}).get("content") or "")
+    except Cancelled as e:
+        logger.info(f"Model call stopped after {len(parts)} chunks: {e.reason}")
+        raise
+    finally:
+        response.close()
+    return "".join(parts), usage
+
+async def read_upload_streaming(upload: UploadFile, max_bytes: int = None):
+    """
+    Read an uploaded notebook in chunks, hashing it as it goes, with a limit per file (413).
+    The form has been spooled by then: the limit that stops a large upload while it arrives is
+    RequestBodyLimit's. Returns the decoded text and its SHA-256 hex digest.
+    """
+    limit = max_bytes or max_upload_bytes
+    
+    # The client-declared size lets us fail before reading anything
+    if upload.size is not None and upload.size > limit:
+        logger.warning(f"Upload {upload.filename} declared {upload.size} bytes, limit is {limit}")
+        raise HTTPException(status_code=413, detail=f"Файл {upload.filename} превышает допустимый размер ({limit} байт)")
+    
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    while True:
+        chunk = await upload.read(upload_chunk_size)
+        if not chunk:
+            break
+        if len(buffer) + len(chunk) > limit:
+            logger.warning(f"Upload {upload.filename} exceeded {limit} bytes while streaming")
+            raise HTTPException(status_code=413, detail=f"Файл {upload.filename} превышает допустимый размер ({limit} байт)")
+        digest.update(chunk)
+        buffer.extend(chunk)
+    
+    try:
+        text = buffer.decode('utf-8')
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail=f"Файл {upload.filename} не является текстом в кодировке UTF-8")
+    
+    return text, digest.hexdigest()
+
+def get_cached_response(cache_key):
+    """Return the cached model response for the given content hashes, if any."""
+    return response_cache.get(cache_key)
+
+def store_cached_response(cache_key, analysis_result):
+    """Remember a model response, evicting the least recently used entries."""
+    response_cache.set(cache_key, analysis_result)
+
+def openai_sdk():
+    """The SDK is only the fallback path and slow to import, so it is loaded and configured on first use."""
+    import openai
+    
+    openai.api_key = api_key
+    openai.base_url = api_base
+    return openai
+
+def preload_app_state():
+    """
+    Load what requests otherwise load on first use: the notebook, report and SDK libraries and
+    the topic taxonomy. The production launcher calls it once before forking its workers,
+    so they start warm and share these pages.
+    """
+    import nbformat
+    import pandas
+    import openpyxl
+    
+    openai_sdk()
+    get_topic_classifier()
+    logger.info("Preloaded notebook, report and SDK libraries and the topic taxonomy")
+
+def complete_with_model(prompt, model):
+    """
+    Get the model response for an analysis prompt: direct HTTP request first,
+    the OpenAI SDK as fallback. Returns None if both fail.
+    """
+    # Use the direct HTTP method as it's known to work
+    logger.info(f"Calling OpenAI API ({model}) using direct HTTP request...")
+    ai_response = call_openai_api_alternative(prompt, model)
+    if ai_response:
+        return ai_response
+    
+    # If direct method fails, try the SDK as fallback
+    check_cancelled()
+    logger.info("Direct HTTP request failed, trying SDK as fallback...")
+    try:
+        openai = openai_sdk()
+        response = openai.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.5,
+            max_tokens=4000,
+            timeout=call_timeout(600)
+        )
+        
+        ai_response = response.choices[0].message.content
+        usage_metrics.record(response.usage.model_dump() if response.usage else None)
+        logger.info("OpenAI API call successful via SDK")
+        return ai_response
+    except Cancelled:
+        raise
+    except Exception as e:
+        logger.error(f"Both API call methods failed for {model}: {str(e)}")
+        return None
+
+def answer_escalation_reasons(answer, execution_check=None, symbolic_check=None):
+    """Escalation reasons of one analysis answer; a grade or confidence it does not state is a reason itself."""
+    # The parser fills in defaults for those, which would otherwise pass as a confident answer
+    reasons = ["unparsed_scores"] if len(extract_scores(answer)) < 2 else []
+    return reasons + escalation_reasons(parse_ai_response(answer), execution_check, symbolic_check)
+
+def cascade_escalation_reasons(ai_response, execution_check=None, symbolic_check=None, pack_size=None):
+    """Why the small model's answer is not good enough; for a packed answer, the reasons of all its parts."""
+    if not ai_response:
+        return ["small_model_failed"]
+    if not pack_size:
+        return answer_escalation_reasons(ai_response, execution_check, symbolic_check)
+    
+    parts = split_packed_response(ai_response, pack_size)
+    reasons = ["incomplete_pack"] if None in parts else []
+    for part in parts:
+        if part:
+            reasons.extend(reason for reason in answer_escalation_reasons(part) if reason not in reasons)
+    return reasons
+
+def request_analysis_completion(prompt, execution_check=None, symbolic_check=None, pack_size=None):
+    """
+    Get the model response for an analysis prompt (of pack_size submissions for a packed prompt).
+    With the cascade enabled the small model answers first and the large model is asked only
+    when that answer has low confidence, a borderline grade or contradicts the execution checks.
+    Raises HTTPException if no model answers.
+    """
+    if cascade_enabled:
+        started = time.monotonic()
+        ai_response = complete_with_model(prompt, cascade_small_model)
+        cascade_metrics.record_call("small", time.monotonic() - started)
+        admission.observe_latency(time.monotonic() - started)
+        
+        reasons = cascade_escalation_reasons(ai_response, execution_check, symbolic_check, pack_size)
+        cascade_metrics.record_request(reasons)
+        if not reasons:
+            return ai_response
+        logger.info(f"Escalating analysis to {analysis_model}: {', '.join(reasons)}")
+    
+    started = time.monotonic()
+    ai_response = complete_with_model(prompt, analysis_model)
+    cascade_metrics.record_call("large", time.monotonic() - started)
+    admission.observe_latency(time.monotonic() - started)
+    if ai_response:
+        return ai_response
+    
+    raise HTTPException(
+        status_code=500, 
+        detail="Не удалось получить ответ от API OpenAI. Пожалуйста, попробуйте позже."
+    )
+
+def load_submission(task_id, student_id):
+    """Load the stored submission info of a student for a task, or None."""
+    path = os.path.join(os.getcwd(), "submissions", task_id, student_id, "analysis_result.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error(f"Error reading analysis result for student {student_id}: {str(e)}")
+        return None
+
+def derive_student_id(student_name, task_id):
+    """
+    Create a consistent ID based on student name and task ID.
+    This ensures the same student gets the same ID for the same task
+    even if they submit multiple times.
+    """
+    # The whole name, reduced to characters safe in a directory name; the hash of the name as
+    # given tells apart names that reduce to the same text
+    name_for_id = re.sub(r"[^\w-]+", "_", student_name.lower()).strip("_")[:100]
+    name_hash = hashlib.sha1(f"{student_name}\0{task_id}".encode("utf-8")).hexdigest()[:8]
+    return f"{name_for_id}_{name_hash}" if name_for_id else name_hash
+
+def truncate_notebook_repr(nb_repr, label, max_chars=15000):
+    """Truncate a notebook representation to a reasonable size for the API."""
+    if len(nb_repr) > max_chars:
+        logger.info(f"{label} notebook content too large ({len(nb_repr)} chars), truncating")
+        return nb_repr[:max_chars] + "... [truncated]"
+    return nb_repr
+
+def analyze_against_base(topic, reference_nb_repr, student_cells, base_analysis, differing, verification_notes="",
+                         execution_check=None, symbolic_check=None):
+    """
+    Analyze only the cells that differ from an already analyzed submission
+    and merge the result into its analysis. Returns the merged analysis and the raw response.
+    """
+    delta_prompt = create_delta_prompt(
+        topic, reference_nb_repr, base_analysis,
+        [cell for cell in student_cells if cell["index"] in differing],
+        verification_notes
+    )
+    ai_response = request_analysis_completion(delta_prompt, execution_check, symbolic_check)
+    return merge_delta_analysis(base_analysis, parse_ai_response(ai_response), differing), ai_response
+
+def missing_task_analysis(label):
+    """Local analysis of a task the student did not attempt."""
+    return {
+        "error_summary": "Решение задания не найдено.",
+        "detailed_feedback": {
+            "strengths": [],
+            "weaknesses": [f"{label}: решение отсутствует"],
+            "suggestions": [f"Выполните {label.lower()}"]
+        },
+        "confidence_score": 1.0,
+        "grade": 0.0,
+        "cell_annotations": []
+    }
+
+def verified_task_analysis():
+    """Local analysis of a task whose results the automatic checks confirmed."""
+    return {
+        "error_summary": "Автоматическая проверка: результаты совпадают с эталонным решением.",
+        "detailed_feedback": {
+            "strengths": ["Результаты совпадают с эталонными"],
+            "weaknesses": [],
+            "suggestions": []
+        },
+        "confidence_score": 1.0,
+        "grade": 10.0,
+        "cell_annotations": []
+    }
+
+def unit_fingerprint(unit):
+    """
+    Fingerprint of what a task unit is graded on: the student's code (comments and whitespace
+    ignored), the student's cell layout and the reference cells of the task.
+    """
+    content = {
+        "student_code": [cell_hash for _, cell_hash in code_cell_hashes(unit["student_cells"])],
+        "student_layout": [cell.get("type") for cell in unit["student_cells"]],
+        "reference": [cell.get("content", "") for cell in unit["reference_cells"]]
+    }
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def task_analysis_records(units, analyses):
+    """Per-task analyses in the form stored with a submission, to be reused by its resubmissions."""
+    return {
+        unit["label"] or "Общая часть": {
+            "fingerprint": unit_fingerprint(unit),
+            "cell_indices": [cell["index"] for cell in unit["student_cells"]],
+            "analysis": analysis
+        }
+        for unit, analysis in zip(units, analyses) if analysis is not None
+    }
+
+async def analyze_by_tasks(topic, units, verification_notes="", previous_tasks=None, verified_tasks=()):
+    """
+    Analyze aligned task units as separate, concurrent LLM calls and merge the results.
+    Each unit's response is cached on its own; units unchanged since the previous submission
+    (previous_tasks, as stored by task_analysis_records) reuse their earlier analysis, and units
+    whose results the automatic checks confirmed (verified_tasks) are graded without the model.
+    Returns (analysis_result, raw responses, per-task analyses).
+    """
+    semaphore = asyncio.Semaphore(task_llm_concurrency)
+    previous_tasks = previous_tasks or {}
+    reused = []
+    
+    async def analyze_unit(unit):
+        # Nothing to grade against
+        if not has_code(unit["reference_cells"]):
+            return None, None
+        label = unit["label"] or "Общая часть"
+        if not has_code(unit["student_cells"]):
+            return missing_task_analysis(label), None
+        if unit["label"] in verified_tasks:
+            return verified_task_analysis(), None
+        
+        previous = previous_tasks.get(label)
+        if previous and previous["fingerprint"] == unit_fingerprint(unit):
+            reused.append(label)
+            return remap_cell_annotations(
+                previous["analysis"], previous["cell_indices"], [cell["index"] for cell in unit["student_cells"]]
+            ), None
+        
+        scope_note = (f"Анализируется только раздел «{label}» ноутбука. "
+                      f"Номера ячеек указаны как в исходном ноутбуке - используй их в комментариях к ячейкам.")
+        prompt = create_prompt_for_analysis(
+            topic, cells_repr(unit["reference_cells"]), cells_repr(unit["student_cells"]),
+            f"{scope_note}\n{verification_notes}"
+        )
+        cache_key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        response = await run_io(get_cached_response, cache_key)
+        if response is None:
+            async with semaphore:
+                response = await run_llm_call(request_analysis_completion, prompt)
+            await run_io(store_cached_response, cache_key, response)
+        return parse_ai_response(response), response
+    
+    results = await asyncio.gather(*(analyze_unit(unit) for unit in units))
+    analyses = [analysis for analysis, _ in results]
+    responses = [f"### {unit['label'] or 'Общая часть'}\n{response}" for unit, (_, response) in zip(units, results) if response]
+    logger.info(f"Analyzed {sum(1 for a in analyses if a is not None)} task units, {len(responses)} LLM responses, "
+                f"reused from the previous submission: {reused}")
+    return merge_task_analyses(units, analyses), "\n\n".join(responses), analyses
+
+def save_submission(task_id, student_id, student_name, analysis_result, analysis_source,
+                    signature=None, cell_hashes=None, reference_hash=None, task_analyses=None, revision=1):
+    """
+    Save a student's analysis to submissions/<task_id>/<student_id> and index it for near-duplicate detection.
+    Cell hashes and per-task analyses are kept so that a resubmission only re-analyzes what changed.
+    """
+    submissions_dir = os.path.join(os.getcwd(), "submissions")
+    student_dir = os.path.join(submissions_dir, task_id, student_id)
+    
+    # Create directories for submissions if they don't exist
+    if not os.path.exists(student_dir):
+        os.makedirs(student_dir)
+    
+    submission_info = {
+        "student_id": student_id,
+        "name": student_name,
+        "email": "",  # Could add email field in future
+        "submission_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "revision": revision,
+        "analysis_source": analysis_source,
+        "analysis_result": analysis_result,
+        "reference_hash": reference_hash,
+        "cell_hashes": cell_hashes,
+        "task_analyses": task_analyses
+    }
+    
+    student_result_path = os.path.join(student_dir, "analysis_result.json")
+    with open(student_result_path, "w", encoding='utf-8') as f:
+        json.dump(submission_info, f, indent=2)
+        logger.debug(f"Saved analysis result for student {student_id} to: {student_result_path}")
+    
+    if signature is not None:
+        index_submission(task_id, submissions_dir, student_id, signature, cell_hashes, reference_hash)
+        save_similarity_sidecar(student_dir, signature, cell_hashes, reference_hash)
+    
+    submission_catalog.record(task_id, submission_info)
+    
+    # Teachers following the task get the result without polling
+    task_events.publish(task_id, task_events.ANALYSIS, {
+        key: submission_info[key]
+        for key in ("student_id", "name", "submission_date", "revision", "analysis_source", "analysis_result")
+    })
+    
+    return submission_info
+
+def persist_analysis(task_id, student_id, student_name, analysis_result, analysis_source, ai_response,
+                     signature=None, cell_hashes=None, reference_hash=None, task_analyses=None, revision=1):
+    """Write everything an interactive analysis leaves on disk; blocking, so it runs in the I/O pool."""
+    # Save the raw response for debugging
+    if ai_response:
+        with open(f"response_debug_{task_id}_{student_id}.txt", "w") as f:
+            f.write(ai_response)
+    
+    # Save the analysis result to the student's directory and index it
+    save_submission(
+        task_id, student_id, student_name, analysis_result, analysis_source,
+        signature, cell_hashes, reference_hash, task_analyses, revision
+    )
+    
+    # Also save to standard locations for backward compatibility
+    with open("analysis_result.json", "w", encoding='utf-8') as f:
+        json.dump(analysis_result, f, indent=2)
+        logger.debug(f"Saved analysis result to current directory")
+    
+    # Also save to parent directory for access from web client
+    try:
+        parent_dir = os.path.abspath(os.path.join(os.getcwd(), ".."))
+        parent_file_path = os.path.join(parent_dir, "analysis_result.json")
+        with open(parent_file_path, "w", encoding='utf-8') as f:
+            json.dump(analysis_result, f, indent=2)
+            logger.debug(f"Saved analysis result to parent directory: {parent_file_path}")
+    except Exception as e:
+        logger.error(f"Failed to save analysis result to parent directory: {str(e)}")
+
 # Utility function to create Excel report from analysis results
 def create_excel_report(task_id: str, submissions_data: List[Dict[str, Any]]):
     """
@@ -493,6 +1225,10 @@ def create_excel_report(task_id: str, submissions_data: List[Dict[str, Any]]):
     Возвращает:
         BytesIO объект, содержащий Excel файл
     """
+    # Библиотеки отчета загружаются только при его создании
+    import pandas as pd
+    from openpyxl.styles import Alignment
+    
     logger.info(f"Создание Excel-отчета для задания {task_id} с {len(submissions_data)} решениями")
     
     # Создаем BytesIO объект для хранения Excel файла
@@ -512,6 +1248,11 @@ def create_excel_report(task_id: str, submissions_data: List[Dict[str, Any]]):
                 "Комментарий": []
             }
             
+            # Batch grading records which cluster each submission was graded in
+            with_clusters = any("cluster" in sub.get("analysis_source", {}) for sub in submissions_data)
+            if with_clusters:
+                summary_data["Кластер"] = []
+            
             # Извлекаем данные из каждого решения
             for sub in submissions_data:
                 analysis_result = sub.get("analysis_result", {})
@@ -532,6 +1273,8 @@ def create_excel_report(task_id: str, submissions_data: List[Dict[str, Any]]):
                 summary_data["Дата сдачи"].append(sub.get("submission_date", ""))
                 summary_data["Количество ошибок"].append(error_count)
                 summary_data["Комментарий"].append(error_summary)
+                if with_clusters:
+                    summary_data["Кластер"].append(sub.get("analysis_source", {}).get("cluster", ""))
             
             # Преобразуем в DataFrame
             summary_df = pd.DataFrame(summary_data)
@@ -570,6 +1313,22 @@ def create_excel_report(task_id: str, submissions_data: List[Dict[str, Any]]):
         logger.error(f"Error creating Excel file: {str(e)}")
         raise e
 
+def build_excel_report(task_id, submissions_data):
+    """Module-level (picklable) entry point for building the report in the CPU pool; returns the file bytes."""
+    return create_excel_report(task_id, submissions_data).getvalue()
+
+def excel_report_response(task_id, excel_data):
+    """Create a response with the Excel file."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"proofmate_отчет_{task_id}_{timestamp}.xlsx"
+    
+    # Header values must be latin-1: keep an ASCII fallback and pass the real name per RFC 5987
+    headers = {
+        'Content-Disposition': f'attachment; filename="proofmate_report_{timestamp}.xlsx"; filename*=UTF-8\'\'{quote(filename)}',
+        'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    }
+    return Response(content=excel_data, headers=headers)
+
 # Routes
 @app.get("/")
 async def root():
@@ -577,7 +1336,29 @@ async def root():
 
 @app.get("/healthcheck")
 async def healthcheck():
-    return {"status": "ок", "environment": environment}
+    """Liveness and the load state of this process (ok, busy, overloaded) as seen by admission control."""
+    load = admission.load(llm_scheduler.waiting(INTERACTIVE))
+    try:
+        load["job_queue"] = await asyncio.to_thread(job_broker.queue_depth)
+    except Exception as e:
+        logger.warning(f"Failed to read the job queue depth: {str(e)}")
+        load["job_queue"] = None
+    load["llm_running"] = llm_scheduler.running()
+    return {"status": "ок", "environment": environment, "load": load}
+
+@app.get("/api/metrics")
+async def metrics():
+    """
+    Counters of the model cascade, token usage (including prompt tokens served from the provider cache),
+    the model call scheduler of this process and the shared caches.
+    """
+    return {
+        "cascade": cascade_metrics.snapshot(),
+        "usage": usage_metrics.snapshot(),
+        "llm_scheduler": llm_scheduler.snapshot(),
+        "admission": admission.stats(),
+        "shared_cache": {cache.namespace: await run_io(cache.stats) for cache in (response_cache, reference_cache, report_cache)}
+    }
 
 # Utility function to ensure analysis files are available
 def ensure_analysis_files_available():
@@ -596,18 +1377,249 @@ def ensure_analysis_files_available():
             except Exception as e:
                 logger.error(f"Failed to copy {filename}: {str(e)}")
 
+async def run_analysis(task_id, student_id, student_name, student_content, student_hash, reference_content, reference_hash):
+    """
+    The analysis pipeline behind /api/analyze, from the decoded notebooks to the persisted result:
+    parse, reuse or prompt the model, parse its answer, highlight errors, save. Also run by the
+    job workers (see job_broker.py), so it only depends on its arguments and the shared storage.
+    Raises HTTPException for invalid notebooks.
+    """
+    # Validate the file content
+    if len(student_content) < 10 or len(reference_content) < 10:
+        logger.error(f"One or both files appear to be empty or too small")
+        raise HTTPException(status_code=400, detail="Один или оба файла ноутбуков пусты или недействительны")
+    
+    # A job may have spent its deadline in the queue
+    check_cancelled()
+    
+    # Parse notebooks in the CPU pool; a reference already parsed by any worker is reused
+    reference_cells = await run_io(reference_cache.get, reference_hash)
+    if reference_cells is None:
+        student_cells, reference_cells = await asyncio.gather(
+            run_cpu(extract_cells_from_notebook, student_content),
+            run_cpu(extract_cells_from_notebook, reference_content)
+        )
+        if reference_cells:
+            await run_io(reference_cache.set, reference_hash, reference_cells)
+    else:
+        student_cells = await run_cpu(extract_cells_from_notebook, student_content)
+    
+    if not student_cells or not reference_cells:
+        logger.error("Failed to parse notebook files")
+        raise HTTPException(status_code=400, detail="Не удалось проанализировать файлы ноутбуков. Убедитесь, что это допустимые Jupyter notebooks.")
+    
+    # Detect the mathematical topic; fingerprint the submission for the near-duplicate and resubmission checks
+    topic, (student_signature, student_cell_hashes) = await asyncio.gather(
+        run_cpu(detect_math_topic, student_cells + reference_cells),
+        run_cpu(submission_fingerprints, student_cells)
+    )
+    logger.info(f"Detected mathematical topic: {topic}")
+    
+    # Create simplified representations for the API call, truncated if too large
+    student_nb_repr = truncate_notebook_repr(student_content, "Student")
+    reference_nb_repr = truncate_notebook_repr(reference_content, "Reference")
+    del student_content, reference_content
+    
+    submissions_dir = os.path.join(os.getcwd(), "submissions")
+    
+    # Look for an earlier near-identical submission of the same task
+    similarity_index = await run_io(get_submission_index, task_id, submissions_dir)
+    
+    ai_response = None
+    analysis_result = None
+    analysis_source = {"type": "full"}
+    task_analyses = None
+    
+    # A resubmission only re-analyzes what changed since the student's previous submission
+    previous_submission = await run_io(load_submission, task_id, student_id) if incremental_reanalysis_enabled else None
+    # A student ID given by the client may be shared by two students; only a student's own work is a base
+    if previous_submission and previous_submission.get("name") != student_name:
+        logger.info(f"Previous submission under {student_id} belongs to another student, analyzing in full")
+        previous_submission = None
+    revision = previous_submission.get("revision", 1) + 1 if previous_submission else 1
+    previous_tasks = (previous_submission or {}).get("task_analyses")
+    resubmission_base = None
+    if (previous_submission and not previous_tasks and previous_submission.get("cell_hashes") is not None
+            and previous_submission.get("reference_hash") == reference_hash):
+        resubmission_base = previous_submission
+    
+    # Identical notebooks were already analyzed: reuse the model response
+    cache_key = f"{reference_hash}:{student_hash}"
+    cached_response = await run_io(get_cached_response, cache_key)
+    
+    # Run student and reference code side by side and compare their results
+    student_run = None
+    execution_check = None
+    symbolic_check = None
+    if cached_response is None and execution_enabled:
+        check_cancelled()
+        student_run, reference_run = await asyncio.to_thread(
+            execute_notebooks, [student_cells, reference_cells]
+        )
+        execution_check = compare_executions(student_run, reference_run, reference_cells)
+        logger.info(f"Execution check: {len(execution_check['checked_cells'])} cells checked, "
+                    f"mismatched {execution_check['mismatched_cells']}, failed {execution_check['failed_cells']}")
+        
+        # Compare the final answer of every task symbolically
+        symbolic_check = await asyncio.to_thread(
+            check_task_answers, student_cells, reference_cells, student_run, reference_run
+        )
+    
+    if cached_response is not None:
+        logger.info(f"Analysis cache hit for student notebook {student_hash[:12]}")
+        ai_response = cached_response
+    elif execution_check and execution_fast_path and (execution_check["all_match"] or symbolic_check["all_identical"]):
+        logger.info("All computed results match the reference, skipping the LLM call")
+        analysis_result = build_verified_analysis(execution_check, symbolic_check)
+        analysis_source = {"type": "execution"}
+    elif resubmission_base is not None:
+        previous_hashes = [tuple(h) for h in resubmission_base["cell_hashes"]]
+        differing = changed_cells(previous_hashes, student_cell_hashes)
+        analysis_source = {"type": "resubmission", "revision": revision, "changed_cells": differing}
+        
+        # Earlier annotations follow their cells if cells were inserted before them
+        base_analysis = remap_cell_annotations(
+            resubmission_base["analysis_result"],
+            [index for index, _ in previous_hashes], [index for index, _ in student_cell_hashes]
+        )
+        if not differing and len(previous_hashes) == len(student_cell_hashes):
+            logger.info(f"Resubmission of {student_id} has no code changes, reusing the previous analysis")
+            analysis_result = base_analysis
+        elif differing and len(differing) <= resubmission_max_changed_cells and len(student_cell_hashes) >= len(previous_hashes):
+            logger.info(f"Resubmission of {student_id} changed cells {differing}, re-analyzing only them")
+            analysis_result, ai_response = await run_llm_call(
+                analyze_against_base, topic, reference_nb_repr, student_cells, base_analysis, differing,
+                describe_execution_check(execution_check, symbolic_check), execution_check, symbolic_check
+            )
+        else:
+            analysis_source = {"type": "full"}
+    elif student_signature is not None:
+        matches = similarity_index.query(student_signature, reference_hash, exclude=student_id, threshold=near_duplicate_threshold)
+        base_submission = await run_io(load_submission, task_id, matches[0][0]) if matches else None
+        
+        if base_submission:
+            base_student_id, similarity = matches[0]
+            base_analysis = base_submission["analysis_result"]
+            base_hashes = similarity_index.entries[base_student_id]["cell_hashes"]
+            differing = changed_cells(base_hashes, student_cell_hashes)
+            analysis_source = {"type": "near_duplicate", "student_id": base_student_id, "similarity": round(similarity, 3), "changed_cells": differing}
+            
+            # A copy with code cells deleted is analyzed in full: the delta prompt only shows cells that exist
+            if not differing and len(base_hashes) == len(student_cell_hashes):
+                logger.info(f"Submission matches {base_student_id} (similarity {similarity:.2f}), reusing its analysis")
+                analysis_result = copy.deepcopy(base_analysis)
+            elif len(differing) <= near_duplicate_max_changed_cells and len(student_cell_hashes) >= len(base_hashes):
+                logger.info(f"Submission is close to {base_student_id} (similarity {similarity:.2f}), re-analyzing cells {differing}")
+                analysis_result, ai_response = await run_llm_call(
+                    analyze_against_base, topic, reference_nb_repr, student_cells, base_analysis, differing,
+                    describe_execution_check(execution_check, symbolic_check), execution_check, symbolic_check
+                )
+            else:
+                analysis_source = {"type": "full"}
+    
+    # Notebooks with several tasks are analyzed per task, concurrently
+    if analysis_result is None and ai_response is None and task_segmentation_enabled:
+        reference_tasks = [section for section in split_into_tasks(reference_cells) if section["label"]]
+        if len(reference_tasks) >= 2:
+            units = align_tasks(student_cells, reference_cells)
+            # Tasks the checks confirmed are not sent to the model, only the others
+            verified_tasks = []
+            if execution_check and execution_fast_path:
+                # Matching cell values do not outweigh a final answer the symbolic check found different
+                verdicts = {task["task"]: task["verdict"] for task in symbolic_check["tasks"]}
+                verified_tasks = [
+                    unit["label"] for unit in units
+                    if verdicts.get(unit["label"]) == "identical"
+                    or (unit["label"] in execution_check["verified_tasks"] and verdicts.get(unit["label"]) in (None, "unknown"))
+                ]
+            analysis_result, ai_response, task_analyses = await analyze_by_tasks(
+                topic, units, describe_execution_check(execution_check, symbolic_check), previous_tasks, verified_tasks
+            )
+            task_analyses = task_analysis_records(units, task_analyses)
+            analysis_source = {"type": "per_task", "tasks": [unit["label"] or "Общая часть" for unit in units]}
+            if verified_tasks:
+                analysis_source["verified_tasks"] = verified_tasks
+    
+    if analysis_result is None:
+        if ai_response is None:
+            analysis_prompt = create_prompt_for_analysis(
+                topic, reference_nb_repr, student_nb_repr, describe_execution_check(execution_check, symbolic_check)
+            )
+            ai_response = await run_llm_call(request_analysis_completion, analysis_prompt, execution_check, symbolic_check)
+        # The response is paid for: cached even if nobody waits for this analysis any more
+        await run_io(store_cached_response, cache_key, ai_response)
+        check_cancelled()
+        
+        # Parse the AI response
+        analysis_result = await run_cpu(parse_ai_response, ai_response)
+    
+    if execution_check is not None:
+        analysis_source["execution_check"] = execution_check
+        analysis_source["symbolic_check"] = symbolic_check
+    
+    # Line-level highlights are computed locally for every result, reused ones included
+    analysis_result["error_highlights"] = await run_cpu(
+        build_error_highlights, student_cells, reference_cells, analysis_result["cell_annotations"],
+        student_run, execution_check, symbolic_check
+    )
+    
+    # Result files are written in the I/O pool
+    check_cancelled()
+    await run_io(
+        persist_analysis, task_id, student_id, student_name, analysis_result, analysis_source, ai_response,
+        student_signature, student_cell_hashes, reference_hash, task_analyses, revision
+    )
+    
+    # Validate the analysis result
+    if not analysis_result["detailed_feedback"]["strengths"] and not analysis_result["detailed_feedback"]["weaknesses"]:
+        logger.warning("Analysis result lacks both strengths and weaknesses")
+        # Add a default strength if none were extracted
+        analysis_result["detailed_feedback"]["strengths"] = ["Решение демонстрирует понимание основных математических концепций"]
+    
+    if not analysis_result["cell_annotations"]:
+        logger.warning("Analysis result lacks cell annotations")
+        # Try to extract some cell-level information from the weaknesses
+        for weakness in analysis_result["detailed_feedback"]["weaknesses"]:
+            cell_match = re.search(r'(?:cell|ячейка)\s*(\d+)', weakness, re.IGNORECASE)
+            if cell_match:
+                cell_index = int(cell_match.group(1))
+                analysis_result["cell_annotations"].append({
+                    "cell_index": cell_index,
+                    "comments": [weakness]
+                })
+    
+    return analysis_result
+
 @app.post("/api/analyze", response_model=AnalysisResult)
 async def analyze_notebook(
+    request: Request,
     notebook_file: UploadFile = File(...),
     reference_solution: UploadFile = File(...),
     task_id: str = Form(...),
     student_id: str = Form(None),
-    student_name: str = Form(None)
+    student_name: str = Form(None),
+    durable: bool = Form(False)
 ):
     """
     Analyze a student's notebook against a reference solution.
     Returns detailed feedback, error analysis, and a grade.
+    The analysis stops at its deadline (ANALYZE_DEADLINE, or X-Request-Timeout if shorter) and
+    when the client disconnects, unless it is durable: then it is finished and saved regardless.
+    Retries sent with the same Idempotency-Key get the response of the first request; a request
+    with the key is always durable, so that its result is there for the retry.
     """
+    bind_log_context(task_id=task_id)
+    # A teacher is waiting: ahead of batch and background model calls
+    bind_priority(INTERACTIVE, task_id)
+    idempotency_key = request.headers.get("idempotency-key")
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= max_key_length:
+        raise HTTPException(status_code=400, detail=f"Ключ идемпотентности должен содержать от 1 до {max_key_length} символов")
+    # The request as sent, before the defaults below are filled in
+    requested = [task_id, student_id, student_name, notebook_file.filename, durable]
+    # A keyed request whose connection drops is resent: stopping it would leave the retry nothing to replay
+    durable = durable or idempotency_key is not None
+    scope = open_scope(analyze_job_timeout if durable else
+                       request_timeout(request.headers.get("x-request-timeout"), analyze_deadline))
     logger.info(f"Received analysis request for task {task_id}")
     logger.info(f"Student notebook: {notebook_file.filename}, Reference: {reference_solution.filename}")
     
@@ -617,347 +1629,1057 @@ async def analyze_notebook(
     
     # Generate a student ID based on name if not provided
     if not student_id:
-        # Create a consistent ID based on student name and task ID
-        # This ensures the same student gets the same ID for the same task
-        # even if they submit multiple times
-        name_for_id = student_name.lower().replace(" ", "_")
-        student_id = f"{name_for_id}_{task_id}"[:8]
-        
-        # If the ID is too short or empty, add a random suffix
-        if len(student_id) < 4:
-            student_id += str(uuid.uuid4())[:4]
+        student_id = derive_student_id(student_name, task_id)
     
     logger.info(f"Processing submission for student ID: {student_id}, name: {student_name}")
     
     try:
-        # Read the contents of both files
-        student_content = await notebook_file.read()
-        reference_content = await reference_solution.read()
-        
-        # Validate the file content
-        if len(student_content) < 10 or len(reference_content) < 10:
-            logger.error(f"One or both files appear to be empty or too small")
-            raise HTTPException(status_code=400, detail="Один или оба файла ноутбуков пусты или недействительны")
-        
-        # Parse notebooks
-        student_cells = extract_cells_from_notebook(student_content)
-        reference_cells = extract_cells_from_notebook(reference_content)
-        
-        if not student_cells or not reference_cells:
-            logger.error("Failed to parse notebook files")
-            raise HTTPException(status_code=400, detail="Не удалось проанализировать файлы ноутбуков. Убедитесь, что это допустимые Jupyter notebooks.")
-        
-        # Detect the mathematical topic
-        topic = detect_math_topic(student_cells + reference_cells)
-        logger.info(f"Detected mathematical topic: {topic}")
-        
-        # Create simplified representations for the API call
-        student_nb_repr = student_content.decode('utf-8')
-        reference_nb_repr = reference_content.decode('utf-8')
-        
-        # Truncate if too large
-        max_chars = 15000  # Reasonable limit for API
-        if len(student_nb_repr) > max_chars:
-            logger.info(f"Student notebook content too large ({len(student_nb_repr)} chars), truncating")
-            student_nb_repr = student_nb_repr[:max_chars] + "... [truncated]"
-        if len(reference_nb_repr) > max_chars:
-            logger.info(f"Reference notebook content too large ({len(reference_nb_repr)} chars), truncating")
-            reference_nb_repr = reference_nb_repr[:max_chars] + "... [truncated]"
-        
-        # Create analysis prompt
-        analysis_prompt = create_prompt_for_analysis(topic, reference_nb_repr, student_nb_repr)
-        
-        # Use the direct HTTP method as it's known to work
-        logger.info("Calling OpenAI API using direct HTTP request...")
-        ai_response = call_openai_api_alternative(analysis_prompt)
-        
-        if not ai_response:
-            # If direct method fails, try the SDK as fallback
-            logger.info("Direct HTTP request failed, trying SDK as fallback...")
+        # Stream both files in chunks; each is decoded exactly once
+        student_content, student_hash = await read_upload_streaming(notebook_file)
+        reference_content, reference_hash = await read_upload_streaming(reference_solution)
+        
+        if idempotency_key is None:
+            return await analyze_submission(
+                request, scope, durable, task_id, student_id, student_name,
+                student_content, student_hash, reference_content, reference_hash
+            )
+        
+        replay = await idempotent_replay(idempotency_key, fingerprint(*requested, student_hash, reference_hash), scope)
+        if replay is not None:
+            return replay
+        try:
+            response = await analyze_submission(
+                request, scope, durable, task_id, student_id, student_name,
+                student_content, student_hash, reference_content, reference_hash
+            )
+        except BaseException:
+            # A failed request leaves no record: its retry runs the analysis again
+            await asyncio.shield(run_io(analyze_idempotency.abandon, idempotency_key))
+            raise
+        if isinstance(response, JSONResponse):
+            await run_io(analyze_idempotency.complete, idempotency_key, response.status_code, json.loads(response.body))
+        else:
+            await run_io(analyze_idempotency.complete, idempotency_key, 200, response.model_dump())
+        return response
+        
+    except Cancelled as e:
+        raise cancelled_error(e)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error analyzing notebooks: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Ошибка анализа: {str(e)}")
+
+async def analyze_submission(request, scope, durable, task_id, student_id, student_name,
+                             student_content, student_hash, reference_content, reference_hash):
+    """Run the analysis of an admitted request here or on a job worker, or queue it if admission control shed it."""
+    # Shed by admission control, the analysis runs as a job the client polls for
+    if getattr(request.state, "run_as_job", False):
+        job_id = await enqueue_analysis_job(
+            task_id, student_id, student_name, student_content, student_hash, reference_content, reference_hash,
+            INTERACTIVE
+        )
+        status_url = f"/api/jobs/{job_id}"
+        return JSONResponse(
+            status_code=202,
+            content={"job_id": job_id, "status": "queued", "priority": INTERACTIVE, "student_id": student_id, "status_url": status_url},
+            headers={"Location": status_url}
+        )
+    
+    async with cancellation_guard(scope, None if durable else request.state.disconnected):
+        # Behind a remote broker this node only enqueues; one of the workers runs the analysis
+        if not job_broker.local:
+            job_id = await enqueue_analysis_job(
+                task_id, student_id, student_name, student_content, student_hash, reference_content, reference_hash,
+                INTERACTIVE, time.time() + scope.remaining()
+            )
+            del student_content, reference_content
             try:
-                response = openai.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {"role": "system", "content": "Вы ИИ-ассистент, который анализирует математические решения."},
-                        {"role": "user", "content": analysis_prompt}
-                    ],
-                    temperature=0.5,
-                    max_tokens=4000
-                )
-                
-                ai_response = response.choices[0].message.content
-                logger.info("OpenAI API call successful via SDK")
-            except Exception as e:
-                logger.error(f"Both API call methods failed: {str(e)}")
-                raise HTTPException(
-                    status_code=500, 
-                    detail="Не удалось получить ответ от API OpenAI. Пожалуйста, попробуйте позже."
-                )
+                return await wait_for_analysis_job(job_id)
+            except Cancelled:
+                # A job still in the queue is dropped; a running one stops at the deadline it carries
+                await asyncio.to_thread(job_broker.cancel, job_id)
+                raise
         
-        # Log first part of the response for debugging
-        logger.info(f"AI response preview: {ai_response[:200]}...")
+        analysis_result = await run_analysis(
+            task_id, student_id, student_name, student_content, student_hash, reference_content, reference_hash
+        )
+    
+    # Return the analysis result
+    return analysis_response(analysis_result)
+
+async def idempotent_replay(idempotency_key, request_fingerprint, scope):
+    """
+    The stored response for a retried Idempotency-Key, or None if this request is the first with it
+    (and now owns the key). While the first request is still running its retry waits for it.
+    """
+    while True:
+        state, record = await run_io(analyze_idempotency.begin, idempotency_key, request_fingerprint)
+        if state == NEW:
+            return None
+        if state == MISMATCH:
+            raise HTTPException(status_code=422, detail="Ключ идемпотентности уже использован для другого запроса")
+        if state == REPLAY:
+            logger.info("Replaying the stored response for an idempotency key")
+            return JSONResponse(status_code=record["status_code"], content=record["body"], headers={"Idempotent-Replayed": "true"})
+        if scope.cancelled:
+            raise HTTPException(status_code=409, detail="Запрос с этим ключом идемпотентности ещё выполняется",
+                                headers={"Retry-After": str(max(1, round(idempotency_poll_interval * 4)))})
+        await asyncio.sleep(idempotency_poll_interval)
+
+def cancelled_error(error: Cancelled):
+    """The HTTP error of an analysis stopped by its deadline or by its client disconnecting."""
+    if error.reason == DEADLINE:
+        logger.warning("Analysis stopped at its deadline")
+        return HTTPException(status_code=504, detail="Проверка не уложилась в отведённое время, повторите попытку позже")
+    logger.info("Client disconnected, analysis stopped")
+    # nginx's code for a request closed by the client: nobody reads the response
+    return HTTPException(status_code=499, detail="Клиент отключился, проверка прервана")
+
+def analysis_response(analysis_result):
+    return AnalysisResult(
+        error_summary=analysis_result["error_summary"],
+        detailed_feedback=analysis_result["detailed_feedback"],
+        confidence_score=analysis_result["confidence_score"],
+        grade=analysis_result["grade"],
+        cell_annotations=analysis_result["cell_annotations"],
+        error_highlights=analysis_result["error_highlights"]
+    )
+
+async def run_analysis_job(payload):
+    """
+    Job handler of the workers: the same pipeline as /api/analyze, logged under the enqueuing
+    request's ID and stopped at the deadline of that request, if it had one.
+    """
+    bind_log_context(request_id=payload.get("request_id"), task_id=payload["task_id"])
+    bind_priority(payload.get("priority", BATCH), payload["task_id"])
+    deadline_at = payload.get("deadline_at")
+    scope = open_scope(deadline_at - time.time() if deadline_at else None)
+    try:
+        async with cancellation_guard(scope):
+            analysis_result = await run_analysis(
+                payload["task_id"], payload["student_id"], payload["student_name"], payload["student_content"],
+                payload["student_hash"], payload["reference_content"], payload["reference_hash"]
+            )
+    except Cancelled as e:
+        raise cancelled_error(e)
+    return analysis_response(analysis_result).model_dump()
+
+async def enqueue_analysis_job(task_id, student_id, student_name, student_content, student_hash, reference_content, reference_hash,
+                               priority=BATCH, deadline_at=None):
+    job_id = new_job_id()
+    try:
+        queue_depth = await asyncio.to_thread(job_broker.queue_depth)
+    except Exception as e:
+        logger.error(f"Failed to read the job queue depth: {str(e)}")
+        raise HTTPException(status_code=503, detail="Очередь проверки недоступна, повторите попытку позже")
+    if queue_depth >= admission_max_job_queue:
+        retry_after = admission.retry_after(queue_depth, llm_scheduler.capacity)
+        logger.warning(f"Job queue is full ({queue_depth} jobs), refusing the analysis job")
+        raise HTTPException(status_code=503, detail="Очередь проверки переполнена, повторите попытку позже",
+                            headers={"Retry-After": str(retry_after)})
+    
+    try:
+        await asyncio.to_thread(job_broker.enqueue, job_id, {
+            "task_id": task_id,
+            "student_id": student_id,
+            "student_name": student_name,
+            "student_content": student_content,
+            "student_hash": student_hash,
+            "reference_content": reference_content,
+            "reference_hash": reference_hash,
+            "request_id": log_context()["request_id"],
+            "priority": priority,
+            "deadline_at": deadline_at
+        }, priority)
+    except Exception as e:
+        logger.error(f"Failed to enqueue analysis job: {str(e)}")
+        raise HTTPException(status_code=503, detail="Очередь проверки недоступна, повторите попытку позже")
+    
+    logger.info(f"Queued {priority} analysis job {job_id} for student {student_id}")
+    return job_id
+
+async def wait_for_analysis_job(job_id):
+    """Poll a queued analysis until it finishes; its error becomes the HTTP error of the request."""
+    deadline = time.monotonic() + analyze_job_timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(job_poll_interval)
+        job = await asyncio.to_thread(job_broker.status, job_id)
+        if job is None:
+            raise HTTPException(status_code=500, detail="Задание на проверку потеряно")
+        if job["status"] == "done":
+            return AnalysisResult(**job["result"])
+        if job["status"] == "failed":
+            raise HTTPException(status_code=job["error"]["status_code"], detail=job["error"]["detail"])
+    raise HTTPException(status_code=504, detail=f"Проверка не завершилась вовремя, результат будет доступен по адресу /api/jobs/{job_id}")
+
+@app.post("/api/jobs/analyze", status_code=202)
+async def enqueue_analysis(
+    notebook_file: UploadFile = File(...),
+    reference_solution: UploadFile = File(...),
+    task_id: str = Form(...),
+    student_id: str = Form(None),
+    student_name: str = Form(None),
+    priority: str = Form(BATCH)
+):
+    """
+    Асинхронная проверка: решение ставится в очередь, его анализирует один из обработчиков.
+    Результат - по адресу из status_url. Приоритет: interactive, batch (по умолчанию)
+    или background - для фоновой перепроверки.
+    """
+    bind_log_context(task_id=task_id)
+    if priority not in PRIORITY_CLASSES:
+        raise HTTPException(status_code=400, detail=f"Неизвестный приоритет: {priority}")
+    if not student_name:
+        student_name = notebook_file.filename.split('.')[0] if notebook_file.filename else "Анонимный"
+    if not student_id:
+        student_id = derive_student_id(student_name, task_id)
+    
+    student_content, student_hash = await read_upload_streaming(notebook_file)
+    reference_content, reference_hash = await read_upload_streaming(reference_solution)
+    
+    job_id = await enqueue_analysis_job(
+        task_id, student_id, student_name, student_content, student_hash, reference_content, reference_hash, priority
+    )
+    return {"job_id": job_id, "status": "queued", "priority": priority, "student_id": student_id, "status_url": f"/api/jobs/{job_id}"}
+
+@app.get("/api/jobs/{job_id}")
+async def analysis_job_status(job_id: str):
+    """Состояние задания на проверку; у выполненного - результат анализа, у неудачного - ошибка."""
+    try:
+        job = await asyncio.to_thread(job_broker.status, job_id)
+    except Exception as e:
+        logger.error(f"Failed to read analysis job {job_id}: {str(e)}")
+        raise HTTPException(status_code=503, detail="Очередь проверки недоступна, повторите попытку позже")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job
+
+def submission_fingerprints(cells):
+    """MinHash signature and code cell hashes of a submission."""
+    return minhash_signature(cells), code_cell_hashes(cells)
+
+def parse_batch_notebook(content):
+    """Everything a batch needs of one notebook, computed in one call in the CPU pool; None if it does not parse."""
+    cells = extract_cells_from_notebook(content)
+    if not cells:
+        return None
+    signature, cell_hashes = submission_fingerprints(cells)
+    return {
+        "cells": cells,
+        "nb_repr": truncate_notebook_repr(content, "Student"),
+        "packed_repr": cells_repr(cells),
+        "signature": signature,
+        "cell_hashes": cell_hashes
+    }
+
+def cluster_by_strategy(cells_per_submission, threshold):
+    """Cluster the submissions of a batch by the TF-IDF vectors of their code."""
+    return cluster_submissions(tfidf_vectors([submission_tokens(cells) for cells in cells_per_submission]), threshold)
+
+async def read_batch_submissions(notebook_files, task_id):
+    """Parse every notebook of a batch once, in the CPU pool while the next uploads are read; unparsable notebooks are skipped."""
+    parsing = []
+    for notebook_file in notebook_files:
+        content, _ = await read_upload_streaming(notebook_file)
+        parsing.append((notebook_file, asyncio.create_task(run_cpu(parse_batch_notebook, content))))
+        del content
+    
+    students = []
+    used_ids = set()
+    for notebook_file, parsed in parsing:
+        parsed = await parsed
+        if parsed is None:
+            logger.warning(f"Skipping unparsable notebook {notebook_file.filename}")
+            continue
+        student_name = notebook_file.filename.split('.')[0] if notebook_file.filename else "Анонимный"
+        student_id = derive_student_id(student_name, task_id)
+        # Files of one batch with the same name must not overwrite each other
+        while student_id in used_ids:
+            student_id = f"{student_id}_{str(uuid.uuid4())[:4]}"
+        used_ids.add(student_id)
+        students.append({"student_id": student_id, "name": student_name, **parsed})
+    return students
+
+@app.post("/api/batch-analyze")
+async def batch_analyze_notebooks(
+    notebook_files: List[UploadFile] = File(...),
+    reference_solution: UploadFile = File(...),
+    task_id: str = Form(...),
+    cluster_threshold: float = Form(None),
+    export_excel: bool = Form(False)
+):
+    """
+    Пакетная проверка: решения группируются по стратегии, полный анализ получает
+    только представитель каждого кластера, остальные - анализ отличий от него.
+    Небольшие решения представителей проверяются по нескольку за один запрос.
+    """
+    bind_log_context(task_id=task_id)
+    bind_priority(BATCH, task_id)
+    threshold = batch_cluster_threshold if cluster_threshold is None else cluster_threshold
+    logger.info(f"Received batch analysis request for task {task_id} with {len(notebook_files)} notebooks")
+    
+    try:
+        reference_content, reference_hash = await read_upload_streaming(reference_solution)
+        reference_cells = await run_cpu(extract_cells_from_notebook, reference_content)
+        if not reference_cells:
+            raise HTTPException(status_code=400, detail="Не удалось проанализировать эталонное решение.")
+        reference_nb_repr = truncate_notebook_repr(reference_content, "Reference")
+        del reference_content
         
-        # Parse the AI response
-        analysis_result = parse_ai_response(ai_response)
+        students = await read_batch_submissions(notebook_files, task_id)
         
-        # Save the raw response for debugging
-        with open(f"response_debug_{task_id}_{student_id}.txt", "w") as f:
-            f.write(ai_response)
+        if not students:
+            raise HTTPException(status_code=400, detail="Не удалось проанализировать ни один ноутбук.")
         
-        # Create directories for submissions if they don't exist
-        submissions_dir = os.path.join(os.getcwd(), "submissions")
-        if not os.path.exists(submissions_dir):
-            os.makedirs(submissions_dir)
+        topic, clusters = await asyncio.gather(
+            run_cpu(detect_math_topic, reference_cells),
+            run_cpu(cluster_by_strategy, [student["cells"] for student in students], threshold)
+        )
         
-        task_dir = os.path.join(submissions_dir, task_id)
-        if not os.path.exists(task_dir):
-            os.makedirs(task_dir)
+        semaphore = asyncio.Semaphore(batch_llm_concurrency)
         
-        student_dir = os.path.join(task_dir, student_id)
-        if not os.path.exists(student_dir):
-            os.makedirs(student_dir)
+        async def run_llm(func, *args):
+            async with semaphore:
+                return await run_llm_call(func, *args)
         
-        # Save the analysis result for this student
-        submission_info = {
-            "student_id": student_id,
-            "name": student_name,
-            "email": "",  # Could add email field in future
-            "submission_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "analysis_result": analysis_result
-        }
+        # Full analysis for the representatives
+        representative_calls = 0
         
-        # Save to student's directory
-        student_result_path = os.path.join(student_dir, "analysis_result.json")
-        with open(student_result_path, "w", encoding='utf-8') as f:
-            json.dump(submission_info, f, indent=2)
-            logger.info(f"Saved analysis result for student {student_id} to: {student_result_path}")
+        async def analyze_representative(student):
+            nonlocal representative_calls
+            representative_calls += 1
+            prompt = create_prompt_for_analysis(topic, reference_nb_repr, student["nb_repr"])
+            return await run_cpu(parse_ai_response, await run_llm(request_analysis_completion, prompt))
         
-        # Also save to standard locations for backward compatibility
-        with open("analysis_result.json", "w", encoding='utf-8') as f:
-            json.dump(analysis_result, f, indent=2)
-            logger.info(f"Saved analysis result to current directory")
+        # Small representatives are graded several per completion, with the reference sent once
+        async def analyze_pack(pack):
+            nonlocal representative_calls
+            representative_calls += 1
+            prompt = create_packed_prompt(topic, reference_nb_repr, [student["packed_repr"] for student in pack])
+            parts = split_packed_response(await run_llm(request_analysis_completion, prompt, None, None, len(pack)), len(pack))
+            results = []
+            for student, part in zip(pack, parts):
+                # A submission the answer skipped is graded on its own
+                results.append(await run_cpu(parse_ai_response, part) if part else await analyze_representative(student))
+            return results
+        
+        representatives = [students[cluster["representative"]] for cluster in clusters]
+        small = [p for p, student in enumerate(representatives) if packing_enabled and is_small(student["packed_repr"])]
+        packs = []
+        if len(small) >= 2:
+            packs = [
+                [small[i] for i in pack]
+                for pack in plan_packs([representatives[p]["packed_repr"] for p in small], reference_nb_repr)
+                if len(pack) >= 2
+            ]
+        packed = {p for pack in packs for p in pack}
+        
+        representative_results = [None] * len(representatives)
+        
+        async def grade_single(position):
+            representative_results[position] = await analyze_representative(representatives[position])
+        
+        async def grade_pack(pack):
+            for position, result in zip(pack, await analyze_pack([representatives[p] for p in pack])):
+                representative_results[position] = result
+        
+        await asyncio.gather(
+            *(grade_pack(pack) for pack in packs),
+            *(grade_single(p) for p in range(len(representatives)) if p not in packed)
+        )
+        
+        # Cheaper delta analysis for the other members of each cluster
+        async def analyze_member(student, representative, base_analysis):
+            differing = changed_cells(representative["cell_hashes"], student["cell_hashes"])
+            if not differing and len(student["cell_hashes"]) == len(representative["cell_hashes"]):
+                return copy.deepcopy(base_analysis), differing
+            # A member with code cells deleted is analyzed in full: the delta prompt only shows cells that exist
+            if len(student["cell_hashes"]) < len(representative["cell_hashes"]):
+                prompt = create_prompt_for_analysis(topic, reference_nb_repr, student["nb_repr"])
+                return await run_cpu(parse_ai_response, await run_llm(request_analysis_completion, prompt)), differing
+            result, _ = await run_llm(analyze_against_base, topic, reference_nb_repr, student["cells"], base_analysis, differing)
+            return result, differing
+        
+        member_jobs = []
+        for cluster_number, (cluster, base_analysis) in enumerate(zip(clusters, representative_results)):
+            representative = students[cluster["representative"]]
+            for member in cluster["members"]:
+                member_jobs.append((cluster_number, cluster, member, analyze_member(students[member], representative, base_analysis)))
+        member_results = await asyncio.gather(*(job[3] for job in member_jobs))
+        
+        llm_calls = representative_calls
+        submissions_data = []
+        for cluster_number, (cluster, analysis_result) in enumerate(zip(clusters, representative_results)):
+            student = students[cluster["representative"]]
+            analysis_result["error_highlights"] = await run_cpu(build_error_highlights, student["cells"], reference_cells, analysis_result["cell_annotations"])
+            submissions_data.append(await run_io(
+                save_submission, task_id, student["student_id"], student["name"], analysis_result,
+                {"type": "cluster_representative", "cluster": cluster_number, "packed": cluster_number in packed},
+                student["signature"], student["cell_hashes"], reference_hash
+            ))
+        for (cluster_number, cluster, member, _), (analysis_result, differing) in zip(member_jobs, member_results):
+            student = students[member]
+            if differing:
+                llm_calls += 1
+            # Members share the representative's comments but get highlights for their own lines
+            analysis_result["error_highlights"] = await run_cpu(build_error_highlights, student["cells"], reference_cells, analysis_result["cell_annotations"])
+            submissions_data.append(await run_io(
+                save_submission, task_id, student["student_id"], student["name"], analysis_result,
+                {
+                    "type": "cluster_member",
+                    "cluster": cluster_number,
+                    "student_id": students[cluster["representative"]]["student_id"],
+                    "similarity": round(cluster["similarities"][member], 3),
+                    "changed_cells": differing
+                },
+                student["signature"], student["cell_hashes"], reference_hash
+            ))
+        
+        logger.info(f"Batch for task {task_id}: {len(students)} submissions, {len(clusters)} clusters, {llm_calls} LLM calls")
+        await run_io(task_events.publish, task_id, task_events.BATCH, {
+            "submissions": len(students), "clusters": len(clusters), "llm_calls": llm_calls
+        })
         
-        # Also save to parent directory for access from web client
+        if export_excel:
+            return excel_report_response(task_id, await run_cpu(build_excel_report, task_id, submissions_data))
+        
+        return {
+            "task_id": task_id,
+            "submissions": len(students),
+            "clusters": len(clusters),
+            "packed_completions": len(packs),
+            "llm_calls": llm_calls,
+            "results": [
+                {
+                    "student_id": sub["student_id"],
+                    "name": sub["name"],
+                    "grade": sub["analysis_result"]["grade"],
+                    "analysis_source": sub["analysis_source"]
+                }
+                for sub in submissions_data
+            ]
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in batch analysis for task {task_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Ошибка пакетного анализа: {str(e)}")
+
+# Local states after which a batch needs no more polling
+OFFLINE_BATCH_DONE = {"stored", "failed", "expired", "cancelled"}
+# Pollers of submitted batches; kept referenced so they are not garbage collected
+offline_batch_pollers = set()
+
+def offline_batch_dir(task_id, batch_id=None):
+    path = os.path.join(os.getcwd(), "offline_batches", task_id)
+    return os.path.join(path, batch_id) if batch_id else path
+
+def load_offline_batch_state(task_id, batch_id):
+    path = os.path.join(offline_batch_dir(task_id, batch_id), "state.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_offline_batch_state(state):
+    path = os.path.join(offline_batch_dir(state["task_id"], state["batch_id"]), "state.json")
+    # Write-then-rename so a concurrent status request never reads half a file
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, path)
+
+def submit_offline_batch(task_id, students, reference_cells, reference_nb_repr, reference_hash):
+    """
+    Write the analysis prompts of all submissions to a JSONL batch file, submit it to the batch API
+    and keep what is needed to store the results once the batch completes.
+    """
+    topic = detect_math_topic(reference_cells)
+    staging_dir = offline_batch_dir(task_id, f"pending_{uuid.uuid4().hex[:12]}")
+    os.makedirs(staging_dir)
+    
+    input_path = os.path.join(staging_dir, "input.jsonl")
+    write_batch_file(input_path, [
+        batch_request_line(student["student_id"], create_prompt_for_analysis(topic, reference_nb_repr, student["nb_repr"]),
+                           analysis_model, ANALYSIS_SYSTEM_PROMPT)
+        for student in students
+    ])
+    # Cells are kept for the error highlights computed when the results are stored
+    with open(os.path.join(staging_dir, "students.jsonl"), "w", encoding="utf-8") as f:
+        for student in students:
+            f.write(json.dumps({
+                "student_id": student["student_id"],
+                "name": student["name"],
+                "cells": student["cells"],
+                "signature": student["signature"].tolist() if student["signature"] is not None else None,
+                "cell_hashes": student["cell_hashes"]
+            }, ensure_ascii=False) + "\n")
+    with open(os.path.join(staging_dir, "reference_cells.json"), "w", encoding="utf-8") as f:
+        json.dump(reference_cells, f, ensure_ascii=False)
+    
+    client = BatchClient()
+    batch = client.create_batch(client.upload_file(input_path), {"task_id": task_id})
+    os.replace(staging_dir, offline_batch_dir(task_id, batch["id"]))
+    
+    state = {
+        "batch_id": batch["id"],
+        "task_id": task_id,
+        "model": analysis_model,
+        "reference_hash": reference_hash,
+        "submissions": len(students),
+        "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "status": batch["status"],
+        "stored": 0,
+        "failed": {}
+    }
+    with batch_ledger(task_id, batch["id"], batch["status"]):
+        save_offline_batch_state(state)
+    logger.info(f"Submitted offline batch {batch['id']} for task {task_id} with {len(students)} prompts")
+    return state
+
+def store_offline_batch_results(state, client, batch):
+    """Stream the batch results through parse_ai_response into the submission store."""
+    batch_dir = offline_batch_dir(state["task_id"], state["batch_id"])
+    with open(os.path.join(batch_dir, "reference_cells.json"), "r", encoding="utf-8") as f:
+        reference_cells = json.load(f)
+    with open(os.path.join(batch_dir, "students.jsonl"), "r", encoding="utf-8") as f:
+        students = {student["student_id"]: student for student in map(json.loads, f)}
+    
+    result_files = [file_id for file_id in (batch.get("output_file_id"), batch.get("error_file_id")) if file_id]
+    for file_id in result_files:
+        for student_id, ai_response, usage, error in iter_batch_results(client.iter_file_lines(file_id)):
+            student = students.get(student_id)
+            if student is None:
+                continue
+            if error:
+                state["failed"][student_id] = error
+                continue
+            usage_metrics.record(usage)
+            analysis_result = parse_ai_response(ai_response)
+            analysis_result["error_highlights"] = build_error_highlights(student["cells"], reference_cells, analysis_result["cell_annotations"])
+            save_submission(
+                state["task_id"], student_id, student["name"], analysis_result,
+                {"type": "offline_batch", "batch_id": state["batch_id"], "model": state["model"]},
+                np.array(student["signature"], dtype=np.uint64) if student["signature"] is not None else None,
+                [tuple(h) for h in student["cell_hashes"]], state["reference_hash"]
+            )
+            state["stored"] += 1
+    logger.info(f"Offline batch {state['batch_id']}: stored {state['stored']} results, {len(state['failed'])} failed")
+
+def refresh_offline_batch(task_id, batch_id):
+    """
+    Check a batch once; store its results when it has completed. Returns the updated state.
+    Pollers and status requests of every worker process may call this at once: the batch's row
+    in the shared ledger decides which one stores the results, and a status saved by a slower
+    caller never overwrites the state of a batch that is being or has been stored.
+    """
+    state = load_offline_batch_state(task_id, batch_id)
+    if state is None or state["status"] in OFFLINE_BATCH_DONE:
+        return state
+    
+    client = BatchClient()
+    batch = client.get_batch(batch_id)
+    if batch["status"] != "completed":
+        with batch_ledger(task_id, batch_id, state["status"]) as entry:
+            if entry["status"] in OFFLINE_BATCH_DONE or entry["status"] == STORING:
+                return load_offline_batch_state(task_id, batch_id)
+            state["status"] = entry["status"] = batch["status"]
+            state["request_counts"] = batch.get("request_counts")
+            save_offline_batch_state(state)
+        return state
+    
+    if not claim_ingestion(task_id, batch_id, OFFLINE_BATCH_DONE):
+        # Stored already, or being stored by another caller
+        return load_offline_batch_state(task_id, batch_id)
+    try:
+        state = load_offline_batch_state(task_id, batch_id)
+        state["status"] = STORING
+        state["request_counts"] = batch.get("request_counts")
+        save_offline_batch_state(state)
+        store_offline_batch_results(state, client, batch)
+    except BaseException:
+        release_ingestion(task_id, batch_id)
+        raise
+    with batch_ledger(task_id, batch_id, STORING) as entry:
+        state["status"] = entry["status"] = "stored"
+        entry["lease_until"] = 0
+        save_offline_batch_state(state)
+    task_events.publish(task_id, task_events.BATCH, {
+        "batch_id": batch_id, "stored": state["stored"], "failed": len(state["failed"])
+    })
+    return state
+
+async def poll_offline_batch(task_id, batch_id):
+    while True:
+        await asyncio.sleep(offline_batch_poll_seconds)
         try:
-            parent_dir = os.path.abspath(os.path.join(os.getcwd(), ".."))
-            parent_file_path = os.path.join(parent_dir, "analysis_result.json")
-            with open(parent_file_path, "w", encoding='utf-8') as f:
-                json.dump(analysis_result, f, indent=2)
-                logger.info(f"Saved analysis result to parent directory: {parent_file_path}")
+            state = await asyncio.to_thread(refresh_offline_batch, task_id, batch_id)
         except Exception as e:
-            logger.error(f"Failed to save analysis result to parent directory: {str(e)}")
-        
-        # Validate the analysis result
-        if not analysis_result["detailed_feedback"]["strengths"] and not analysis_result["detailed_feedback"]["weaknesses"]:
-            logger.warning("Analysis result lacks both strengths and weaknesses")
-            # Add a default strength if none were extracted
-            analysis_result["detailed_feedback"]["strengths"] = ["Решение демонстрирует понимание основных математических концепций"]
-        
-        if not analysis_result["cell_annotations"]:
-            logger.warning("Analysis result lacks cell annotations")
-            # Try to extract some cell-level information from the weaknesses
-            for weakness in analysis_result["detailed_feedback"]["weaknesses"]:
-                cell_match = re.search(r'(?:cell|ячейка)\s*(\d+)', weakness, re.IGNORECASE)
-                if cell_match:
-                    cell_index = int(cell_match.group(1))
-                    analysis_result["cell_annotations"].append({
-                        "cell_index": cell_index,
-                        "comments": [weakness]
-                    })
+            logger.error(f"Error polling offline batch {batch_id}: {str(e)}")
+            continue
+        if state is None or state["status"] in OFFLINE_BATCH_DONE:
+            return
+
+def start_offline_batch_poller(task_id, batch_id):
+    poller = asyncio.create_task(poll_offline_batch(task_id, batch_id))
+    offline_batch_pollers.add(poller)
+    poller.add_done_callback(offline_batch_pollers.discard)
+
+@app.post("/api/tasks/{task_id}/offline-batch")
+async def create_offline_batch(
+    task_id: str,
+    notebook_files: List[UploadFile] = File(...),
+    reference_solution: UploadFile = File(...)
+):
+    """
+    Несрочная массовая проверка через пакетный API провайдера: дешевле и не расходует
+    лимит запросов интерактивной проверки. Результаты сохраняются по мере готовности пакета.
+    """
+    bind_log_context(task_id=task_id)
+    logger.info(f"Received offline batch request for task {task_id} with {len(notebook_files)} notebooks")
+    try:
+        reference_content, reference_hash = await read_upload_streaming(reference_solution)
+        reference_cells = await run_cpu(extract_cells_from_notebook, reference_content)
+        if not reference_cells:
+            raise HTTPException(status_code=400, detail="Не удалось проанализировать эталонное решение.")
+        reference_nb_repr = truncate_notebook_repr(reference_content, "Reference")
+        del reference_content
         
-        # Return the analysis result
-        return AnalysisResult(
-            error_summary=analysis_result["error_summary"],
-            detailed_feedback=analysis_result["detailed_feedback"],
-            confidence_score=analysis_result["confidence_score"],
-            grade=analysis_result["grade"],
-            cell_annotations=analysis_result["cell_annotations"],
-            error_highlights=[]  # Empty for now, will be enhanced in future
-        )
+        students = await read_batch_submissions(notebook_files, task_id)
+        if not students:
+            raise HTTPException(status_code=400, detail="Не удалось проанализировать ни один ноутбук.")
         
+        state = await asyncio.to_thread(
+            submit_offline_batch, task_id, students, reference_cells, reference_nb_repr, reference_hash
+        )
+        start_offline_batch_poller(task_id, state["batch_id"])
+        return state
+    
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error analyzing notebooks: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Ошибка анализа: {str(e)}")
+        logger.error(f"Error submitting offline batch for task {task_id}: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Не удалось отправить пакет на проверку: {str(e)}")
 
-@app.get("/api/export-report/{task_id}")
-async def export_report(task_id: str):
+@app.get("/api/tasks/{task_id}/offline-batch/{batch_id}")
+async def offline_batch_status(task_id: str, batch_id: str):
+    """Состояние пакета; если пакет готов, результаты сохраняются при этом запросе."""
+    bind_log_context(task_id=task_id)
+    try:
+        state = await asyncio.to_thread(refresh_offline_batch, task_id, batch_id)
+    except Exception as e:
+        logger.error(f"Error checking offline batch {batch_id}: {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Не удалось получить состояние пакета: {str(e)}")
+    if state is None:
+        raise HTTPException(status_code=404, detail="Пакет не найден")
+    return state
+
+@app.get("/api/tasks/{task_id}/similarity")
+async def similarity_report(task_id: str, threshold: float = None):
     """
-    Генерация Excel-отчета для заданий конкретной задачи
+    Отчет о похожих решениях (возможный плагиат) для задания
     """
-    logger.info(f"Generating Excel report for task ID: {task_id}")
+    bind_log_context(task_id=task_id)
+    threshold = similarity_report_threshold if threshold is None else threshold
+    index = await run_io(get_submission_index, task_id, os.path.join(os.getcwd(), "submissions"))
+    pairs = await run_io(index.similarity_report, threshold)
+    logger.info(f"Similarity report for task {task_id}: {len(pairs)} pairs above {threshold}")
+    return {
+        "task_id": task_id,
+        "threshold": threshold,
+        "submissions": len(index.entries),
+        "pairs": pairs
+    }
+
+# Page size of the submissions listing, and the most a client may ask for
+SUBMISSIONS_PAGE_SIZE = 50
+SUBMISSIONS_MAX_PAGE_SIZE = 200
+
+@app.get("/api/tasks/{task_id}/submissions")
+async def list_submissions(
+    task_id: str,
+    sort: str = "-date",
+    max_grade: Optional[float] = None,
+    max_confidence: Optional[float] = None,
+    weakness: Optional[str] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = SUBMISSIONS_PAGE_SIZE
+):
+    """
+    Страница проверенных работ задания. sort: grade, confidence, date или student_id, с минусом —
+    по убыванию. Фильтры: оценка ниже max_grade, уверенность ниже max_confidence, недочёт,
+    содержащий weakness. fields — нужные поля через запятую; следующая страница — по next_cursor.
+    """
+    bind_log_context(task_id=task_id)
+    if sort.lstrip("-") not in submission_catalog.SORT_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный ключ сортировки: {sort}")
+    selected = [field.strip() for field in fields.split(",") if field.strip()] if fields else list(submission_catalog.DEFAULT_FIELDS)
+    unknown = [field for field in selected if field not in submission_catalog.FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(unknown)}")
+    if not 1 <= limit <= SUBMISSIONS_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit должен быть от 1 до {SUBMISSIONS_MAX_PAGE_SIZE}")
+    
+    def load_page():
+        submission_catalog.sync_task(task_id, os.path.join(os.getcwd(), "submissions"))
+        return submission_catalog.query(task_id, sort, max_grade, max_confidence, weakness, cursor, limit)
     
     try:
-        # Define the path to the submissions directory for this task
-        submissions_dir = os.path.join(os.getcwd(), "submissions", task_id)
+        page = await run_io(load_page)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректный курсор: {str(e)}")
+    except sqlite3.Error as e:
+        logger.error(f"Error listing submissions of task {task_id}: {str(e)}")
+        raise HTTPException(status_code=503, detail="Каталог работ временно недоступен")
+    
+    return {
+        "task_id": task_id,
+        "total": page["total"],
+        "next_cursor": page["next_cursor"],
+        "items": [submission_catalog.project(document, selected) for document in page["documents"]]
+    }
+
+# Hits per page of the feedback search, and the most a client may ask for
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+@app.get("/api/search")
+async def search_feedback(
+    q: str,
+    task_id: Optional[List[str]] = Query(None),
+    limit: int = SEARCH_PAGE_SIZE,
+    offset: int = 0
+):
+    """
+    Полнотекстовый поиск по отзывам: сводке, подробному отзыву и комментариям к ячейкам. Слова
+    запроса ищутся в любой форме («определитель» найдёт «определителя»), все слова обязательны,
+    кроме служебных («в», «и», «для»…) и однобуквенных, которые не учитываются.
+    task_id (можно несколько раз) ограничивает поиск заданиями, например заданиями курса; без него
+    поиск идёт по всем заданиям. Совпадения в фрагментах выделены тегом <mark>.
+    """
+    if match_query(q) is None:
+        raise HTTPException(status_code=400, detail="В поисковом запросе нет слов для поиска")
+    if not 1 <= limit <= SEARCH_MAX_PAGE_SIZE or offset < 0:
+        raise HTTPException(status_code=400, detail=f"limit должен быть от 1 до {SEARCH_MAX_PAGE_SIZE}, offset — не меньше 0")
+    
+    def run_search():
+        submissions_root = os.path.join(os.getcwd(), "submissions")
+        # Tasks stored before the catalog existed are indexed on their first search
+        tasks = task_id or (os.listdir(submissions_root) if os.path.isdir(submissions_root) else [])
+        for name in tasks:
+            submission_catalog.sync_task(name, submissions_root)
+        return submission_catalog.search(q, task_id, limit, offset)
+    
+    started = time.perf_counter()
+    try:
+        result = await run_io(run_search)
+    except sqlite3.Error as e:
+        logger.error(f"Error searching feedback for {q!r}: {str(e)}")
+        raise HTTPException(status_code=503, detail="Поиск временно недоступен")
+    logger.info(f"Feedback search for {q!r}: {result['total']} hits in {time.perf_counter() - started:.3f}s")
+    
+    return {
+        "query": q,
+        "total": result["total"],
+        "hits": [
+            {
+                "task_id": hit["task_id"],
+                **submission_catalog.project(hit["document"], ["student_id", "name", "grade", "submission_date"]),
+                "snippets": hit["snippets"]
+            }
+            for hit in result["hits"]
+        ]
+    }
+
+# Interval of the comments that keep an idle event stream open through proxies (seconds)
+TASK_EVENT_KEEPALIVE = 15
+# How long a browser waits before reconnecting a dropped event stream (milliseconds)
+TASK_EVENT_RETRY_MS = 2000
+
+def format_sse(event):
+    """One event of a text/event-stream; the id is what a reconnecting client sends back as Last-Event-ID."""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+@app.get("/api/tasks/{task_id}/events")
+async def task_event_stream(request: Request, task_id: str, cursor: Optional[int] = None):
+    """
+    Поток событий задания (Server-Sent Events): результат каждой проверенной работы приходит
+    сразу после сохранения. После переподключения поток продолжается с заголовка Last-Event-ID
+    (или параметра cursor) и досылает пропущенные события; без курсора — только новые.
+    """
+    bind_log_context(task_id=task_id)
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id:
+        try:
+            cursor = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный заголовок Last-Event-ID")
+    resumed = cursor is not None
+    if cursor is None:
+        cursor = await run_io(task_events.latest_event_id)
+    disconnected = request.state.disconnected
+    
+    async def stream():
+        nonlocal cursor
+        # How long the browser waits before reconnecting, and where this subscription starts
+        yield f"retry: {TASK_EVENT_RETRY_MS}\n"
+        yield format_sse({"id": cursor, "type": "ready", "data": {"task_id": task_id, "cursor": cursor, "resumed": resumed}})
+        # The subscribers of a task in this process share one poll of the log
+        async with task_events.subscription(task_id, cursor) as feed:
+            while not disconnected.is_set():
+                events = await feed.events_after(cursor, TASK_EVENT_KEEPALIVE)
+                for event in events:
+                    cursor = event["id"]
+                    yield format_sse(event)
+                if not events:
+                    yield ": keepalive\n\n"
+        logger.debug(f"Event subscription of task {task_id} closed at event {cursor}")
+    
+    logger.info(f"Event subscription of task {task_id} from event {cursor}")
+    return StreamingResponse(
+        stream(), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def report_cache_key(task_id):
+    """
+    Key of the task's report in the shared cache: changes whenever a stored result is added,
+    removed or rewritten. None when the task has no stored results (the legacy fallback is not cached).
+    """
+    pattern = os.path.join(os.getcwd(), "submissions", glob.escape(task_id), "*", "analysis_result.json")
+    files = []
+    for path in sorted(glob.glob(pattern)):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append(f"{os.path.basename(os.path.dirname(path))}:{stat.st_mtime_ns}:{stat.st_size}")
+    if not files:
+        return None
+    digest = hashlib.sha256("\n".join(files).encode("utf-8")).hexdigest()
+    return f"{task_id}:{digest}"
+
+def collect_report_submissions(task_id):
+    """Load the stored submissions of a task for the report, falling back to the legacy result files."""
+    # Define the path to the submissions directory for this task
+    submissions_dir = os.path.join(os.getcwd(), "submissions", task_id)
+    
+    # Initialize submissions data
+    submissions_data = []
+    
+    # Check if the submissions directory exists
+    if os.path.exists(submissions_dir) and os.path.isdir(submissions_dir):
+        # Get all student subdirectories
+        student_dirs = [d for d in os.listdir(submissions_dir) 
+                       if os.path.isdir(os.path.join(submissions_dir, d))]
         
-        # Initialize submissions data
-        submissions_data = []
+        logger.info(f"Found {len(student_dirs)} student submissions for task {task_id}")
         
-        # Check if the submissions directory exists
-        if os.path.exists(submissions_dir) and os.path.isdir(submissions_dir):
-            # Get all student subdirectories
-            student_dirs = [d for d in os.listdir(submissions_dir) 
-                           if os.path.isdir(os.path.join(submissions_dir, d))]
-            
-            logger.info(f"Found {len(student_dirs)} student submissions for task {task_id}")
+        # Process each student's submission
+        for student_id in student_dirs:
+            student_dir = os.path.join(submissions_dir, student_id)
+            analysis_file = os.path.join(student_dir, "analysis_result.json")
             
-            # Process each student's submission
-            for student_id in student_dirs:
-                student_dir = os.path.join(submissions_dir, student_id)
-                analysis_file = os.path.join(student_dir, "analysis_result.json")
+            if os.path.exists(analysis_file):
+                try:
+                    with open(analysis_file, "r", encoding='utf-8') as f:
+                        student_data = json.load(f)
+                    
+                    # Add to submissions data - include all submissions regardless of name
+                    submissions_data.append(student_data)
+                    logger.debug(f"Added student {student_id} to the report")
+                except Exception as e:
+                    logger.error(f"Error reading analysis result for student {student_id}: {str(e)}")
+            else:
+                logger.warning(f"No analysis result found for student {student_id}")
+    
+    # If no submissions found in the new structure, try the legacy approach
+    if not submissions_data:
+        logger.info("Решения не найдены в новой структуре директорий. Пробуем устаревший подход.")
+        
+        # Make sure analysis files are available
+        ensure_analysis_files_available()
+        
+        # Log current working directory for debugging
+        current_dir = os.getcwd()
+        parent_dir = os.path.abspath(os.path.join(current_dir, ".."))
+        
+        # Define list of possible file paths to check in various locations
+        possible_paths = []
+        
+        # Look in current directory and parent directory for both files
+        for filename in ["analysis_result.json", "direct_analysis_result.json"]:
+            # Current directory
+            possible_paths.append(os.path.join(current_dir, filename))
+            # Parent directory 
+            possible_paths.append(os.path.join(parent_dir, filename))
+        
+        # Find all existing files and pick the most recent one
+        existing_files = []
+        for file_path in possible_paths:
+            if os.path.exists(file_path):
+                mod_time = os.path.getmtime(file_path)
+                file_size = os.path.getsize(file_path)
+                existing_files.append((file_path, mod_time, file_size))
+        
+        # Sort files by modification time (most recent first)
+        existing_files.sort(key=lambda x: x[1], reverse=True)
+        
+        analysis_result = None
+        if existing_files:
+            # Use the most recent file
+            most_recent_file = existing_files[0][0]
+            logger.info(f"Using most recent file: {most_recent_file}")
+            try:
+                with open(most_recent_file, "r", encoding='utf-8') as f:
+                    analysis_result = json.load(f)
+                logger.info(f"Successfully loaded analysis result from {most_recent_file}")
+            except Exception as e:
+                logger.error(f"Failed to load analysis result from {most_recent_file}: {str(e)}")
                 
-                if os.path.exists(analysis_file):
+                # Try other files if available
+                for file_path, _, _ in existing_files[1:]:
                     try:
-                        with open(analysis_file, "r", encoding='utf-8') as f:
-                            student_data = json.load(f)
-                        
-                        # Add to submissions data - include all submissions regardless of name
-                        submissions_data.append(student_data)
-                        logger.info(f"Added student {student_id} to the report")
-                    except Exception as e:
-                        logger.error(f"Error reading analysis result for student {student_id}: {str(e)}")
-                else:
-                    logger.warning(f"No analysis result found for student {student_id}")
+                        logger.debug(f"Trying alternate file: {file_path}")
+                        with open(file_path, "r", encoding='utf-8') as f:
+                            analysis_result = json.load(f)
+                        logger.info(f"Successfully loaded analysis result from {file_path}")
+                        break
+                    except Exception as e2:
+                        logger.error(f"Failed to load analysis result from {file_path}: {str(e2)}")
         
-        # If no submissions found in the new structure, try the legacy approach
-        if not submissions_data:
-            logger.info("Решения не найдены в новой структуре директорий. Пробуем устаревший подход.")
-            
-            # Make sure analysis files are available
-            ensure_analysis_files_available()
-            
-            # Log current working directory for debugging
-            current_dir = os.getcwd()
-            parent_dir = os.path.abspath(os.path.join(current_dir, ".."))
-            
-            # Define list of possible file paths to check in various locations
-            possible_paths = []
-            
-            # Look in current directory and parent directory for both files
-            for filename in ["analysis_result.json", "direct_analysis_result.json"]:
-                # Current directory
-                possible_paths.append(os.path.join(current_dir, filename))
-                # Parent directory 
-                possible_paths.append(os.path.join(parent_dir, filename))
+        # If analysis result found, create a mock submission
+        if analysis_result:
+            # Extract notebook info and student information
+            assignment_topic = "Неизвестная тема"
+            student_name = "Студент"
             
-            # Find all existing files and pick the most recent one
-            existing_files = []
-            for file_path in possible_paths:
-                if os.path.exists(file_path):
-                    mod_time = os.path.getmtime(file_path)
-                    file_size = os.path.getsize(file_path)
-                    existing_files.append((file_path, mod_time, file_size))
+            # Try to extract assignment topic and student name from filenames
+            notebook_files = []
+            student_files = glob.glob(os.path.join(parent_dir, "решение_студента*.ipynb"))
+            notebook_files.extend(student_files)
+            student_files = glob.glob(os.path.join(current_dir, "решение_студента*.ipynb"))
+            notebook_files.extend(student_files)
             
-            # Sort files by modification time (most recent first)
-            existing_files.sort(key=lambda x: x[1], reverse=True)
-            
-            analysis_result = None
-            if existing_files:
-                # Use the most recent file
-                most_recent_file = existing_files[0][0]
-                logger.info(f"Using most recent file: {most_recent_file}")
-                try:
-                    with open(most_recent_file, "r", encoding='utf-8') as f:
-                        analysis_result = json.load(f)
-                    logger.info(f"Successfully loaded analysis result from {most_recent_file}")
-                except Exception as e:
-                    logger.error(f"Failed to load analysis result from {most_recent_file}: {str(e)}")
-                    
-                    # Try other files if available
-                    for file_path, _, _ in existing_files[1:]:
-                        try:
-                            logger.info(f"Trying alternate file: {file_path}")
-                            with open(file_path, "r", encoding='utf-8') as f:
-                                analysis_result = json.load(f)
-                            logger.info(f"Successfully loaded analysis result from {file_path}")
-                            break
-                        except Exception as e2:
-                            logger.error(f"Failed to load analysis result from {file_path}: {str(e2)}")
-            
-            # If analysis result found, create a mock submission
-            if analysis_result:
-                # Extract notebook info and student information
-                assignment_topic = "Неизвестная тема"
-                student_name = "Студент"
-                
-                # Try to extract assignment topic and student name from filenames
-                notebook_files = []
-                student_files = glob.glob(os.path.join(parent_dir, "решение_студента*.ipynb"))
-                notebook_files.extend(student_files)
-                student_files = glob.glob(os.path.join(current_dir, "решение_студента*.ipynb"))
-                notebook_files.extend(student_files)
-                
-                if notebook_files:
-                    # Extract student name from filename
-                    filename = os.path.basename(notebook_files[0])
-                    if "_ellipse" in filename:
-                        assignment_topic = "Эллипс"
-                    elif "_complex" in filename:
-                        assignment_topic = "Комплексные числа"
-                    
-                    # Try to get a more specific student name if available
-                    student_name_match = re.search(r'(?:решение_студента|student_solution)_([^\.]+)\.ipynb', filename)
-                    if student_name_match:
-                        student_name = student_name_match.group(1).strip()
-                        if not student_name:
-                            student_name = "Студент"
+            if notebook_files:
+                # Extract student name from filename
+                filename = os.path.basename(notebook_files[0])
+                if "_ellipse" in filename:
+                    assignment_topic = "Эллипс"
+                elif "_complex" in filename:
+                    assignment_topic = "Комплексные числа"
                 
-                # Create a submission entry with the loaded analysis result
-                submissions_data.append({
-                    "student_id": f"{student_name}_{task_id}",
-                    "name": f"{student_name} - {assignment_topic}",
-                    "email": "студент@example.edu",
-                    "submission_date": datetime.now().strftime("%Y-%m-%d"),
-                    "analysis_result": analysis_result
-                })
-                logger.info(f"Создана запись решения по устаревшему методу для студента: {student_name}")
-        
-        # If still no submissions, create a dummy entry
-        if not submissions_data:
-            logger.warning("Не найдены корректные результаты анализа. Создаём тестовый отчёт.")
-            submissions_data = [
-                {
-                    "student_id": "Неизвестно",
-                    "name": "Тестовый студент",
-                    "email": "студент@example.edu",
-                    "submission_date": datetime.now().strftime("%Y-%m-%d"),
-                    "analysis_result": {
-                        "error_summary": "Это тестовый отчет анализа. Реальный анализ не проводился.",
-                        "detailed_feedback": {
-                            "strengths": ["Это тестовое преимущество"],
-                            "weaknesses": ["Это тестовый недостаток"],
-                            "suggestions": ["Это тестовое предложение"]
-                        },
-                        "confidence_score": 0.5,
-                        "grade": 0.0,
-                        "cell_annotations": [
-                            {"cell_index": 0, "comments": ["Тестовый комментарий"]}
-                        ],
-                        "error_highlights": []
-                    }
+                # Try to get a more specific student name if available
+                student_name_match = re.search(r'(?:решение_студента|student_solution)_([^\.]+)\.ipynb', filename)
+                if student_name_match:
+                    student_name = student_name_match.group(1).strip()
+                    if not student_name:
+                        student_name = "Студент"
+            
+            # Create a submission entry with the loaded analysis result
+            submissions_data.append({
+                "student_id": f"{student_name}_{task_id}",
+                "name": f"{student_name} - {assignment_topic}",
+                "email": "студент@example.edu",
+                "submission_date": datetime.now().strftime("%Y-%m-%d"),
+                "analysis_result": analysis_result
+            })
+            logger.info(f"Создана запись решения по устаревшему методу для студента: {student_name}")
+    
+    # If still no submissions, create a dummy entry
+    if not submissions_data:
+        logger.warning("Не найдены корректные результаты анализа. Создаём тестовый отчёт.")
+        submissions_data = [
+            {
+                "student_id": "Неизвестно",
+                "name": "Тестовый студент",
+                "email": "студент@example.edu",
+                "submission_date": datetime.now().strftime("%Y-%m-%d"),
+                "analysis_result": {
+                    "error_summary": "Это тестовый отчет анализа. Реальный анализ не проводился.",
+                    "detailed_feedback": {
+                        "strengths": ["Это тестовое преимущество"],
+                        "weaknesses": ["Это тестовый недостаток"],
+                        "suggestions": ["Это тестовое предложение"]
+                    },
+                    "confidence_score": 0.5,
+                    "grade": 0.0,
+                    "cell_annotations": [
+                        {"cell_index": 0, "comments": ["Тестовый комментарий"]}
+                    ],
+                    "error_highlights": []
                 }
-            ]
-        
-        # Use our utility function to create the Excel report
-        output = create_excel_report(task_id, submissions_data)
-        excel_data = output.getvalue()
-        
-        # Create a response with the Excel file
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"proofmate_отчет_{task_id}_{timestamp}.xlsx"
+            }
+        ]
+    
+    return submissions_data
+
+@app.get("/api/export-report/{task_id}")
+async def export_report(task_id: str):
+    """
+    Генерация Excel-отчета для заданий конкретной задачи
+    """
+    bind_log_context(task_id=task_id)
+    logger.info(f"Generating Excel report for task ID: {task_id}")
+    
+    try:
+        # A report of unchanged submissions is served from the shared cache
+        cache_key = await run_io(report_cache_key, task_id)
+        excel_data = await run_io(report_cache.get, cache_key) if cache_key else None
+        if excel_data is not None:
+            logger.info(f"Excel-отчёт для задания {task_id} взят из кэша")
+            return excel_report_response(task_id, excel_data)
         
-        headers = {
-            'Content-Disposition': f'attachment; filename="{filename}"',
-            'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        }
+        # Reading the stored results and building the workbook must not block other requests
+        submissions_data = await run_io(collect_report_submissions, task_id)
+        excel_data = await run_cpu(build_excel_report, task_id, submissions_data)
+        if cache_key:
+            await run_io(report_cache.set, cache_key, excel_data)
         
         logger.info(f"Excel-отчёт успешно создан для задания: {task_id} с {len(submissions_data)} решениями")
-        return Response(content=excel_data, headers=headers)
+        return excel_report_response(task_id, excel_data)
         
     except Exception as e:
         logger.error(f"Error generating Excel report for task ID {task_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Ошибка создания отчета: {str(e)}")
 
+@app.on_event("startup")
+async def check_shared_store():
+    """Refuse to start with the shared SQLite store on a network filesystem, where WAL corrupts it."""
+    check_local_filesystem()
+
+@app.on_event("startup")
+async def start_local_job_workers():
+    if job_broker.local:
+        local_job_workers.append(asyncio.create_task(
+            process_jobs(job_broker, run_analysis_job, f"local-{os.getpid()}")
+        ))
+
+@app.on_event("startup")
+async def resume_offline_batches():
+    """Poll the batches a restart left unfinished again; the ledger keeps workers from storing one twice."""
+    try:
+        batches = await run_io(unfinished_batches, OFFLINE_BATCH_DONE)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not list unfinished offline batches: {str(e)}")
+        return
+    for task_id, batch_id in batches:
+        start_offline_batch_poller(task_id, batch_id)
+    if batches:
+        logger.info(f"Resumed polling of {len(batches)} offline batches")
+
+@app.on_event("shutdown")
+async def stop_worker_pools():
+    for worker in local_job_workers:
+        worker.cancel()
+    local_job_workers.clear()
+    shutdown_pools()
+
 if __name__ == "__main__":
+    import uvicorn
+    
     port = int(os.environ.get("PYTHON_SERVER_PORT", 8000))
     uvicorn.run("main_functional:app", host="0.0.0.0", port=port, reload=True) 
\ No newline at end of file
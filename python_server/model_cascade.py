@@ -0,0 +1,91 @@
+import os
+import threading
+import logging
+from collections import Counter
+from typing import Dict, Any, Optional, List
+
+logger = logging.getLogger("proofmate.model_cascade")
+
+# The large model grades alone unless the cascade is enabled
+analysis_model = os.getenv("ANALYSIS_MODEL", "gpt-4o")
+cascade_enabled = os.getenv("CASCADE_ENABLED", "false").lower() == "true"
+cascade_small_model = os.getenv("CASCADE_SMALL_MODEL", "gpt-4o-mini")
+cascade_min_confidence = float(os.getenv("CASCADE_MIN_CONFIDENCE", "0.75"))
+# Grades in this band decide pass/fail and always get a second opinion
+cascade_borderline_low = float(os.getenv("CASCADE_BORDERLINE_LOW", "4"))
+cascade_borderline_high = float(os.getenv("CASCADE_BORDERLINE_HIGH", "6"))
+
+
+def local_verdict(execution_check: Optional[Dict[str, Any]], symbolic_check: Optional[Dict[str, Any]]) -> Optional[str]:
+    """What the deterministic checks say about the submission: "correct", "wrong" or None when they ran nothing."""
+    if execution_check is None and symbolic_check is None:
+        return None
+    execution_check = execution_check or {}
+    symbolic_check = symbolic_check or {}
+    if execution_check.get("all_match") or symbolic_check.get("all_identical"):
+        return "correct"
+    if execution_check.get("mismatched_cells") or any(task.get("verdict") == "different" for task in symbolic_check.get("tasks", [])):
+        return "wrong"
+    return None
+
+
+def escalation_reasons(analysis: Dict[str, Any], execution_check: Optional[Dict[str, Any]] = None,
+                       symbolic_check: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Why the small model's analysis must be redone by the large model; empty if it can be kept."""
+    reasons = []
+    if analysis["confidence_score"] < cascade_min_confidence:
+        reasons.append("low_confidence")
+    if cascade_borderline_low <= analysis["grade"] <= cascade_borderline_high:
+        reasons.append("borderline_grade")
+
+    verdict = local_verdict(execution_check, symbolic_check)
+    if verdict == "correct" and analysis["grade"] < cascade_borderline_high:
+        reasons.append("disagrees_with_checks")
+    elif verdict == "wrong" and analysis["grade"] >= 9:
+        reasons.append("disagrees_with_checks")
+    return reasons
+
+
+class CascadeMetrics:
+    """Counters of the model cascade, updated from the worker threads that call the API."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.escalations = 0
+        self.reasons = Counter()
+        self.latency = {"small": 0.0, "large": 0.0}
+        self.calls = {"small": 0, "large": 0}
+
+    def record_call(self, tier: str, seconds: float):
+        with self._lock:
+            self.calls[tier] += 1
+            self.latency[tier] += seconds
+
+    def record_request(self, reasons: List[str]):
+        with self._lock:
+            self.requests += 1
+            if reasons:
+                self.escalations += 1
+                self.reasons.update(reasons)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            mean = {tier: self.latency[tier] / self.calls[tier] if self.calls[tier] else None for tier in self.calls}
+            kept = self.requests - self.escalations
+            # Requests answered by the small model alone would otherwise have waited for the large one
+            saved = (mean["large"] - mean["small"]) * kept if mean["large"] is not None and mean["small"] is not None else None
+            return {
+                "enabled": cascade_enabled,
+                "small_model": cascade_small_model,
+                "large_model": analysis_model,
+                "requests": self.requests,
+                "escalations": self.escalations,
+                "escalation_rate": self.escalations / self.requests if self.requests else 0.0,
+                "escalation_reasons": dict(self.reasons),
+                "mean_latency_seconds": mean,
+                "estimated_latency_saved_seconds": saved
+            }
+
+
+cascade_metrics = CascadeMetrics()
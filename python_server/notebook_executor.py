@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import shutil
+import signal
+import logging
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+from task_segmenter import graded_sections
+
+logger = logging.getLogger("proofmate.notebook_executor")
+
+RUNNER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "notebook_runner.py")
+
+# Sandbox limits for one notebook run
+execution_timeout = float(os.getenv("EXECUTION_TIMEOUT", "30"))
+execution_cpu_seconds = int(os.getenv("EXECUTION_CPU_SECONDS", "20"))
+execution_memory_mb = int(os.getenv("EXECUTION_MEMORY_MB", "1024"))
+execution_workers = int(os.getenv("EXECUTION_WORKERS", str(os.cpu_count() or 1)))
+# namespaces: the runner confines itself in its own user, mount, network and pid namespaces
+# (needs util-linux unshare and unprivileged user namespaces); none: resource limits only, for
+# development on machines without them. Nothing runs if the namespaces are asked for but missing.
+execution_sandbox = os.getenv("EXECUTION_SANDBOX", "namespaces").lower()
+
+# Tolerance used to compare numeric outputs with the reference
+execution_rtol = float(os.getenv("EXECUTION_RTOL", "1e-6"))
+execution_atol = float(os.getenv("EXECUTION_ATOL", "1e-9"))
+
+_pool = None
+
+
+def sandbox_isolated() -> bool:
+    """Whether student code runs confined (no server files, no network) rather than with limits only."""
+    return execution_sandbox != "none"
+
+
+def sandbox_command() -> Optional[List[str]]:
+    """The command line of a sandboxed run, or None if the sandbox cannot be set up here."""
+    memory = execution_memory_mb * 1024 * 1024
+    # Limits are set by prlimit before exec: no preexec_fn, which is unsafe in a threaded server
+    command = ["prlimit", f"--cpu={execution_cpu_seconds}", f"--as={memory}", f"--fsize={1024 * 1024}", "--core=0", "--"]
+    if sandbox_isolated():
+        command += ["unshare", "--user", "--map-root-user", "--mount", "--net", "--pid", "--ipc", "--uts",
+                    "--fork", "--kill-child", "--"]
+    if any(shutil.which(tool) is None for tool in command if tool in ("prlimit", "unshare")):
+        return None
+    return command + [sys.executable, "-I", RUNNER_PATH] + (["--confine"] if sandbox_isolated() else [])
+
+
+def _kill_session(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_sandboxed(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run notebook_runner.py with the given request in an isolated, resource-limited process.
+    The result comes back on a pipe of its own, not on stdout, which the cells write to.
+    Returns {"ok": True, "result": {...}} or {"ok": False, "error": str}.
+    """
+    command = sandbox_command()
+    if command is None:
+        logger.error("Notebook execution sandbox is unavailable (prlimit/unshare not found)")
+        return {"ok": False, "error": "Песочница для выполнения кода недоступна"}
+
+    read_end, write_end = os.pipe()
+    chunks = []
+    reader = threading.Thread(target=lambda: chunks.extend(iter(lambda: os.read(read_end, 65536), b"")), daemon=True)
+    with tempfile.TemporaryDirectory(prefix="proofmate_exec_") as workdir:
+        try:
+            process = subprocess.Popen(
+                command + ["--result-fd", str(write_end)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                cwd=workdir,
+                env={"PATH": "/usr/bin:/bin", "HOME": "/tmp", "MPLBACKEND": "Agg", "OMP_NUM_THREADS": "1", "OPENBLAS_NUM_THREADS": "1"},
+                pass_fds=(write_end,),
+                start_new_session=True,
+                text=True
+            )
+        finally:
+            os.close(write_end)
+        reader.start()
+        try:
+            _, stderr = process.communicate(json.dumps(payload), timeout=execution_timeout)
+        except subprocess.TimeoutExpired:
+            _kill_session(process)
+            process.communicate()
+            logger.warning(f"Sandboxed run timed out after {execution_timeout}s")
+            return {"ok": False, "error": f"Превышено время выполнения ({execution_timeout} с)"}
+        finally:
+            # Processes the cells may have forked must not outlive the run
+            _kill_session(process)
+            reader.join(timeout=5)
+            os.close(read_end)
+
+    try:
+        return {"ok": True, "result": json.loads(b"".join(chunks))}
+    except ValueError:
+        logger.warning(f"Sandboxed run failed with exit code {process.returncode}: {stderr[-500:]}")
+        return {"ok": False, "error": f"Процесс выполнения завершился с кодом {process.returncode}"}
+
+
+def execute_cells(cells: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Run the code cells of a notebook in the sandbox.
+    Returns {"ok": bool, "error": str|None, "cells": {cell_index: cell_result}}.
+    """
+    code_cells = [
+        {"index": cell["index"], "content": cell.get("content", "")}
+        for cell in cells if cell.get("type") == "code" and cell.get("content", "").strip()
+    ]
+    if not code_cells:
+        return {"ok": True, "error": None, "cells": {}}
+
+    run = run_sandboxed({"cells": code_cells})
+    if not run["ok"]:
+        return {"ok": False, "error": run["error"], "cells": {}}
+    return {"ok": True, "error": None, "cells": {cell["index"]: cell for cell in run["result"]["cells"]}}
+
+
+def execute_notebooks(notebooks: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Run several notebooks in parallel, one sandboxed process each, up to EXECUTION_WORKERS at a time."""
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=execution_workers, thread_name_prefix="notebook-exec")
+    return list(_pool.map(execute_cells, notebooks))
+
+
+def _numbers_match(a, b) -> bool:
+    # Complex values are serialized as {"re": ..., "im": ...}, symbolic ones as strings
+    a = complex(a["re"], a["im"]) if isinstance(a, dict) else a
+    b = complex(b["re"], b["im"]) if isinstance(b, dict) else b
+    if isinstance(a, str) or isinstance(b, str):
+        return a == b
+    return abs(a - b) <= execution_atol + execution_rtol * abs(b)
+
+
+def outputs_match(student_output: Optional[Dict[str, Any]], reference_output: Dict[str, Any]) -> bool:
+    """Compare a captured student value with the reference value within tolerance."""
+    if student_output is None or student_output.get("kind") != reference_output.get("kind"):
+        return False
+
+    kind = reference_output["kind"]
+    if kind == "number":
+        return _numbers_match(student_output["value"], reference_output["value"])
+    if kind == "matrix":
+        if student_output["shape"] != reference_output["shape"]:
+            return False
+        return all(
+            _numbers_match(a, b)
+            for row_a, row_b in zip(student_output["values"], reference_output["values"])
+            for a, b in zip(row_a, row_b)
+        )
+    if kind == "sequence":
+        return len(student_output["values"]) == len(reference_output["values"]) and all(
+            _numbers_match(a, b) for a, b in zip(student_output["values"], reference_output["values"])
+        )
+    return student_output.get("value") == reference_output.get("value")
+
+
+def compare_executions(student_run: Dict[str, Any], reference_run: Dict[str, Any],
+                       reference_cells: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Compare the values of aligned cells (same notebook cell index) that produced
+    a checkable value in the reference run. A task of the reference is verified when some of its
+    cells were compared and all of them match; tasks whose reference produced nothing checkable
+    (text, plots, assignments only) are unchecked, and all_match requires that there are none.
+    """
+    checked = []
+    mismatched = []
+    failed = []
+
+    for cell_index, reference_cell in reference_run.get("cells", {}).items():
+        reference_output = reference_cell.get("output")
+        if not reference_cell.get("ok") or not reference_output or reference_output.get("kind") == "text":
+            continue
+        checked.append(cell_index)
+
+        student_cell = student_run.get("cells", {}).get(cell_index)
+        if student_cell is None or not student_cell.get("ok"):
+            failed.append(cell_index)
+        elif not outputs_match(student_cell.get("output"), reference_output):
+            mismatched.append(cell_index)
+
+    verified_tasks = []
+    unchecked_tasks = []
+    wrong = set(mismatched) | set(failed)
+    for section in graded_sections(reference_cells):
+        section_cells = {cell["index"] for cell in section["cells"]}
+        if not section_cells & set(checked):
+            unchecked_tasks.append(section["label"])
+        elif student_run.get("ok", False) and not section_cells & wrong:
+            verified_tasks.append(section["label"])
+
+    return {
+        "checked_cells": checked,
+        "mismatched_cells": mismatched,
+        "failed_cells": failed,
+        "verified_tasks": verified_tasks,
+        "unchecked_tasks": unchecked_tasks,
+        "all_match": (bool(checked) and student_run.get("ok", False) and not mismatched and not failed
+                      and not unchecked_tasks)
+    }
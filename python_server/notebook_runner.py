@@ -0,0 +1,400 @@
+"""
+Executes notebook code cells inside a sandboxed worker process started by notebook_executor.
+
+Reads {"cells": [{"index": ..., "content": ...}]} as JSON on stdin and writes one JSON
+object with the captured value of every cell to the result pipe (the fd given as
+--result-fd). Cells share one namespace, like a notebook kernel; the value of a cell is
+the value of its last expression.
+
+With --confine the process first isolates itself: it is started by notebook_executor in
+fresh user, mount, network, pid and IPC namespaces, and before any student code runs it
+changes root to a tmpfs holding read-only binds of the system and Python directories only
+(no server files, no /proc) and drops every capability. The cells then run in a forked
+child that does not hold the result pipe: this process collects the child's records,
+checks them against the requested cells and is the only writer of the result.
+
+With {"mode": "compare", "pairs": [[student_srepr, reference_srepr], ...]} it instead
+rebuilds the sympy answers from their srepr strings and decides whether they are
+equivalent. srepr strings come from student processes, so they are only evaluated if they
+are made of sympy constructors and literals, and only here, inside the sandbox.
+"""
+import io
+import os
+import re
+import sys
+import ast
+import json
+import math
+import random
+import signal
+import ctypes
+import contextlib
+import traceback
+
+MAX_TEXT = 2000
+# Longest srepr string the compare mode evaluates
+MAX_SREPR = 20000
+# Strings an srepr may pass to a constructor: symbol names and numbers, never anything sympify
+# would parse as code
+SREPR_STRING = re.compile(r"[^\W\d]\w*|[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?(?:/\d+)?")
+
+
+def to_scalar(value):
+    """Convert a number-like value to a JSON scalar, or its string form for symbolic values."""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int):
+        return value if abs(value) < 2 ** 53 else float(value)
+    if isinstance(value, float):
+        return value if math.isfinite(value) else str(value)
+    if isinstance(value, complex):
+        return {"re": value.real, "im": value.imag}
+
+    sympy = sys.modules.get("sympy")
+    if sympy is not None and isinstance(value, sympy.Basic):
+        if value.is_Integer:
+            return to_scalar(int(value))
+        if value.is_number:
+            try:
+                number = complex(value)
+                return number.real if number.imag == 0 else {"re": number.real, "im": number.imag}
+            except (TypeError, ValueError):
+                pass
+        return str(value)
+
+    numpy = sys.modules.get("numpy")
+    if numpy is not None and isinstance(value, numpy.generic):
+        return to_scalar(value.item())
+
+    return str(value)
+
+
+def to_output(value):
+    """Describe the value of a cell in a JSON-friendly form."""
+    if value is None:
+        return None
+
+    sympy = sys.modules.get("sympy")
+    numpy = sys.modules.get("numpy")
+
+    if sympy is not None and isinstance(value, sympy.MatrixBase):
+        return {
+            "kind": "matrix",
+            "shape": list(value.shape),
+            "values": [[to_scalar(value[i, j]) for j in range(value.shape[1])] for i in range(value.shape[0])],
+            "srepr": sympy.srepr(value)
+        }
+    if numpy is not None and isinstance(value, numpy.ndarray) and value.ndim <= 2:
+        matrix = value.reshape(1, -1) if value.ndim == 1 else value
+        return {
+            "kind": "matrix",
+            "shape": list(matrix.shape),
+            "values": [[to_scalar(item) for item in row] for row in matrix.tolist()]
+        }
+    if sympy is not None and isinstance(value, sympy.Basic):
+        scalar = to_scalar(value)
+        if not isinstance(scalar, str):
+            return {"kind": "number", "value": scalar, "srepr": sympy.srepr(value)}
+        return {"kind": "expr", "value": scalar, "srepr": sympy.srepr(value)}
+    if isinstance(value, (bool, int, float, complex)) or (numpy is not None and isinstance(value, numpy.generic)):
+        return {"kind": "number", "value": to_scalar(value)}
+    if isinstance(value, (list, tuple)) and all(not isinstance(v, (list, tuple, dict)) for v in value):
+        return {"kind": "sequence", "values": [to_scalar(v) for v in value]}
+    return {"kind": "text", "value": repr(value)[:MAX_TEXT]}
+
+
+def run_cell(source, namespace):
+    """Run one cell, returning the value of its trailing expression (if any)."""
+    tree = ast.parse(source, mode="exec")
+    last_expression = None
+    if tree.body and isinstance(tree.body[-1], ast.Expr):
+        last_expression = ast.Expression(tree.body.pop().value)
+
+    exec(compile(tree, "<cell>", "exec"), namespace)
+    if last_expression is not None:
+        return eval(compile(last_expression, "<cell>", "eval"), namespace)
+    return None
+
+
+class CheckTimeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise CheckTimeout()
+
+
+def is_zero(expression, seconds):
+    """
+    Decide whether a sympy expression is identically zero: simplify() first
+    (bounded by an alarm), then evaluation at random points.
+    Returns True, False or None when undecidable.
+    """
+    import sympy
+
+    signal.signal(signal.SIGALRM, _on_alarm)
+    signal.alarm(seconds)
+    try:
+        if sympy.simplify(expression) == 0:
+            return True
+    except CheckTimeout:
+        pass
+    finally:
+        signal.alarm(0)
+
+    symbols = sorted(expression.free_symbols, key=str)
+    rng = random.Random(0)
+    evaluated = 0
+    for _ in range(6):
+        point = {symbol: sympy.Rational(rng.randint(-97, 97), rng.randint(1, 13)) for symbol in symbols}
+        try:
+            value = complex(sympy.N(expression.subs(point), 30))
+        except (TypeError, ValueError, ZeroDivisionError):
+            continue
+        if not math.isfinite(abs(value)):
+            continue
+        if abs(value) > 1e-9:
+            return False
+        evaluated += 1
+    return True if evaluated else None
+
+
+def _is_sympy_name(value):
+    """A sympy class (Integer, Symbol, MutableDenseMatrix, sin...) or constant (pi, oo, I)."""
+    import sympy
+    if isinstance(value, type):
+        return issubclass(value, (sympy.Basic, sympy.MatrixBase))
+    return isinstance(value, sympy.Basic)
+
+
+def parse_srepr(text):
+    """
+    Rebuild a sympy object from its srepr string, which must consist of sympy classes and
+    constants called with literal arguments; anything else (attributes, other names, operators,
+    strings that are not symbol names or numbers) is refused with ValueError, not evaluated.
+    """
+    import sympy
+
+    if not isinstance(text, str) or len(text) > MAX_SREPR:
+        raise ValueError("srepr too long")
+    tree = ast.parse(text, mode="eval")
+    names = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name):
+                raise ValueError("not a sympy constructor")
+        elif isinstance(node, ast.Name):
+            value = getattr(sympy, node.id, None)
+            if not _is_sympy_name(value):
+                raise ValueError(f"unexpected name {node.id}")
+            names[node.id] = value
+        elif isinstance(node, ast.Constant):
+            if isinstance(node.value, str):
+                if not SREPR_STRING.fullmatch(node.value):
+                    raise ValueError("unexpected string")
+            elif not isinstance(node.value, (int, float, bool, type(None))):
+                raise ValueError("unexpected constant")
+        elif not isinstance(node, (ast.Expression, ast.List, ast.Tuple, ast.keyword, ast.Load,
+                                   ast.UnaryOp, ast.USub)):
+            raise ValueError(f"unexpected {type(node).__name__}")
+    return eval(compile(tree, "<srepr>", "eval"), {"__builtins__": {}}, names)
+
+
+def compare_answer(student_srepr, reference_srepr, seconds):
+    """Verdict for one answer: identical, equivalent, different or unknown."""
+    import sympy
+
+    try:
+        student = parse_srepr(student_srepr)
+        reference = parse_srepr(reference_srepr)
+    except Exception:
+        return "unknown"
+
+    if student == reference:
+        return "identical"
+
+    student_is_matrix = isinstance(student, sympy.MatrixBase)
+    if student_is_matrix != isinstance(reference, sympy.MatrixBase):
+        return "different"
+
+    if student_is_matrix:
+        if student.shape != reference.shape:
+            return "different"
+        verdicts = [is_zero(a - b, seconds) for a, b in zip(student, reference)]
+    else:
+        try:
+            verdicts = [is_zero(student - reference, seconds)]
+        except TypeError:
+            return "different"
+
+    if any(verdict is False for verdict in verdicts):
+        return "different"
+    if all(verdict is True for verdict in verdicts):
+        return "equivalent"
+    return "unknown"
+
+
+# Linux constants for the confinement
+_MS_RDONLY, _MS_NOSUID, _MS_NODEV, _MS_NOEXEC = 1, 2, 4, 8
+_MS_REMOUNT, _MS_BIND, _MS_REC, _MS_PRIVATE = 32, 4096, 16384, 1 << 18
+_PR_SET_DUMPABLE, _PR_CAPBSET_DROP, _PR_SET_NO_NEW_PRIVS = 4, 24, 38
+_SYS_CAPSET = 126
+_LINUX_CAPABILITY_VERSION_3 = 0x20080522
+
+
+def _check(result, what):
+    if result != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, f"{what}: {os.strerror(error)}")
+
+
+def confine():
+    """
+    Isolate this process before running anything untrusted. Expects to be started by
+    `unshare --user --map-root-user --mount --net --pid --ipc --uts --fork`: it is root of its own
+    user namespace, so it may mount, and has no network. The working directory becomes the root.
+    """
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.mount.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_ulong, ctypes.c_char_p]
+
+    def mount(source, target, fstype, flags, data=None):
+        _check(libc.mount(
+            source and source.encode(), target.encode(), fstype and fstype.encode(), flags, data and data.encode()
+        ), f"mount {target}")
+
+    mount(None, "/", None, _MS_REC | _MS_PRIVATE)
+    root = os.getcwd()
+    mount("tmpfs", root, "tmpfs", _MS_NOSUID | _MS_NODEV, "size=64m,mode=755")
+
+    # What Python and the libraries it loads need, read-only
+    paths = {"/usr", "/lib", "/lib64", "/bin", "/etc/ld.so.cache", "/etc/localtime",
+             "/dev/null", "/dev/zero", "/dev/urandom",
+             sys.prefix, sys.base_prefix, sys.exec_prefix}
+    # Not the directory of this script, the server's: before Python 3.11, -I keeps it on sys.path
+    server_dir = os.path.dirname(os.path.abspath(__file__))
+    paths.update(path for path in sys.path if os.path.isdir(path) and os.path.abspath(path) != server_dir)
+    for path in sorted(paths):
+        if not os.path.exists(path):
+            continue
+        real = os.path.realpath(path)
+        target = root + path
+        if os.path.isdir(real):
+            os.makedirs(target, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            open(target, "a").close()
+        mount(real, target, None, _MS_BIND | _MS_REC)
+        # A read-only remount must keep the flags the host mount already had
+        locked = os.statvfs(target).f_flag & (_MS_NOSUID | _MS_NODEV | _MS_NOEXEC)
+        mount(None, target, None, _MS_BIND | _MS_REMOUNT | _MS_RDONLY | _MS_NOSUID | locked)
+    os.makedirs(root + "/tmp", exist_ok=True)
+    os.chmod(root + "/tmp", 0o1777)
+
+    os.chroot(root)
+    os.chdir("/tmp")
+
+    # No way back: no capabilities (in this namespace) and none to be gained by exec
+    _check(libc.prctl(_PR_SET_NO_NEW_PRIVS, 1, 0, 0, 0), "no_new_privs")
+    for capability in range(64):
+        if libc.prctl(_PR_CAPBSET_DROP, capability, 0, 0, 0) != 0:
+            break
+    header = (ctypes.c_uint32 * 2)(_LINUX_CAPABILITY_VERSION_3, 0)
+    data = (ctypes.c_uint32 * 6)()
+    _check(libc.syscall(_SYS_CAPSET, header, data), "capset")
+
+
+def run_cells(cells, out):
+    """Run the cells one by one, writing the record of each as a JSON line to `out`."""
+    namespace = {"__name__": "__main__"}
+    for cell in cells:
+        stdout = io.StringIO()
+        result = {"index": cell["index"], "ok": True, "output": None, "stdout": "", "error": None}
+        try:
+            with contextlib.redirect_stdout(stdout):
+                value = run_cell(cell.get("content", ""), namespace)
+            result["output"] = to_output(value)
+        except BaseException as e:
+            result["ok"] = False
+            result["error"] = "".join(traceback.format_exception_only(type(e), e)).strip()[:MAX_TEXT]
+            result["traceback"] = traceback.format_exc()[-MAX_TEXT:]
+        result["stdout"] = stdout.getvalue()[:MAX_TEXT]
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+
+
+def _valid_output(output):
+    if output is None:
+        return True
+    if not isinstance(output, dict) or output.get("kind") not in ("number", "expr", "matrix", "sequence", "text"):
+        return False
+    return len(json.dumps(output)) <= 50 * MAX_TEXT
+
+
+def collect_cells(cells, result_fd):
+    """
+    Run the cells in a forked child and collect its records: one per requested cell, in order,
+    with the expected fields; a cell the child did not report (it crashed or exited) is failed.
+    The child closes the result pipe before running anything.
+    """
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        os.close(result_fd)
+        code = 0
+        try:
+            with os.fdopen(write_end, "w") as out:
+                run_cells(cells, out)
+        except BaseException:
+            code = 1
+        finally:
+            os._exit(code)
+
+    os.close(write_end)
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.prctl(_PR_SET_DUMPABLE, 0, 0, 0, 0)
+    results = []
+    with os.fdopen(read_end, "r") as records:
+        for line, cell in zip(records, cells):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not isinstance(record, dict) or record.get("index") != cell["index"] or not _valid_output(record.get("output")):
+                break
+            results.append({
+                "index": cell["index"],
+                "ok": record.get("ok") is True,
+                "output": record.get("output"),
+                "stdout": str(record.get("stdout") or "")[:MAX_TEXT],
+                "error": str(record["error"])[:MAX_TEXT] if record.get("error") else None,
+                "traceback": str(record.get("traceback") or "")[-MAX_TEXT:]
+            })
+    os.waitpid(pid, 0)
+    for cell in cells[len(results):]:
+        results.append({
+            "index": cell["index"], "ok": False, "output": None, "stdout": "",
+            "error": "Выполнение прервано до этой ячейки"
+        })
+    return results
+
+
+def main():
+    result_fd = int(sys.argv[sys.argv.index("--result-fd") + 1])
+    if "--confine" in sys.argv:
+        confine()
+    request = json.load(sys.stdin)
+
+    if request.get("mode") == "compare":
+        seconds = int(request.get("seconds", 5))
+        verdicts = [compare_answer(student, reference, seconds) for student, reference in request.get("pairs", [])]
+        result = {"verdicts": verdicts}
+    else:
+        result = {"cells": collect_cells(request.get("cells", []), result_fd)}
+
+    with os.fdopen(result_fd, "w") as out:
+        json.dump(result, out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import logging
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterator, Optional, Tuple, TYPE_CHECKING
+
+from shared_cache import connection_with
+
+if TYPE_CHECKING:
+    import requests
+
+logger = logging.getLogger("proofmate.offline_batch")
+
+# OpenAI-compatible batch endpoint; local_batch_server.py provides a stand-in for testing
+offline_batch_api_base = os.getenv("OFFLINE_BATCH_API_BASE") or os.getenv("OPENAI_API_BASE")
+offline_batch_completion_window = os.getenv("OFFLINE_BATCH_COMPLETION_WINDOW", "24h")
+offline_batch_poll_seconds = float(os.getenv("OFFLINE_BATCH_POLL_SECONDS", "60"))
+
+# How long one process may take to store the results of a completed batch before another takes over
+offline_batch_ingest_lease = float(os.getenv("OFFLINE_BATCH_INGEST_LEASE", "1800"))
+
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+# Batch states after which the provider does no more work
+FINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+# Local state of a batch whose results a process is storing
+STORING = "storing"
+
+# The local state of every submitted batch, shared by the worker processes: which batches
+# still need polling, and which process, if any, is storing the results of a completed one
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS offline_batches (
+    batch_id TEXT PRIMARY KEY,
+    task_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    lease_until REAL NOT NULL DEFAULT 0
+);
+"""
+
+
+def batch_request_line(custom_id: str, prompt: str, model: str, system_prompt: str) -> Dict[str, Any]:
+    """One line of the batch input file: the same chat completion the interactive path sends."""
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": CHAT_COMPLETIONS_URL,
+        "body": {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.3
+        }
+    }
+
+
+def write_batch_file(path: str, lines: List[Dict[str, Any]]):
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+def iter_batch_results(lines: Iterator[str]) -> Iterator[Tuple[str, Optional[str], Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    Parse the lines of a batch output (or error) file.
+    Yields (custom_id, response content or None, usage or None, error message or None).
+    """
+    for raw in lines:
+        if not raw.strip():
+            continue
+        record = json.loads(raw)
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        if record.get("error") or response.get("status_code") != 200:
+            error = record.get("error") or body.get("error") or {"message": f"HTTP {response.get('status_code')}"}
+            yield record.get("custom_id"), None, None, error.get("message") if isinstance(error, dict) else str(error)
+            continue
+        try:
+            yield record.get("custom_id"), body["choices"][0]["message"]["content"], body.get("usage"), None
+        except (KeyError, IndexError, TypeError):
+            yield record.get("custom_id"), None, None, "Некорректный ответ в результатах пакета"
+
+
+class BatchClient:
+    """Minimal client of the OpenAI files and batches API."""
+
+    def __init__(self, api_base: Optional[str] = None, api_key: Optional[str] = None, timeout: float = 60):
+        base = (api_base or offline_batch_api_base or "https://api.openai.com").rstrip("/")
+        # Same convention as call_openai_api_alternative: the base URL may or may not end with /v1
+        self.base_url = base[:-3] if base.endswith("/v1") else base
+        self.headers = {"Authorization": f"Bearer {api_key or os.getenv('OPENAI_API_KEY')}"}
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, **kwargs) -> "requests.Response":
+        import requests
+
+        response = requests.request(method, f"{self.base_url}{path}", headers=self.headers, timeout=self.timeout, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"Batch API {method} {path} failed with status {response.status_code}: {response.text[:500]}")
+        return response
+
+    def upload_file(self, path: str) -> str:
+        with open(path, "rb") as f:
+            response = self._request("POST", "/v1/files", data={"purpose": "batch"},
+                                     files={"file": (os.path.basename(path), f, "application/jsonl")})
+        return response.json()["id"]
+
+    def create_batch(self, input_file_id: str, metadata: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        return self._request("POST", "/v1/batches", json={
+            "input_file_id": input_file_id,
+            "endpoint": CHAT_COMPLETIONS_URL,
+            "completion_window": offline_batch_completion_window,
+            "metadata": metadata or {}
+        }).json()
+
+    def get_batch(self, batch_id: str) -> Dict[str, Any]:
+        return self._request("GET", f"/v1/batches/{batch_id}").json()
+
+    def iter_file_lines(self, file_id: str) -> Iterator[str]:
+        """Stream the lines of a result file without loading it whole."""
+        import requests
+
+        response = requests.get(f"{self.base_url}/v1/files/{file_id}/content", headers=self.headers,
+                                timeout=self.timeout, stream=True)
+        if response.status_code >= 400:
+            raise RuntimeError(f"Batch API file {file_id} download failed with status {response.status_code}")
+        with response:
+            for line in response.iter_lines(decode_unicode=False):
+                if line:
+                    yield line.decode("utf-8")
+
+    def wait_for_batch(self, batch_id: str, poll_seconds: Optional[float] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Poll a batch until it reaches a final state (or the timeout passes) and return its last state."""
+        started = time.monotonic()
+        while True:
+            batch = self.get_batch(batch_id)
+            if batch["status"] in FINAL_STATES or (timeout is not None and time.monotonic() - started > timeout):
+                return batch
+            time.sleep(poll_seconds or offline_batch_poll_seconds)
+
+
+@contextmanager
+def batch_ledger(task_id: str, batch_id: str, status: str):
+    """
+    Lock the shared row of a batch for the duration of the block and yield it as a dict
+    (status, lease_until); changes made to the dict are written back on exit. A batch
+    without a row (submitted before the ledger existed) gets one with the given status.
+    The lock is a write transaction on the shared file: keep the block short.
+    """
+    conn = connection_with(SCHEMA)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT status, lease_until FROM offline_batches WHERE batch_id = ?", (batch_id,)
+        ).fetchone()
+        entry = {"status": row[0], "lease_until": row[1]} if row else {"status": status, "lease_until": 0}
+        yield entry
+        conn.execute(
+            "INSERT OR REPLACE INTO offline_batches (batch_id, task_id, status, lease_until) VALUES (?, ?, ?, ?)",
+            (batch_id, task_id, entry["status"], entry["lease_until"])
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def claim_ingestion(task_id: str, batch_id: str, done_states) -> bool:
+    """
+    Claim the storing of a completed batch's results for this process. False if they are stored
+    already or another process holds an unexpired claim; a claim outlives a crashed holder by at
+    most offline_batch_ingest_lease seconds.
+    """
+    now = time.time()
+    with batch_ledger(task_id, batch_id, "completed") as entry:
+        if entry["status"] in done_states or (entry["status"] == STORING and entry["lease_until"] > now):
+            return False
+        entry["status"] = STORING
+        entry["lease_until"] = now + offline_batch_ingest_lease
+    return True
+
+
+def release_ingestion(task_id: str, batch_id: str):
+    """Give up a claim after a failed attempt, so the next poll retries at once."""
+    with batch_ledger(task_id, batch_id, "completed") as entry:
+        if entry["status"] == STORING:
+            entry["status"] = "completed"
+            entry["lease_until"] = 0
+
+
+def unfinished_batches(done_states) -> List[Tuple[str, str]]:
+    """(task_id, batch_id) of the batches that still need polling or storing, for resuming after a restart."""
+    rows = connection_with(SCHEMA).execute("SELECT task_id, batch_id, status FROM offline_batches").fetchall()
+    return [(task_id, batch_id) for task_id, batch_id, status in rows if status not in done_states]
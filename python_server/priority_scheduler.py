@@ -0,0 +1,216 @@
+"""
+Priority scheduling of the model calls. Every call takes a slot of this process before it goes to
+the provider; slots are handed out by priority class:
+
+    interactive  a teacher waiting on /api/analyze
+    batch        /api/batch-analyze and queued jobs
+    background   regrades nobody is waiting for
+
+Free slots go to the classes in proportion to their weights (stride scheduling), and within a class
+in equal turns to the tasks (or any other fairness key) that have calls waiting, so one task with
+300 submissions does not hold back the others. Per-class limits keep bulk work from taking every
+slot: what interactive calls do not use, the bulk classes keep busy up to their limits.
+"""
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Iterable, Optional, Tuple
+
+from deadlines import check_cancelled
+
+INTERACTIVE, BATCH, BACKGROUND = "interactive", "batch", "background"
+PRIORITY_CLASSES = (INTERACTIVE, BATCH, BACKGROUND)
+
+
+def parse_class_settings(spec: str, default: float) -> Dict[str, float]:
+    """"interactive=8,batch=3" -> a value for every priority class, default for the ones not listed."""
+    settings = dict.fromkeys(PRIORITY_CLASSES, default)
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        if name.strip() in settings and value.strip():
+            settings[name.strip()] = float(value)
+    return settings
+
+
+# Concurrent model calls of this process (each server worker and job worker has its own slots)
+llm_concurrency = int(os.getenv("LLM_CONCURRENCY", "16"))
+# Share of the free slots each class gets while several are waiting
+priority_weights = parse_class_settings(os.getenv("PRIORITY_WEIGHTS", "interactive=8,batch=3,background=1"), 1)
+# Most slots a class may hold at once; the gap to LLM_CONCURRENCY stays free for interactive calls
+priority_limits = {
+    name: int(limit) for name, limit in
+    parse_class_settings(os.getenv("PRIORITY_LIMITS", "batch=12,background=4"), llm_concurrency).items()
+}
+
+# Priority class and fairness key of the calls made by the current request or job
+priority_var: contextvars.ContextVar[Tuple[str, Optional[Hashable]]] = contextvars.ContextVar(
+    "priority", default=(INTERACTIVE, None)
+)
+
+
+def bind_priority(priority: str, key: Optional[Hashable] = None):
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class: {priority}")
+    priority_var.set((priority, key))
+
+
+class WeightedRotation:
+    """
+    Stride scheduling: each pick goes to the candidate furthest behind its weighted share. A
+    candidate that was idle starts level with the last pick instead of cashing in the turns it
+    did not use.
+    """
+
+    def __init__(self, weights: Optional[Dict[Hashable, float]] = None):
+        self.weights = weights or {}
+        self._pass: Dict[Hashable, float] = {}
+        self._virtual = 0.0
+
+    def pick(self, candidates: Iterable[Hashable]) -> Hashable:
+        chosen = None
+        for candidate in candidates:
+            self._pass[candidate] = max(self._pass.get(candidate, self._virtual), self._virtual)
+            if chosen is None or self._pass[candidate] < self._pass[chosen]:
+                chosen = candidate
+        self._virtual = self._pass[chosen]
+        self._pass[chosen] += 1 / max(self.weights.get(chosen, 1), 1e-6)
+        return chosen
+
+    def forget(self, candidate: Hashable):
+        self._pass.pop(candidate, None)
+
+
+class _Waiter:
+    __slots__ = ("loop", "future", "enqueued", "granted")
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class PriorityScheduler:
+    """
+    Slots for the model calls of one process. Waiters may come from several event loops (the
+    server's and the job workers'), so the state is guarded by a thread lock and grants are
+    delivered through each waiter's own loop.
+    """
+
+    def __init__(self, capacity: int, weights: Dict[str, float], limits: Dict[str, int]):
+        self.capacity = capacity
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._classes = WeightedRotation(weights)
+        self._keys = {priority: WeightedRotation() for priority in PRIORITY_CLASSES}
+        self._waiting: Dict[str, Dict[Hashable, Deque[_Waiter]]] = {priority: {} for priority in PRIORITY_CLASSES}
+        self._running = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self._granted = dict.fromkeys(PRIORITY_CLASSES, 0)
+        # Recent waits for a slot, for the percentiles in the metrics
+        self._waits = {priority: deque(maxlen=1000) for priority in PRIORITY_CLASSES}
+
+    def _dispatch(self):
+        while sum(self._running.values()) < self.capacity:
+            ready = [priority for priority in PRIORITY_CLASSES
+                     if self._waiting[priority] and self._running[priority] < self.limits[priority]]
+            if not ready:
+                return
+            priority = self._classes.pick(ready)
+            queues = self._waiting[priority]
+            key = self._keys[priority].pick(queues)
+            waiter = queues[key].popleft()
+            if not queues[key]:
+                del queues[key]
+                self._keys[priority].forget(key)
+            try:
+                waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+            except RuntimeError:
+                # The waiter's event loop is gone
+                continue
+            waiter.granted = True
+            self._running[priority] += 1
+            self._granted[priority] += 1
+            self._waits[priority].append(time.monotonic() - waiter.enqueued)
+
+    def _remove(self, priority, key, waiter):
+        queue = self._waiting[priority].get(key)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._waiting[priority][key]
+                self._keys[priority].forget(key)
+
+    async def acquire(self, priority: str, key: Optional[Hashable] = None):
+        waiter = _Waiter(asyncio.get_running_loop())
+        with self._lock:
+            self._waiting[priority].setdefault(key, deque()).append(waiter)
+            self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.granted:
+                    self._running[priority] -= 1
+                    self._dispatch()
+                else:
+                    self._remove(priority, key, waiter)
+            raise
+
+    def release(self, priority: str):
+        with self._lock:
+            self._running[priority] -= 1
+            self._dispatch()
+
+    def running(self) -> int:
+        with self._lock:
+            return sum(self._running.values())
+
+    def waiting(self, priority: Optional[str] = None) -> int:
+        """Calls waiting for a slot, of one class or of all."""
+        with self._lock:
+            return sum(len(queue) for name in PRIORITY_CLASSES if priority in (None, name)
+                       for queue in self._waiting[name].values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            classes = {}
+            for priority in PRIORITY_CLASSES:
+                waits = sorted(self._waits[priority])
+                classes[priority] = {
+                    "running": self._running[priority],
+                    "waiting": sum(len(queue) for queue in self._waiting[priority].values()),
+                    "waiting_keys": len(self._waiting[priority]),
+                    "limit": self.limits[priority],
+                    "weight": self._classes.weights[priority],
+                    "granted": self._granted[priority],
+                    "wait_p50_s": round(waits[len(waits) // 2], 3) if waits else 0.0,
+                    "wait_p95_s": round(waits[int(len(waits) * 0.95)], 3) if waits else 0.0
+                }
+            return {"capacity": self.capacity, "classes": classes}
+
+
+llm_scheduler = PriorityScheduler(llm_concurrency, priority_weights, priority_limits)
+
+
+async def run_llm_call(func: Callable[..., Any], *args):
+    """
+    Run a blocking model call in a thread once a slot of the current priority class is free;
+    a request cancelled or past its deadline in the meantime does not call the model.
+    """
+    priority, key = priority_var.get()
+    check_cancelled()
+    await llm_scheduler.acquire(priority, key)
+    try:
+        # The deadline may have passed while waiting for the slot
+        check_cancelled()
+        return await asyncio.to_thread(func, *args)
+    finally:
+        llm_scheduler.release(priority)
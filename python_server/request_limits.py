@@ -0,0 +1,79 @@
+"""
+Size limits on request bodies, enforced while the body is received. Starlette parses a multipart
+form (spooling the files to disk) before the endpoint runs, so a limit checked by the endpoint
+comes after the whole upload has been read; this middleware sits in front of the parser instead.
+A declared Content-Length over the limit is refused before anything is read, and a body sent
+without one (chunked) is cut off as soon as the bytes received pass the limit.
+"""
+import re
+import logging
+from typing import Dict
+
+from fastapi.responses import JSONResponse
+
+logger = logging.getLogger("proofmate.request_limits")
+
+
+class BodyTooLarge(Exception):
+    """Raised into the app by receive() once the body has passed its limit."""
+
+
+class RequestBodyLimit:
+    """ASGI middleware: `limits` maps path patterns (matched in full) to the most bytes a body may have."""
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = [(re.compile(path), limit) for path, limit in limits.items()]
+
+    def _limit(self, scope):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return None
+        return next((limit for path, limit in self.limits if path.fullmatch(scope["path"])), None)
+
+    async def __call__(self, scope, receive, send):
+        limit = self._limit(scope)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        response = JSONResponse(
+            status_code=413, content={"detail": f"Тело запроса превышает допустимый размер ({limit} байт)"}
+        )
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            logger.warning(f"Rejected a body of {content_length.decode()} bytes to {scope['path']}, limit is {limit}")
+            await response(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def receive_limited():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+            if exceeded:
+                raise BodyTooLarge()
+            return message
+
+        async def send_tracked(message):
+            nonlocal response_started
+            # Whatever the app answers to a body it could not read in full is replaced by the 413
+            if exceeded:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_limited, send_tracked)
+        except BodyTooLarge:
+            pass
+        if exceeded:
+            logger.warning(f"Cut off a body to {scope['path']} after {received} bytes, limit is {limit}")
+            if not response_started:
+                await response(scope, receive, send)
@@ -0,0 +1,146 @@
+"""
+Production entry point: the app is imported and warmed once, then SERVER_WORKERS processes are
+forked that serve the same listening socket. No reload, no access log by default; workers that
+die are restarted. On platforms without fork it falls back to uvicorn's own multi-process mode.
+
+    python serve.py
+
+For development with auto-reload keep using python main_functional.py.
+"""
+import os
+import time
+import signal
+import socket
+import logging
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import uvicorn
+from logging_setup import process_log_queue, init_worker_logging, stop_logging, hold_listeners, release_listeners
+
+# Workers are forked from this process: its log threads only run while no fork is under way,
+# so the app is imported with them held
+hold_listeners()
+
+from main_functional import app, preload_app_state, job_broker
+
+logger = logging.getLogger("proofmate.serve")
+
+# Production server settings
+server_host = os.getenv("PYTHON_SERVER_HOST", "0.0.0.0")
+server_port = int(os.getenv("PYTHON_SERVER_PORT", 8000))
+# Several workers need a shared job broker (JOB_BROKER_URL=redis://...): a job queued in memory is
+# only known to the worker that accepted it. With memory:// the default is one worker.
+server_workers = int(os.getenv("SERVER_WORKERS", str(os.cpu_count() or 1) if not job_broker.local else "1"))
+server_backlog = int(os.getenv("SERVER_BACKLOG", "2048"))
+server_access_log = os.getenv("SERVER_ACCESS_LOG", "false").lower() == "true"
+# Restarts of crashed workers are spaced out, so that a worker failing on startup does not spin
+worker_restart_delay = float(os.getenv("WORKER_RESTART_DELAY", "1"))
+
+stopping = False
+
+
+def listening_socket():
+    sock = socket.socket(socket.AF_INET6 if ":" in server_host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((server_host, server_port))
+    sock.listen(server_backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock, log_queue):
+    """Body of a forked worker: log through the parent and serve the shared socket until told to stop."""
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    init_worker_logging(log_queue)
+    config = uvicorn.Config(app, reload=False, log_config=None, access_log=server_access_log, proxy_headers=True)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def start_worker(sock, log_queue):
+    hold_listeners()
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(sock, log_queue)
+        except Exception:
+            logger.exception("Worker failed")
+            code = 1
+        finally:
+            # os._exit skips the queue's finalizer: flush the records still being fed to the parent,
+            # and never exit while holding the queue's write lock
+            log_queue.close()
+            log_queue.join_thread()
+            os._exit(code)
+    release_listeners()
+    logger.info(f"Started worker {pid}")
+    return pid
+
+
+def stop(signum, frame):
+    global stopping
+    stopping = True
+
+
+def serve_forked():
+    sock = listening_socket()
+    # Workers send their records here, so that one process writes (and rotates) the log file
+    log_queue = process_log_queue()
+    preload_app_state()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    workers = {start_worker(sock, log_queue) for _ in range(server_workers)}
+    logger.info(f"Serving on {server_host}:{server_port} with {len(workers)} workers")
+
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.5)
+            continue
+        workers.discard(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting it")
+            time.sleep(worker_restart_delay)
+            workers.add(start_worker(sock, log_queue))
+
+    logger.info(f"Stopping {len(workers)} workers")
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in workers:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    sock.close()
+    stop_logging()
+
+
+def main():
+    if job_broker.local and server_workers > 1:
+        release_listeners()
+        logger.error(f"SERVER_WORKERS={server_workers} with JOB_BROKER_URL=memory://: a queued job could only be looked up "
+                     f"in the worker that accepted it. Use a Redis broker or a single worker.")
+        stop_logging()
+        raise SystemExit(1)
+    if hasattr(os, "fork"):
+        serve_forked()
+    else:
+        release_listeners()
+        # Spawned workers import the app themselves; nothing is shared
+        uvicorn.run("main_functional:app", host=server_host, port=server_port, workers=server_workers,
+                    reload=False, access_log=server_access_log, proxy_headers=True)
+
+
+if __name__ == "__main__":
+    main()
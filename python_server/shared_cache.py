@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("proofmate.shared_cache")
+
+# One SQLite file shared by every worker process of the server (WAL mode: readers never wait for writers).
+# WAL keeps its index in shared memory, so the processes must all run on one host and the file must be
+# on a local disk: on a network filesystem it would be corrupted or locked, and it is refused there.
+shared_cache_path = os.path.abspath(os.getenv("SHARED_CACHE_PATH", "shared_cache.sqlite3"))
+shared_cache_busy_timeout = float(os.getenv("SHARED_CACHE_BUSY_TIMEOUT", "5"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    is_json INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, last_used);
+"""
+
+MOUNTS_PATH = "/proc/self/mounts"
+# Filesystem types (as in /proc/mounts) that may be mounted by several hosts
+NETWORK_FILESYSTEMS = {
+    "nfs", "nfs4", "cifs", "smb3", "smbfs", "ncpfs", "afs", "9p", "ceph", "glusterfs", "lustre", "gpfs",
+    "beegfs", "ocfs2", "gfs2", "fuse.sshfs", "fuse.s3fs", "fuse.glusterfs", "fuse.cephfs", "fuse.juicefs"
+}
+
+# Connections are per thread and are reopened in forked processes
+_local = threading.local()
+
+
+def filesystem_type(path: str) -> Optional[str]:
+    """Type of the filesystem holding path, or None where /proc/self/mounts is not available."""
+    try:
+        with open(MOUNTS_PATH, encoding="utf-8") as mounts:
+            entries = [line.split() for line in mounts]
+    except OSError:
+        return None
+    path = os.path.realpath(path)
+    found, found_length = None, -1
+    for entry in entries:
+        if len(entry) < 3:
+            continue
+        mount_point = entry[1].replace("\\040", " ")
+        inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+        if inside and len(mount_point) > found_length:
+            found, found_length = entry[2], len(mount_point)
+    return found
+
+
+def check_local_filesystem():
+    """Raise sqlite3.OperationalError if SHARED_CACHE_PATH is on a network filesystem."""
+    fs_type = filesystem_type(os.path.dirname(shared_cache_path))
+    if fs_type in NETWORK_FILESYSTEMS:
+        raise sqlite3.OperationalError(
+            f"SHARED_CACHE_PATH {shared_cache_path} is on a network filesystem ({fs_type}): "
+            f"the shared store serves the processes of one host and needs a local disk"
+        )
+
+
+def connection() -> sqlite3.Connection:
+    if getattr(_local, "pid", None) != os.getpid():
+        os.makedirs(os.path.dirname(shared_cache_path), exist_ok=True)
+        check_local_filesystem()
+        conn = sqlite3.connect(shared_cache_path, timeout=shared_cache_busy_timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn, _local.pid = conn, os.getpid()
+        _local.schemas = set()
+    return _local.conn
+
+
+def connection_with(schema: str) -> sqlite3.Connection:
+    """The shared connection, with the tables of another user of the file created on its first use."""
+    conn = connection()
+    if schema not in _local.schemas:
+        conn.executescript(schema)
+        _local.schemas.add(schema)
+    return conn
+
+
+class SharedCache:
+    """
+    A namespace of the shared key-value store, bounded to max_entries with least recently used
+    eviction. Values are JSON-serializable objects or bytes. Every write (with its eviction) is
+    one transaction, so other processes see either the old or the new state. Storage errors are
+    logged and treated as misses: the cache never fails a request.
+    """
+
+    def __init__(self, namespace: str, max_entries: int):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            conn = connection()
+            row = conn.execute(
+                "SELECT value, is_json FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE cache SET last_used = ? WHERE namespace = ? AND key = ?", (time.time(), self.namespace, key)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache read failed ({self.namespace}): {str(e)}")
+            row = None
+        self._count(row is not None)
+        if row is None:
+            return None
+        value, is_json = row
+        return json.loads(value) if is_json else bytes(value)
+
+    def set(self, key: str, value: Any):
+        is_json = not isinstance(value, (bytes, bytearray))
+        encoded = json.dumps(value, ensure_ascii=False) if is_json else bytes(value)
+        try:
+            conn = connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, is_json, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, key, encoded, int(is_json), time.time())
+                )
+                conn.execute(
+                    "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                    "SELECT key FROM cache WHERE namespace = ? ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.namespace, self.namespace, self.max_entries)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache write failed ({self.namespace}): {str(e)}")
+
+    def delete(self, key: str):
+        try:
+            connection().execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache delete failed ({self.namespace}): {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Entries are shared by all workers; hits and misses are counted by this process."""
+        try:
+            entries = connection().execute(
+                "SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)
+            ).fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
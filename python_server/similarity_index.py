@@ -0,0 +1,293 @@
+import os
+import re
+import json
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+
+from shared_cache import connection_with
+
+logger = logging.getLogger("proofmate.similarity_index")
+
+# MinHash/LSH parameters: 16 bands of 8 rows put the LSH threshold around 0.7
+NUM_PERM = 128
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERM // LSH_BANDS
+SHINGLE_SIZE = 3
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+_TOKEN_RE = re.compile(r"[A-Za-zА-Яа-я_]\w*|\d+(?:\.\d*)?|\S")
+_NUMBER_RE = re.compile(r"\d")
+
+
+def normalize_code(source: str, keep_numbers: bool = False) -> List[str]:
+    """Tokenize code with comments dropped and, unless keep_numbers is set, numeric literals replaced by a placeholder."""
+    tokens = []
+    for line in source.splitlines():
+        line = line.split("#", 1)[0]
+        for token in _TOKEN_RE.findall(line):
+            tokens.append("<num>" if not keep_numbers and _NUMBER_RE.match(token) else token)
+    return tokens
+
+
+def code_cell_hashes(cells: List[Dict[str, Any]]) -> List[Tuple[int, str]]:
+    """
+    Hashes of the code cells, as (notebook cell index, hash) pairs.
+    Comments and whitespace are ignored, numbers are not.
+    """
+    return [
+        (cell["index"], hashlib.sha1(" ".join(normalize_code(cell.get("content", ""), keep_numbers=True)).encode("utf-8")).hexdigest())
+        for cell in cells if cell.get("type") == "code"
+    ]
+
+
+def minhash_signature(cells: List[Dict[str, Any]]) -> Optional[np.ndarray]:
+    """MinHash signature over token shingles of all code cells, or None for a notebook without code."""
+    tokens = []
+    for cell in cells:
+        if cell.get("type") == "code":
+            tokens.extend(normalize_code(cell.get("content", "")))
+            tokens.append("<cell>")
+
+    if len(tokens) < SHINGLE_SIZE or all(token == "<cell>" for token in tokens):
+        return None
+
+    shingles = {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+    signature = np.full(NUM_PERM, _MAX_HASH, dtype=np.uint64)
+    # Chunked to keep the (shingles x permutations) matrix small for big notebooks
+    for start in range(0, len(hashes), 4096):
+        chunk = hashes[start:start + 4096, None]
+        permuted = ((chunk * _PERM_A + _PERM_B) % _MERSENNE_PRIME) & _MAX_HASH
+        signature = np.minimum(signature, permuted.min(axis=0))
+    return signature
+
+
+def estimate_similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return float(np.count_nonzero(sig_a == sig_b)) / NUM_PERM
+
+
+def changed_cells(base_hashes: List[Tuple[int, str]], new_hashes: List[Tuple[int, str]]) -> List[int]:
+    """
+    Notebook indices of code cells that differ from the base submission, aligned by code cell order.
+    Code cells of the base past the end of the new submission were deleted and are reported with
+    their index in the base notebook, so that a truncated copy never looks unchanged.
+    """
+    changed = []
+    for position, (cell_index, cell_hash) in enumerate(new_hashes):
+        if position >= len(base_hashes) or base_hashes[position][1] != cell_hash:
+            changed.append(cell_index)
+    changed.extend(cell_index for cell_index, _ in base_hashes[len(new_hashes):])
+    return changed
+
+
+class SubmissionIndex:
+    """LSH index of the submissions of a single task. Safe to update from worker threads."""
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        # Number of the last shared row applied to this copy
+        self.seq = 0
+        self.entries = {}
+        self.buckets = [{} for _ in range(LSH_BANDS)]
+        self._lock = threading.RLock()
+
+    def _band_keys(self, signature: np.ndarray):
+        for band in range(LSH_BANDS):
+            yield band, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes()
+
+    def add(self, student_id: str, signature: np.ndarray, cell_hashes: List[Tuple[int, str]], reference_hash: str):
+        """Index a submission, replacing any earlier one of the same student."""
+        with self._lock:
+            self.remove(student_id)
+            self.entries[student_id] = {
+                "signature": signature,
+                "cell_hashes": cell_hashes,
+                "reference_hash": reference_hash
+            }
+            for band, key in self._band_keys(signature):
+                self.buckets[band].setdefault(key, set()).add(student_id)
+
+    def remove(self, student_id: str):
+        with self._lock:
+            entry = self.entries.pop(student_id, None)
+            if entry is None:
+                return
+            for band, key in self._band_keys(entry["signature"]):
+                bucket = self.buckets[band].get(key)
+                if bucket:
+                    bucket.discard(student_id)
+                    if not bucket:
+                        del self.buckets[band][key]
+
+    def candidates(self, signature: np.ndarray) -> set:
+        found = set()
+        with self._lock:
+            for band, key in self._band_keys(signature):
+                found.update(self.buckets[band].get(key, ()))
+        return found
+
+    def query(self, signature: np.ndarray, reference_hash: Optional[str] = None,
+              exclude: Optional[str] = None, threshold: float = 0.0) -> List[Tuple[str, float]]:
+        """Submissions similar to the signature, most similar first."""
+        matches = []
+        for student_id in self.candidates(signature):
+            if student_id == exclude:
+                continue
+            entry = self.entries.get(student_id)
+            if entry is None:
+                continue
+            if reference_hash is not None and entry["reference_hash"] != reference_hash:
+                continue
+            similarity = estimate_similarity(signature, entry["signature"])
+            if similarity >= threshold:
+                matches.append((student_id, similarity))
+        matches.sort(key=lambda x: x[1], reverse=True)
+        return matches
+
+    def similarity_report(self, threshold: float) -> List[Dict[str, Any]]:
+        """All pairs of submissions whose similarity reaches the threshold."""
+        pairs = {}
+        with self._lock:
+            entries = list(self.entries.items())
+        for student_id, entry in entries:
+            for other_id, similarity in self.query(entry["signature"], exclude=student_id, threshold=threshold):
+                key = tuple(sorted((student_id, other_id)))
+                pairs[key] = similarity
+        report = [
+            {"student_a": a, "student_b": b, "similarity": round(similarity, 3)}
+            for (a, b), similarity in pairs.items()
+        ]
+        report.sort(key=lambda x: x["similarity"], reverse=True)
+        return report
+
+
+# The signatures of every task live in the shared SQLite file, so a submission indexed by one worker
+# process is found by the others. Rows are numbered in write order (a rewritten row gets a new
+# number): each process keeps an in-memory LSH index per task and reads only the rows numbered
+# after the last one it has seen. A task stored before the table existed is loaded from its
+# similarity.json sidecars, once, by whichever process uses it first.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS similarity_signatures (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    cell_hashes TEXT NOT NULL,
+    reference_hash TEXT,
+    UNIQUE (task_id, student_id) ON CONFLICT REPLACE
+);
+CREATE INDEX IF NOT EXISTS similarity_signatures_task ON similarity_signatures (task_id, seq);
+CREATE TABLE IF NOT EXISTS similarity_tasks (
+    task_id TEXT PRIMARY KEY
+);
+"""
+
+_indices = {}
+_indices_lock = threading.Lock()
+# Tasks whose sidecars are known to be in the shared table
+_synced_tasks = set()
+
+
+def get_submission_index(task_id: str, submissions_root: str) -> SubmissionIndex:
+    """Return the index of a task, brought up to date with the submissions any process has indexed since."""
+    with _indices_lock:
+        index = _indices.get(task_id)
+        if index is None:
+            index = _indices[task_id] = SubmissionIndex(task_id)
+    try:
+        _sync_task(task_id, submissions_root)
+        _catch_up(index)
+    except sqlite3.Error as e:
+        logger.warning(f"Shared similarity index unavailable, using this process's copy for task {task_id}: {str(e)}")
+    return index
+
+
+def index_submission(task_id: str, submissions_root: str, student_id: str, signature: np.ndarray,
+                     cell_hashes: List[Tuple[int, str]], reference_hash: str):
+    """Index a submission for every process, replacing any earlier one of the same student."""
+    try:
+        connection_with(SCHEMA).execute(
+            "INSERT INTO similarity_signatures (task_id, student_id, signature, cell_hashes, reference_hash) VALUES (?, ?, ?, ?, ?)",
+            (task_id, student_id, signature.tobytes(), json.dumps(cell_hashes), reference_hash)
+        )
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to index submission {student_id} of task {task_id} in the shared store: {str(e)}")
+    # Added here as well: this process sees its own submission even if the shared store failed
+    get_submission_index(task_id, submissions_root).add(student_id, signature, cell_hashes, reference_hash)
+
+
+def _catch_up(index: SubmissionIndex):
+    with index._lock:
+        rows = connection_with(SCHEMA).execute(
+            "SELECT seq, student_id, signature, cell_hashes, reference_hash FROM similarity_signatures "
+            "WHERE task_id = ? AND seq > ? ORDER BY seq",
+            (index.task_id, index.seq)
+        ).fetchall()
+        for seq, student_id, signature, cell_hashes, reference_hash in rows:
+            index.add(
+                student_id, np.frombuffer(signature, dtype=np.uint64).copy(),
+                [tuple(h) for h in json.loads(cell_hashes)], reference_hash
+            )
+            index.seq = seq
+
+
+def _sync_task(task_id: str, submissions_root: str):
+    """Load a task's similarity.json sidecars into the shared table unless that was done already (by any process)."""
+    if task_id in _synced_tasks:
+        return
+    conn = connection_with(SCHEMA)
+    if conn.execute("SELECT 1 FROM similarity_tasks WHERE task_id = ?", (task_id,)).fetchone() is not None:
+        _synced_tasks.add(task_id)
+        return
+    rows = []
+    task_dir = os.path.join(submissions_root, task_id)
+    if os.path.isdir(task_dir):
+        for student_id in os.listdir(task_dir):
+            sidecar = os.path.join(task_dir, student_id, "similarity.json")
+            if not os.path.exists(sidecar):
+                continue
+            try:
+                with open(sidecar, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                rows.append((
+                    task_id, student_id, np.array(data["signature"], dtype=np.uint64).tobytes(),
+                    json.dumps(data["cell_hashes"]), data["reference_hash"]
+                ))
+            except Exception as e:
+                logger.error(f"Failed to load similarity data for student {student_id}: {str(e)}")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # A row written through meanwhile is at least as new as its sidecar
+        conn.executemany(
+            "INSERT OR IGNORE INTO similarity_signatures (task_id, student_id, signature, cell_hashes, reference_hash) "
+            "VALUES (?, ?, ?, ?, ?)", rows
+        )
+        conn.execute("INSERT OR IGNORE INTO similarity_tasks (task_id) VALUES (?)", (task_id,))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    _synced_tasks.add(task_id)
+    logger.info(f"Loaded {len(rows)} stored signatures of task {task_id} into the shared similarity index")
+
+
+def save_similarity_sidecar(student_dir: str, signature: np.ndarray, cell_hashes: List[Tuple[int, str]], reference_hash: str):
+    """Persist the data needed to rebuild the index entry of a submission."""
+    with open(os.path.join(student_dir, "similarity.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "signature": signature.tolist(),
+            "cell_hashes": cell_hashes,
+            "reference_hash": reference_hash
+        }, f)
@@ -0,0 +1,282 @@
+"""
+Catalog of the stored submissions for listing them: one row per submission of a task in the shared
+SQLite file, with the fields it is sorted and filtered on as indexed columns next to the stored
+document. save_submission writes through to it; a task saved before the catalog existed is loaded
+from its analysis_result.json files the first time it is listed.
+
+Pages are cut with keyset cursors (the sort value and student id of the last row), so a page
+costs the same however deep it is and rows saved meanwhile do not shift the following pages.
+
+The feedback of every row (summary, detailed feedback, cell annotations) is also in a full-text
+index keyed by the row's rowid and updated in the same transaction; see feedback_search for how
+queries are matched.
+"""
+import os
+import json
+import base64
+import sqlite3
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from shared_cache import connection_with
+from feedback_search import COLUMNS as FEEDBACK_COLUMNS, COLUMN_WEIGHTS, feedback_columns, match_query
+
+logger = logging.getLogger("proofmate.submission_catalog")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    task_id TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    grade REAL NOT NULL,
+    confidence REAL NOT NULL,
+    submission_date TEXT NOT NULL,
+    weaknesses TEXT NOT NULL,
+    document TEXT NOT NULL,
+    PRIMARY KEY (task_id, student_id)
+);
+CREATE INDEX IF NOT EXISTS submissions_grade ON submissions (task_id, grade, student_id);
+CREATE INDEX IF NOT EXISTS submissions_confidence ON submissions (task_id, confidence, student_id);
+CREATE INDEX IF NOT EXISTS submissions_date ON submissions (task_id, submission_date, student_id);
+CREATE TABLE IF NOT EXISTS submission_catalog_tasks (
+    task_id TEXT PRIMARY KEY
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS submission_feedback USING fts5 (
+    error_summary, detailed_feedback, cell_annotations, tokenize = 'unicode61'
+);
+"""
+
+# Markers around the matched words in search snippets, and the words of context a snippet keeps
+SNIPPET_MARKERS = ("<mark>", "</mark>")
+SNIPPET_WORDS = 12
+
+# Sort keys of the listing and their columns
+SORT_COLUMNS = {"grade": "grade", "confidence": "confidence", "date": "submission_date", "student_id": "student_id"}
+
+# Fields of a listed submission; the analysis result as a whole is only sent when asked for
+FIELDS = (
+    "student_id", "name", "submission_date", "revision", "grade", "confidence", "error_summary",
+    "strengths", "weaknesses", "error_count", "analysis_source", "analysis_result"
+)
+DEFAULT_FIELDS = ("student_id", "name", "submission_date", "revision", "grade", "confidence")
+
+# Parts of the stored submission that only the resubmission logic needs
+_INTERNAL_KEYS = ("cell_hashes", "task_analyses", "reference_hash")
+
+# Tasks this process knows to be in the catalog
+_synced_tasks = set()
+
+
+def _row(task_id: str, submission_info: Dict[str, Any]) -> Tuple:
+    analysis_result = submission_info.get("analysis_result") or {}
+    weaknesses = analysis_result.get("detailed_feedback", {}).get("weaknesses", [])
+    document = {key: value for key, value in submission_info.items() if key not in _INTERNAL_KEYS}
+    return (
+        task_id,
+        submission_info["student_id"],
+        float(analysis_result.get("grade") or 0.0),
+        float(analysis_result.get("confidence_score") or 0.0),
+        submission_info.get("submission_date") or "",
+        "\n".join(weaknesses).casefold(),
+        json.dumps(document, ensure_ascii=False)
+    )
+
+
+_UPSERT = """
+INSERT INTO submissions (task_id, student_id, grade, confidence, submission_date, weaknesses, document)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (task_id, student_id) DO UPDATE SET
+    grade = excluded.grade, confidence = excluded.confidence, submission_date = excluded.submission_date,
+    weaknesses = excluded.weaknesses, document = excluded.document
+WHERE excluded.submission_date >= submissions.submission_date
+"""
+
+
+def _store(conn: sqlite3.Connection, task_id: str, submission_info: Dict[str, Any]):
+    """Upsert the row of a submission and reindex its feedback; call inside a transaction."""
+    if conn.execute(_UPSERT, _row(task_id, submission_info)).rowcount == 0:
+        return
+    rowid = conn.execute(
+        "SELECT rowid FROM submissions WHERE task_id = ? AND student_id = ?", (task_id, submission_info["student_id"])
+    ).fetchone()[0]
+    conn.execute("DELETE FROM submission_feedback WHERE rowid = ?", (rowid,))
+    conn.execute(
+        "INSERT INTO submission_feedback (rowid, error_summary, detailed_feedback, cell_annotations) VALUES (?, ?, ?, ?)",
+        [rowid] + feedback_columns(submission_info.get("analysis_result") or {})
+    )
+
+
+def record(task_id: str, submission_info: Dict[str, Any]):
+    """Add or replace a submission; an older version (a late backfill) does not overwrite a newer one."""
+    try:
+        conn = connection_with(SCHEMA)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _store(conn, task_id, submission_info)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to catalog submission {submission_info.get('student_id')} of task {task_id}: {str(e)}")
+
+
+def sync_task(task_id: str, submissions_root: str):
+    """Load a task's stored submissions into the catalog unless that was done already (by any process)."""
+    if task_id in _synced_tasks:
+        return
+    conn = connection_with(SCHEMA)
+    if conn.execute("SELECT 1 FROM submission_catalog_tasks WHERE task_id = ?", (task_id,)).fetchone() is None:
+        documents = []
+        task_dir = os.path.join(submissions_root, task_id)
+        if os.path.isdir(task_dir):
+            for student_id in os.listdir(task_dir):
+                path = os.path.join(task_dir, student_id, "analysis_result.json")
+                if not os.path.exists(path):
+                    continue
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        documents.append(json.load(f))
+                except Exception as e:
+                    logger.error(f"Failed to load submission {student_id} of task {task_id} into the catalog: {str(e)}")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for submission_info in documents:
+                _store(conn, task_id, submission_info)
+            conn.execute("INSERT OR IGNORE INTO submission_catalog_tasks (task_id) VALUES (?)", (task_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        logger.info(f"Cataloged {len(documents)} stored submissions of task {task_id}")
+    _synced_tasks.add(task_id)
+
+
+def encode_cursor(sort: str, value: Any, student_id: str) -> str:
+    raw = json.dumps([sort, value, student_id], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, str]:
+    """The position a cursor points after; ValueError if it is malformed or was issued for another sort."""
+    try:
+        cursor_sort, value, student_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("malformed cursor")
+    if cursor_sort != sort:
+        raise ValueError("cursor was issued for another sort")
+    return value, student_id
+
+
+def query(task_id: str, sort: str = "-date", max_grade: Optional[float] = None,
+          max_confidence: Optional[float] = None, weakness: Optional[str] = None,
+          cursor: Optional[str] = None, limit: int = 50) -> Dict[str, Any]:
+    """
+    A page of a task's submissions: sort is a key of SORT_COLUMNS, prefixed with "-" for descending;
+    max_grade and max_confidence keep the rows strictly below them, weakness the rows with a weakness
+    containing the term (case-insensitive). Returns the documents, the cursor of the next page
+    (None on the last one) and the number of rows matching the filters.
+    """
+    descending = sort.startswith("-")
+    column = SORT_COLUMNS.get(sort.lstrip("-"))
+    if column is None:
+        raise ValueError(f"unknown sort key: {sort}")
+
+    conditions, params = ["task_id = ?"], [task_id]
+    if max_grade is not None:
+        conditions.append("grade < ?")
+        params.append(max_grade)
+    if max_confidence is not None:
+        conditions.append("confidence < ?")
+        params.append(max_confidence)
+    if weakness:
+        conditions.append("instr(weaknesses, ?) > 0")
+        params.append(weakness.casefold())
+    where = " AND ".join(conditions)
+
+    conn = connection_with(SCHEMA)
+    total = conn.execute(f"SELECT COUNT(*) FROM submissions WHERE {where}", params).fetchone()[0]
+
+    page_conditions, page_params = list(conditions), list(params)
+    if cursor:
+        value, student_id = decode_cursor(cursor, sort)
+        if column == "student_id":
+            page_conditions.append(f"student_id {'<' if descending else '>'} ?")
+            page_params.append(student_id)
+        else:
+            page_conditions.append(f"({column}, student_id) {'<' if descending else '>'} (?, ?)")
+            page_params.extend([value, student_id])
+    direction = "DESC" if descending else "ASC"
+    order = "student_id" if column == "student_id" else f"{column} {direction}, student_id"
+    rows = conn.execute(
+        f"SELECT {column}, student_id, document FROM submissions WHERE {' AND '.join(page_conditions)} "
+        f"ORDER BY {order} {direction} LIMIT ?",
+        page_params + [limit + 1]
+    ).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(sort, rows[-1][0], rows[-1][1])
+    return {"total": total, "next_cursor": next_cursor, "documents": [json.loads(row[2]) for row in rows]}
+
+
+def project(document: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    """The requested fields of a listed submission, from its stored document."""
+    analysis_result = document.get("analysis_result") or {}
+    feedback = analysis_result.get("detailed_feedback", {})
+    values = {
+        "student_id": lambda: document.get("student_id"),
+        "name": lambda: document.get("name"),
+        "submission_date": lambda: document.get("submission_date"),
+        "revision": lambda: document.get("revision", 1),
+        "grade": lambda: analysis_result.get("grade"),
+        "confidence": lambda: analysis_result.get("confidence_score"),
+        "error_summary": lambda: analysis_result.get("error_summary"),
+        "strengths": lambda: feedback.get("strengths", []),
+        "weaknesses": lambda: feedback.get("weaknesses", []),
+        "error_count": lambda: len(analysis_result.get("error_highlights", [])),
+        "analysis_source": lambda: document.get("analysis_source"),
+        "analysis_result": lambda: analysis_result
+    }
+    return {field: values[field]() for field in fields}
+
+
+def search(query: str, task_ids: Optional[List[str]] = None, limit: int = 20, offset: int = 0) -> Dict[str, Any]:
+    """
+    Submissions whose feedback matches the query (see feedback_search.match_query), best first,
+    in the given tasks or in all of them. Each hit comes with a highlighted snippet of every
+    column that matched. The tasks must have been synced.
+    """
+    expression = match_query(query)
+    if expression is None:
+        return {"total": 0, "hits": []}
+    conditions, params = ["submission_feedback MATCH ?"], [expression]
+    if task_ids:
+        conditions.append(f"s.task_id IN ({', '.join('?' * len(task_ids))})")
+        params.extend(task_ids)
+    where = " AND ".join(conditions)
+    joined = "submission_feedback JOIN submissions s ON s.rowid = submission_feedback.rowid"
+
+    conn = connection_with(SCHEMA)
+    total = conn.execute(f"SELECT COUNT(*) FROM {joined} WHERE {where}", params).fetchone()[0]
+    open_marker, close_marker = SNIPPET_MARKERS
+    snippets = ", ".join(
+        f"snippet(submission_feedback, {column}, ?, ?, '…', {SNIPPET_WORDS})" for column in range(len(FEEDBACK_COLUMNS))
+    )
+    rows = conn.execute(
+        f"SELECT s.task_id, s.document, {snippets} FROM {joined} WHERE {where} "
+        f"ORDER BY bm25(submission_feedback, {', '.join(map(str, COLUMN_WEIGHTS))}) LIMIT ? OFFSET ?",
+        [open_marker, close_marker] * len(FEEDBACK_COLUMNS) + params + [limit, offset]
+    ).fetchall()
+
+    hits = []
+    for task_id, document, *column_snippets in rows:
+        hits.append({
+            "task_id": task_id,
+            "document": json.loads(document),
+            # snippet() of a column without a match is just its beginning
+            "snippets": {
+                column: snippet for column, snippet in zip(FEEDBACK_COLUMNS, column_snippets) if open_marker in snippet
+            }
+        })
+    return {"total": total, "hits": hits}
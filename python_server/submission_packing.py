@@ -0,0 +1,65 @@
+import os
+import re
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger("proofmate.submission_packing")
+
+# Small submissions of a batch are graded several per completion
+packing_enabled = os.getenv("PACKING_ENABLED", "true").lower() == "true"
+pack_small_submission_tokens = int(os.getenv("PACK_SMALL_SUBMISSION_TOKENS", "1500"))
+pack_input_token_budget = int(os.getenv("PACK_INPUT_TOKEN_BUDGET", "12000"))
+pack_output_tokens_per_submission = int(os.getenv("PACK_OUTPUT_TOKENS_PER_SUBMISSION", "700"))
+pack_max_output_tokens = int(os.getenv("PACK_MAX_OUTPUT_TOKENS", "4000"))
+
+# "=== СТУДЕНТ 3 ===" opens the part of a packed prompt or answer that belongs to the third submission
+STUDENT_DELIMITER = "=== СТУДЕНТ {number} ==="
+STUDENT_DELIMITER_RE = re.compile(r'^\s*=+\s*СТУДЕНТ\s+(\d+)\s*=+\s*$', re.MULTILINE | re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count; Cyrillic text and code average about three characters per token."""
+    return len(text) // 3 + 1
+
+
+def is_small(text: str) -> bool:
+    return estimate_tokens(text) <= pack_small_submission_tokens
+
+
+def plan_packs(texts: List[str], shared_text: str) -> List[List[int]]:
+    """
+    Group submissions (by position) into packs that fit the token budget together with the
+    shared text sent once per pack. The pack size K adapts to the sizes of the submissions
+    and is capped by the answer length the model can produce. Packs of one are graded alone.
+    """
+    max_per_pack = max(pack_max_output_tokens // pack_output_tokens_per_submission, 1)
+    budget = pack_input_token_budget - estimate_tokens(shared_text)
+
+    packs = []
+    current, used = [], 0
+    # Largest first, so that the small ones fill the remaining space
+    for position in sorted(range(len(texts)), key=lambda p: -estimate_tokens(texts[p])):
+        tokens = estimate_tokens(texts[position])
+        if current and (used + tokens > budget or len(current) >= max_per_pack):
+            packs.append(current)
+            current, used = [], 0
+        current.append(position)
+        used += tokens
+    if current:
+        packs.append(current)
+
+    logger.info(f"Packed {len(texts)} small submissions into {len(packs)} completions (sizes {[len(p) for p in packs]})")
+    return packs
+
+
+def split_packed_response(response_text: str, count: int) -> List[Optional[str]]:
+    """Split a packed answer into the parts of each of the count submissions; None for a missing part."""
+    parts = [None] * count
+    matches = list(STUDENT_DELIMITER_RE.finditer(response_text))
+    for position, match in enumerate(matches):
+        number = int(match.group(1))
+        end = matches[position + 1].start() if position + 1 < len(matches) else len(response_text)
+        part = response_text[match.end():end].strip()
+        if 1 <= number <= count and part and parts[number - 1] is None:
+            parts[number - 1] = part
+    return parts
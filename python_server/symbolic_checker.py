@@ -0,0 +1,111 @@
+import os
+import hashlib
+import logging
+from typing import List, Dict, Any, Tuple
+
+from notebook_executor import run_sandboxed, outputs_match
+from shared_cache import SharedCache
+from task_segmenter import split_into_tasks, graded_sections
+
+logger = logging.getLogger("proofmate.symbolic_checker")
+
+# simplify() budget per answer inside the sandbox, before falling back to random-point evaluation
+symbolic_check_seconds = int(os.getenv("SYMBOLIC_CHECK_SECONDS", "5"))
+verdict_cache_size = int(os.getenv("SYMBOLIC_VERDICT_CACHE_SIZE", "4096"))
+
+# Verdicts keyed by the hash of the (student, reference) expression pair, shared by all workers
+_verdict_cache = SharedCache("symbolic_verdict", verdict_cache_size)
+
+
+def answer_pair_hash(student_srepr: str, reference_srepr: str) -> str:
+    return hashlib.sha256(f"{student_srepr}\0{reference_srepr}".encode("utf-8")).hexdigest()
+
+
+def task_answers(cells: List[Dict[str, Any]], run: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """The final value each "Задание N" section produces: the last code cell with a checkable output."""
+    answers = {}
+    for section in split_into_tasks(cells):
+        if section["label"] is None:
+            continue
+        for cell in reversed(section["cells"]):
+            if cell.get("type") != "code":
+                continue
+            result = run.get("cells", {}).get(cell["index"])
+            output = result.get("output") if result and result.get("ok") else None
+            if output and output.get("kind") in ("expr", "matrix", "number"):
+                answers[section["label"]] = {"cell_index": cell["index"], "output": output}
+                break
+    return answers
+
+
+def compare_answers(pairs: List[Tuple[str, str]]) -> List[str]:
+    """Verdicts for (student_srepr, reference_srepr) pairs; uncached ones are decided in one sandboxed run."""
+    verdicts = [None] * len(pairs)
+    pending = []
+    for position, (student_srepr, reference_srepr) in enumerate(pairs):
+        key = answer_pair_hash(student_srepr, reference_srepr)
+        cached = _verdict_cache.get(key)
+        if cached is not None:
+            verdicts[position] = cached
+        else:
+            pending.append((position, key))
+
+    if pending:
+        run = run_sandboxed({
+            "mode": "compare",
+            "seconds": symbolic_check_seconds,
+            "pairs": [list(pairs[position]) for position, _ in pending]
+        })
+        results = run["result"]["verdicts"] if run["ok"] else ["unknown"] * len(pending)
+        for (position, key), verdict in zip(pending, results):
+            verdicts[position] = verdict
+            if run["ok"]:
+                _verdict_cache.set(key, verdict)
+
+    return verdicts
+
+
+def check_task_answers(student_cells: List[Dict[str, Any]], reference_cells: List[Dict[str, Any]],
+                       student_run: Dict[str, Any], reference_run: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compare the final answer of every task with the reference answer of the same task.
+    Verdicts: identical, equivalent (same value, different form), different, missing or unknown.
+    Tasks whose reference gives no expression, matrix or number (text, plots, lists) get no
+    verdict; they are listed as unchecked and all_identical is False while there are any.
+    """
+    student_answers = task_answers(student_cells, student_run)
+    reference_answers = task_answers(reference_cells, reference_run)
+
+    tasks = []
+    symbolic_pairs = []
+    for label, reference_answer in reference_answers.items():
+        student_answer = student_answers.get(label)
+        task = {"task": label, "cell_index": student_answer["cell_index"] if student_answer else None}
+        tasks.append(task)
+
+        if student_answer is None:
+            task["verdict"] = "missing"
+            continue
+
+        student_output, reference_output = student_answer["output"], reference_answer["output"]
+        if "srepr" in student_output and "srepr" in reference_output:
+            symbolic_pairs.append((task, (student_output["srepr"], reference_output["srepr"])))
+        elif student_output["kind"] == reference_output["kind"]:
+            task["verdict"] = "identical" if outputs_match(student_output, reference_output) else "different"
+        else:
+            task["verdict"] = "different"
+
+    if symbolic_pairs:
+        for (task, _), verdict in zip(symbolic_pairs, compare_answers([pair for _, pair in symbolic_pairs])):
+            task["verdict"] = verdict
+
+    unchecked = [section["label"] for section in graded_sections(reference_cells)
+                 if section["label"] is not None and section["label"] not in reference_answers]
+
+    logger.info(f"Symbolic check: {[(t['task'], t['verdict']) for t in tasks]}, unchecked {unchecked}")
+    return {
+        "tasks": tasks,
+        "verified_tasks": [task["task"] for task in tasks if task["verdict"] == "identical"],
+        "unchecked_tasks": unchecked,
+        "all_identical": bool(tasks) and not unchecked and all(task["verdict"] == "identical" for task in tasks)
+    }
@@ -0,0 +1,168 @@
+"""
+Events of a task for the teachers following it: every saved analysis (and every finished batch)
+is appended to a log in the shared SQLite file, so a subscriber connected to any worker process
+sees what the others wrote. Event ids grow monotonically; a subscriber that reconnects passes the
+last id it got and receives what it missed, as long as it is younger than the retention.
+
+Within a process, the subscribers of a task share one TaskFeed: a single poller reads the log for
+the task and wakes them, so the polling costs the same however many teachers follow the task.
+Polls run in an executor of their own, not in the I/O pool the requests use.
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from shared_cache import connection_with
+
+logger = logging.getLogger("proofmate.task_events")
+
+# How long events are kept for subscribers resuming after a disconnect
+task_event_retention = int(os.getenv("TASK_EVENT_RETENTION", str(24 * 3600)))
+# How often the feed of a followed task checks the log for new events (seconds)
+task_event_poll_interval = float(os.getenv("TASK_EVENT_POLL_INTERVAL", "0.5"))
+# Recent events a feed keeps for its subscribers; one further behind reads the log itself
+task_event_buffer = int(os.getenv("TASK_EVENT_BUFFER", "1000"))
+
+ANALYSIS, BATCH = "analysis", "batch"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS task_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS task_events_task ON task_events (task_id, id);
+CREATE INDEX IF NOT EXISTS task_events_age ON task_events (created_at);
+"""
+
+
+def publish(task_id: str, event_type: str, data: Dict[str, Any]) -> Optional[int]:
+    """Append an event to the task's log; returns its id, or None if it could not be stored."""
+    now = time.time()
+    try:
+        conn = connection_with(SCHEMA)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM task_events WHERE created_at < ?", (now - task_event_retention,))
+            event_id = conn.execute(
+                "INSERT INTO task_events (task_id, type, created_at, data) VALUES (?, ?, ?, ?)",
+                (task_id, event_type, now, json.dumps(data, ensure_ascii=False))
+            ).lastrowid
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return event_id
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to publish a {event_type} event of task {task_id}: {str(e)}")
+        return None
+
+
+def read_events(task_id: str, after: int, limit: int = 100) -> List[Dict[str, Any]]:
+    """Events of the task with ids above `after`, oldest first."""
+    try:
+        rows = connection_with(SCHEMA).execute(
+            "SELECT id, type, created_at, data FROM task_events WHERE task_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (task_id, after, limit)
+        ).fetchall()
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to read the events of task {task_id}: {str(e)}")
+        return []
+    return [
+        {"id": event_id, "type": event_type, "created_at": created_at, "data": json.loads(data)}
+        for event_id, event_type, created_at, data in rows
+    ]
+
+
+def latest_event_id() -> int:
+    """Id of the newest event of any task: a subscription without a cursor starts after it."""
+    try:
+        row = connection_with(SCHEMA).execute("SELECT MAX(id) FROM task_events").fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to read the event log: {str(e)}")
+        return 0
+    return row[0] or 0
+
+
+_poll_executor = None
+
+
+async def _in_poll_executor(func, *args):
+    global _poll_executor
+    if _poll_executor is None:
+        _poll_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="proofmate-events")
+    return await asyncio.get_running_loop().run_in_executor(_poll_executor, func, *args)
+
+
+class TaskFeed:
+    """
+    The new events of one task for the subscribers in this process. The feed holds every event
+    of the task with an id in (floor, head]: a subscriber whose cursor is at or past the floor is
+    served from memory, one further behind (resuming after a long disconnect) from the log.
+    """
+
+    def __init__(self, task_id: str, head: int):
+        self.task_id = task_id
+        self.floor = self.head = head
+        self.recent = deque()
+        self.changed = asyncio.Condition()
+        self.subscribers = 0
+        self.poller = None
+
+    async def poll(self):
+        while True:
+            await asyncio.sleep(task_event_poll_interval)
+            try:
+                events = await _in_poll_executor(read_events, self.task_id, self.head)
+            except Exception as e:
+                logger.warning(f"Failed to poll the events of task {self.task_id}: {str(e)}")
+                continue
+            if not events:
+                continue
+            async with self.changed:
+                self.recent.extend(events)
+                self.head = events[-1]["id"]
+                while len(self.recent) > task_event_buffer:
+                    self.floor = self.recent.popleft()["id"]
+                self.changed.notify_all()
+
+    async def events_after(self, cursor: int, timeout: float) -> List[Dict[str, Any]]:
+        """Events with ids above the cursor, waiting up to timeout for one if there are none yet."""
+        if cursor < self.floor:
+            return await _in_poll_executor(read_events, self.task_id, cursor)
+        async with self.changed:
+            if self.head <= cursor:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    return []
+            return [event for event in self.recent if event["id"] > cursor]
+
+
+_feeds: Dict[str, TaskFeed] = {}
+
+
+@contextlib.asynccontextmanager
+async def subscription(task_id: str, cursor: int):
+    """The feed of a task for one subscriber; the feed polls while the task has subscribers."""
+    feed = _feeds.get(task_id)
+    if feed is None:
+        feed = _feeds[task_id] = TaskFeed(task_id, cursor)
+        feed.poller = asyncio.create_task(feed.poll())
+    feed.subscribers += 1
+    try:
+        yield feed
+    finally:
+        feed.subscribers -= 1
+        if feed.subscribers == 0:
+            feed.poller.cancel()
+            del _feeds[task_id]
@@ -0,0 +1,160 @@
+import re
+import logging
+from typing import List, Dict, Any
+
+logger = logging.getLogger("proofmate.task_segmenter")
+
+# "### Задание 4.", "## Задание 10", "### Индивидуальное задание" (header anywhere in a markdown cell)
+TASK_HEADER_RE = re.compile(r'^#+\s*(Задание\s*(\d+)|Индивидуальное\s+задание)', re.IGNORECASE | re.MULTILINE)
+
+
+def task_label(match) -> str:
+    """Canonical label of a task header match, used to align student and reference notebooks."""
+    if match.group(2):
+        return f"Задание {int(match.group(2))}"
+    return "Индивидуальное задание"
+
+
+def split_into_tasks(cells: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Split parsed notebook cells into sections started by task headers.
+    Cells before the first header form a section with label None.
+    Returns [{"label": str|None, "cells": [cell, ...]}] in notebook order.
+    """
+    sections = [{"label": None, "cells": []}]
+    for cell in cells:
+        if cell.get("type") == "markdown":
+            headers = list(TASK_HEADER_RE.finditer(cell.get("content", "")))
+            if headers:
+                # A cell with several headers starts the section of the last one
+                sections.append({"label": task_label(headers[-1]), "cells": []})
+        sections[-1]["cells"].append(cell)
+
+    if not sections[0]["cells"]:
+        sections.pop(0)
+    return sections
+
+
+def has_code(cells: List[Dict[str, Any]]) -> bool:
+    return any(cell.get("type") == "code" and cell.get("content", "").strip() for cell in cells)
+
+
+def graded_sections(cells: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    The sections a reference notebook is graded by: its task sections that contain code, or the
+    whole notebook as one section (label None) if it has no task headers.
+    """
+    sections = [section for section in split_into_tasks(cells) if section["label"] is not None]
+    if not sections:
+        sections = [{"label": None, "cells": cells}]
+    return [section for section in sections if has_code(section["cells"])]
+
+
+def align_tasks(student_cells: List[Dict[str, Any]], reference_cells: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Pair the sections of the student and reference notebooks by task label.
+    Returns units {"label", "student_cells", "reference_cells"} in student notebook order;
+    reference tasks the student left out are appended with no student cells.
+    """
+    reference_sections = {section["label"]: section["cells"] for section in split_into_tasks(reference_cells)}
+    units = []
+    seen = set()
+    for section in split_into_tasks(student_cells):
+        label = section["label"]
+        if label in seen:
+            # Repeated header in the student notebook: keep it with the first occurrence
+            units[-1]["student_cells"].extend(section["cells"])
+            continue
+        seen.add(label)
+        units.append({
+            "label": label,
+            "student_cells": section["cells"],
+            "reference_cells": reference_sections.get(label, [])
+        })
+    for label, cells in reference_sections.items():
+        if label not in seen:
+            units.append({"label": label, "student_cells": [], "reference_cells": cells})
+    return units
+
+
+def cells_repr(cells: List[Dict[str, Any]], max_output_chars: int = 500) -> str:
+    """Compact text form of cells, labelled with their global notebook cell indices."""
+    parts = []
+    for cell in cells:
+        text = f"# Ячейка {cell['index']} ({cell.get('type')})\n{cell.get('content', '')}"
+        outputs = []
+        for output in cell.get("outputs", []):
+            if output.get("output_type") == "stream":
+                outputs.append(output.get("text", ""))
+            elif output.get("output_type") in ("execute_result", "display_data"):
+                outputs.append(output.get("data", {}).get("text/plain", ""))
+            elif output.get("output_type") == "error":
+                outputs.append(f"{output.get('ename')}: {output.get('evalue')}")
+        output_text = "".join(o if isinstance(o, str) else "".join(o) for o in outputs).strip()
+        if output_text:
+            text += f"\n# Вывод:\n{output_text[:max_output_chars]}"
+        parts.append(text)
+    return "\n\n".join(parts) if parts else "# (нет ячеек)"
+
+
+def globalize_cell_index(cell_index: int, unit_cells: List[Dict[str, Any]]) -> int:
+    """Map a cell number from a per-task answer to the global notebook index (answers may count cells locally)."""
+    global_indices = [cell["index"] for cell in unit_cells]
+    if cell_index in global_indices or not global_indices:
+        return cell_index
+    if 0 <= cell_index < len(global_indices):
+        return global_indices[cell_index]
+    if 1 <= cell_index <= len(global_indices):
+        return global_indices[cell_index - 1]
+    return cell_index
+
+
+# Defaults parse_ai_response fills in when a section is missing from the answer
+PLACEHOLDER_ITEMS = (
+    "Решение демонстрирует понимание основных математических концепций",
+    "Ознакомьтесь с комментариями к ячейкам для детальных рекомендаций"
+)
+
+
+def merge_task_analyses(units: List[Dict[str, Any]], analyses: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge per-task analyses into one analysis: mean grade and confidence, labelled feedback, global cell indices."""
+    graded = [(unit, analysis) for unit, analysis in zip(units, analyses) if analysis is not None]
+    if not graded:
+        raise ValueError("No task analyses to merge")
+
+    summaries = []
+    feedback = {"strengths": [], "weaknesses": [], "suggestions": []}
+    cell_annotations = {}
+    for unit, analysis in graded:
+        label = unit["label"] or "Общая часть"
+        summaries.append(f"{label}: {analysis['error_summary']}")
+        for key in feedback:
+            items = [f"{label}: {item}" for item in analysis["detailed_feedback"].get(key, []) if item not in PLACEHOLDER_ITEMS]
+            if items:
+                feedback[key].append(items)
+        for annotation in analysis["cell_annotations"]:
+            cell_index = globalize_cell_index(annotation["cell_index"], unit["student_cells"])
+            cell_annotations.setdefault(cell_index, []).extend(annotation["comments"])
+
+    # Round-robin across tasks so every task is represented in the top items
+    merged_feedback = {}
+    for key, per_task in feedback.items():
+        merged_feedback[key] = [
+            items[position] for position in range(max(map(len, per_task), default=0))
+            for items in per_task if position < len(items)
+        ]
+
+    return {
+        "error_summary": "\n".join(summaries),
+        "detailed_feedback": {
+            "strengths": merged_feedback["strengths"][:5] or [PLACEHOLDER_ITEMS[0]],
+            "weaknesses": merged_feedback["weaknesses"][:5],
+            "suggestions": merged_feedback["suggestions"][:5] or [PLACEHOLDER_ITEMS[1]]
+        },
+        "confidence_score": sum(a["confidence_score"] for _, a in graded) / len(graded),
+        "grade": sum(a["grade"] for _, a in graded) / len(graded),
+        "cell_annotations": [
+            {"cell_index": cell_index, "comments": comments}
+            for cell_index, comments in sorted(cell_annotations.items())
+        ]
+    }
@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+import tempfile
+import threading
+
+import pytest
+
+# Importing the servers configures their log file and storage; tests do not write those into the tree
+os.environ.setdefault("LOG_FILE", os.path.join(tempfile.gettempdir(), "proofmate_tests_log.txt"))
+os.environ.setdefault("LOCAL_BATCH_DIR", os.path.join(tempfile.gettempdir(), "proofmate_tests_local_batch"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shared_cache
+
+SAMPLE_NOTEBOOK = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                               "Alg_1_2023_24_tasks.ipynb")
+
+
+@pytest.fixture
+def shared_store(tmp_path, monkeypatch):
+    """A fresh shared SQLite file for the test, reopened by every module and thread that uses it."""
+    monkeypatch.setattr(shared_cache, "shared_cache_path", str(tmp_path / "shared_cache.sqlite3"))
+    # A new thread-local drops the connections the pool threads kept from earlier tests too
+    monkeypatch.setattr(shared_cache, "_local", threading.local())
+    yield tmp_path
+    conn = getattr(shared_cache._local, "conn", None)
+    if conn is not None:
+        conn.close()
+
+
+@pytest.fixture
+def sample_cells():
+    """Cells of the sample assignment notebook (parsed like extract_cells_from_notebook), code cells filled in."""
+    with open(SAMPLE_NOTEBOOK, encoding="utf-8") as file:
+        notebook = json.load(file)
+    cells = []
+    for index, cell in enumerate(notebook["cells"]):
+        source = "".join(cell["source"])
+        if cell["cell_type"] == "code":
+            cells.append({"index": index, "type": "code", "content": source or f"answer_{index} = {index}", "outputs": []})
+        else:
+            cells.append({"index": index, "type": "markdown", "content": source})
+    return cells
@@ -0,0 +1,73 @@
+import admission_control
+from admission_control import AdmissionController, OK, BUSY, OVERLOADED
+
+
+def controller(**overrides):
+    settings = {"max_in_flight": 8, "min_in_flight": 2, "target_latency": 10.0, "max_llm_waiting": 5}
+    settings.update(overrides)
+    return AdmissionController(**settings)
+
+
+def test_admits_up_to_the_in_flight_limit():
+    admission = controller()
+    for _ in range(8):
+        assert admission.try_admit(0)[0]
+    admitted, load = admission.try_admit(0)
+    assert not admitted
+    assert load["state"] == OVERLOADED and load["reasons"] == ["in_flight"]
+    admission.release()
+    assert admission.try_admit(0)[0]
+    assert admission.stats() == {"admitted": 9, "rejected": 1, "redirected": 0}
+
+
+def test_busy_before_overloaded():
+    admission = controller()
+    for _ in range(5):
+        admission.try_admit(0)
+    assert admission.load(0)["state"] == OK
+    admission.try_admit(0)
+    assert admission.load(0)["state"] == BUSY
+
+
+def test_waiting_model_calls_reject():
+    admission = controller()
+    admitted, load = admission.try_admit(5)
+    assert not admitted and load["reasons"] == ["llm_queue"]
+    assert admission.in_flight == 0
+
+
+def test_slow_upstream_shrinks_the_limit():
+    admission = controller()
+    admission.observe_latency(20.0)
+    load = admission.load(0)
+    assert load["in_flight_limit"] == 4 and load["state"] == BUSY
+    admission.observe_latency(1000.0)
+    assert admission.load(0)["in_flight_limit"] == 2
+
+
+def test_latency_is_smoothed():
+    admission = controller()
+    admission.observe_latency(10.0)
+    admission.observe_latency(60.0)
+    assert admission.latency == 10.0 + admission_control.LATENCY_SMOOTHING * 50.0
+
+
+def test_redirect_is_not_counted_as_rejected():
+    admission = controller(max_in_flight=1)
+    admission.try_admit(0)
+    admission.try_admit(0)
+    admission.count_redirect()
+    assert admission.stats() == {"admitted": 1, "rejected": 0, "redirected": 1}
+
+
+def test_retry_after_bounds(monkeypatch):
+    admission = controller()
+    assert admission.retry_after(0, 16) == 10
+    admission.observe_latency(0.01)
+    assert admission.retry_after(0, 16) == 1
+    admission = controller()
+    admission.observe_latency(30.0)
+    assert admission.retry_after(16, 16) == 60
+    monkeypatch.setattr(admission_control, "admission_max_retry_after", 45)
+    assert admission.retry_after(16, 16) == 45
+    assert admission.retry_after(10, 0) == 45
@@ -0,0 +1,57 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main_functional
+from test_similarity_index import SOLUTION, notebook
+
+LLM_ANSWER = "Решение выполнено аккуратно, ответы получены.\n\nОценка: 8\nУверенность: 0.9"
+
+
+@pytest.fixture
+def batch(shared_store, monkeypatch):
+    """POST /api/batch-analyze with a stubbed model that records its prompts."""
+    monkeypatch.chdir(shared_store)
+    monkeypatch.setattr(main_functional, "packing_enabled", False)
+    prompts = []
+
+    def complete(prompt, *args):
+        prompts.append(prompt)
+        return LLM_ANSWER
+
+    monkeypatch.setattr(main_functional, "request_analysis_completion", complete)
+    client = TestClient(main_functional.app)
+
+    def post(submissions):
+        response = client.post(
+            "/api/batch-analyze",
+            data={"task_id": "alg1", "cluster_threshold": "0.5"},
+            files=[("reference_solution", ("reference.ipynb", notebook(SOLUTION)))] + [
+                ("notebook_files", (f"{name}.ipynb", notebook(sources))) for name, sources in submissions
+            ]
+        )
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    return post, prompts
+
+
+def test_truncated_member_gets_its_own_analysis(batch):
+    post, prompts = batch
+    result = post([("ivanov", SOLUTION), ("petrov", SOLUTION), ("sidorov", SOLUTION[:9])])
+    assert result["clusters"] == 1
+    sources = {item["name"]: item["analysis_source"] for item in result["results"]}
+    assert sources["ivanov"]["type"] == "cluster_representative"
+    assert sources["petrov"] == {**sources["petrov"], "type": "cluster_member", "changed_cells": []}
+    assert sources["sidorov"]["type"] == "cluster_member" and sources["sidorov"]["changed_cells"] == [9]
+    # The representative and the truncated member, each with a full prompt; the exact copy costs nothing
+    assert result["llm_calls"] == 2 and len(prompts) == 2
+    assert all("# Решение студента" in prompt for prompt in prompts)
+
+
+def test_member_with_an_edited_cell_gets_a_delta(batch):
+    post, prompts = batch
+    edited = SOLUTION[:9] + ["B.rank(), B.shape, B.nullspace()"]
+    result = post([("ivanov", SOLUTION), ("petrov", edited)])
+    sources = {item["name"]: item["analysis_source"] for item in result["results"]}
+    assert sources["petrov"]["changed_cells"] == [9]
+    assert len(prompts) == 2 and "# Решение студента" not in prompts[1]
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+import main_functional
+
+ANALYSIS = {
+    "error_summary": "Решение верное",
+    "detailed_feedback": {"strengths": ["Аккуратный код"], "weaknesses": [], "suggestions": []},
+    "confidence_score": 0.9,
+    "grade": 9,
+    "cell_annotations": [],
+    "error_highlights": []
+}
+
+
+def multipart(fields, files):
+    boundary = "proofmate-test-boundary"
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n')
+    for name, (filename, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n{content}\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n")
+    return "".join(parts).encode("utf-8"), f"multipart/form-data; boundary={boundary}"
+
+
+async def post_and_disconnect(headers):
+    """POST /api/analyze from a client that goes away right after sending the body; returns the response start."""
+    body, content_type = multipart(
+        {"task_id": "alg1", "student_name": "Кузнецов"},
+        {"notebook_file": ("student.ipynb", "{}"), "reference_solution": ("reference.ipynb", "{}")}
+    )
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/api/analyze", "raw_path": b"/api/analyze", "root_path": "",
+        "query_string": b"", "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+        "headers": [
+            (b"host", b"testserver"), (b"content-type", content_type.encode()),
+            (b"content-length", str(len(body)).encode())
+        ] + [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+    }
+    sent = []
+    messages = [{"type": "http.request", "body": body, "more_body": False}, {"type": "http.disconnect"}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    await asyncio.wait_for(main_functional.app(scope, receive, send), 10)
+    return next(message for message in sent if message["type"] == "http.response.start")
+
+
+@pytest.fixture
+def slow_analysis(shared_store, monkeypatch):
+    """run_analysis stubbed to take a while, so that the client is gone before it ends."""
+    monkeypatch.chdir(shared_store)
+    finished = []
+
+    async def run_analysis(task_id, student_id, *args):
+        await asyncio.sleep(0.3)
+        finished.append(student_id)
+        return ANALYSIS
+
+    monkeypatch.setattr(main_functional, "run_analysis", run_analysis)
+    return finished
+
+
+def test_keyed_request_is_finished_after_the_client_disconnects(slow_analysis):
+    assert asyncio.run(post_and_disconnect({"Idempotency-Key": "retry-me"}))["status"] == 200
+    assert len(slow_analysis) == 1
+    # The client's retry gets the stored result
+    retry = asyncio.run(post_and_disconnect({"Idempotency-Key": "retry-me"}))
+    assert retry["status"] == 200 and (b"idempotent-replayed", b"true") in retry["headers"]
+    assert len(slow_analysis) == 1
+
+
+def test_unkeyed_request_stops_when_the_client_disconnects(slow_analysis):
+    assert asyncio.run(post_and_disconnect({}))["status"] == 499
+    assert slow_analysis == []
@@ -0,0 +1,79 @@
+import pytest
+
+from error_highlighter import diff_hunks, traceback_line, comment_highlights, build_error_highlights
+
+REFERENCE = """import sympy
+x = sympy.Symbol('x')
+A = sympy.Matrix([[1, x], [0, 2]])
+d = A.det()
+d"""
+
+# Line 4 differs, a comment and a blank line are added
+STUDENT = """import sympy
+x = sympy.Symbol('x')  # переменная
+
+A = sympy.Matrix([[1, x], [0, 2]])
+d = A.trace()
+d"""
+
+
+def spans(highlights):
+    return [(item["cell_index"], item["line_start"], item["line_end"], item["error_type"]) for item in highlights]
+
+
+def test_diff_hunks_are_student_line_ranges():
+    assert diff_hunks(STUDENT, REFERENCE) == [(5, 5, ["d = A.det()"])]
+    assert diff_hunks(REFERENCE, REFERENCE) == []
+
+
+def test_changed_block_and_missing_lines():
+    student = "a = 1\nb = 3\nc = 4\nprint(a)"
+    reference = "a = 1\nb = 2\nc = 2\nd = 5\nprint(a)"
+    assert diff_hunks(student, reference) == [(2, 3, ["b = 2", "c = 2", "d = 5"])]
+    # Lines the student left out are pointed at where they belong
+    assert diff_hunks("a = 1\nprint(a)", "a = 1\nb = 2\nprint(a)") == [(2, 2, ["b = 2"])]
+
+
+@pytest.mark.parametrize("traceback_text, line", [
+    ("\x1b[0;31mZeroDivisionError\x1b[0m\nCell \x1b[0;32mIn[5], line 3\x1b[0m\n", 3),
+    ("---------\nZeroDivisionError\n----> 7 y = 1 / 0\n", 7),
+    ('Traceback (most recent call last):\n  File "<cell>", line 2, in <module>\n', 2),
+    ("ZeroDivisionError: division by zero", None),
+])
+def test_traceback_line(traceback_text, line):
+    assert traceback_line(traceback_text) == line
+
+
+def test_comments_land_on_referenced_lines_or_matching_hunks():
+    cell = {"index": 4, "type": "code", "content": STUDENT}
+    highlights = comment_highlights(cell, [
+        "Строки 4-5: матрица задана неверно",
+        "Нужен определитель, а не trace",
+        "Line 40: лишний вывод"
+    ], {"content": REFERENCE})
+    assert spans(highlights) == [(4, 4, 5, "reviewer_comment"), (4, 5, 5, "reference_mismatch"), (4, 6, 6, "reviewer_comment")]
+    assert highlights[1]["suggestion"] == "Сравните с эталонным решением: d = A.det()"
+
+
+def test_error_highlights_of_a_notebook():
+    header = {"index": 0, "type": "markdown", "content": "### Задание 1"}
+    student = [
+        header,
+        {"index": 1, "type": "code", "content": STUDENT},
+        {"index": 2, "type": "code", "content": "y = 1\nz = y / 0  # ERROR", "outputs": [{
+            "output_type": "error", "ename": "ZeroDivisionError", "evalue": "division by zero",
+            "traceback": ["Cell In[2], line 2"]
+        }]},
+    ]
+    reference = [header, {"index": 1, "type": "code", "content": REFERENCE}, {"index": 2, "type": "code", "content": "y = 1"}]
+    highlights = build_error_highlights(
+        student, reference, [{"cell_index": 1, "comments": ["Вместо trace нужен det"]}],
+        symbolic_check={"tasks": [{"task": "Задание 1", "cell_index": 1, "verdict": "different"}]}
+    )
+    assert spans(highlights) == [
+        (1, 5, 5, "wrong_result"),
+        (1, 5, 5, "reference_mismatch"),
+        (2, 2, 2, "runtime_error"),
+        (2, 2, 2, "marked_error")
+    ]
+    assert highlights[2]["error_message"] == "ZeroDivisionError: division by zero"
@@ -0,0 +1,73 @@
+from notebook_executor import compare_executions, outputs_match
+from task_segmenter import split_into_tasks
+
+# Tasks of the sample notebook whose answer is an expression or a matrix; the others print text or lists
+COMPUTED_TASKS = ["Задание 4", "Задание 5", "Задание 6", "Задание 9", "Задание 10"]
+
+
+def sample_run(cells, answers=None):
+    """A sandbox run of the sample notebook: computed tasks end with an expression, the rest with text."""
+    answers = answers or {}
+    run = {"ok": True, "cells": {}}
+    for section in split_into_tasks(cells):
+        for cell in section["cells"]:
+            if cell["type"] != "code":
+                continue
+            if section["label"] in COMPUTED_TASKS:
+                value = answers.get(section["label"], f"x**{cell['index']}")
+                output = {"kind": "expr", "value": value, "srepr": value}
+            elif section["label"] is None:
+                output = None
+            else:
+                output = {"kind": "text", "value": "[(x**2, y**2, z**2)]"}
+            run["cells"][cell["index"]] = {"index": cell["index"], "ok": True, "output": output}
+    return run
+
+
+def test_tasks_without_checkable_values_are_unchecked(sample_cells):
+    reference_run = sample_run(sample_cells)
+    check = compare_executions(sample_run(sample_cells), reference_run, sample_cells)
+    assert check["verified_tasks"] == COMPUTED_TASKS
+    assert check["unchecked_tasks"] == [
+        "Задание 1", "Задание 2", "Задание 3", "Задание 7", "Задание 8", "Индивидуальное задание"
+    ]
+    assert not check["mismatched_cells"] and not check["failed_cells"]
+    assert not check["all_match"]
+
+
+def test_mismatched_task_is_not_verified(sample_cells):
+    check = compare_executions(sample_run(sample_cells, {"Задание 5": "0"}), sample_run(sample_cells), sample_cells)
+    assert "Задание 5" not in check["verified_tasks"]
+    assert check["mismatched_cells"] == [12]
+
+
+def test_all_match_needs_every_task_checked():
+    cells = [
+        {"index": 0, "type": "markdown", "content": "### Задание 1"},
+        {"index": 1, "type": "code", "content": "A.det()"},
+        {"index": 2, "type": "markdown", "content": "### Задание 2"},
+        {"index": 3, "type": "code", "content": "A.rank()"},
+    ]
+    run = {"ok": True, "cells": {
+        1: {"ok": True, "output": {"kind": "number", "value": 2}},
+        3: {"ok": True, "output": {"kind": "number", "value": 3}},
+    }}
+    assert compare_executions(run, run, cells)["all_match"]
+    student_run = {"ok": True, "cells": {**run["cells"], 3: {"ok": False, "output": None}}}
+    check = compare_executions(student_run, run, cells)
+    assert check["verified_tasks"] == ["Задание 1"] and check["failed_cells"] == [3]
+    assert not check["all_match"]
+
+
+def test_notebook_without_task_headers_is_one_task():
+    cells = [{"index": 0, "type": "code", "content": "import sympy"}, {"index": 1, "type": "code", "content": "2 ** 10"}]
+    run = {"ok": True, "cells": {0: {"ok": True, "output": None}, 1: {"ok": True, "output": {"kind": "number", "value": 1024}}}}
+    check = compare_executions(run, run, cells)
+    assert check["verified_tasks"] == [None] and check["all_match"]
+
+
+def test_numbers_match_within_tolerance():
+    assert outputs_match({"kind": "number", "value": 0.1 + 0.2}, {"kind": "number", "value": 0.3})
+    assert not outputs_match({"kind": "number", "value": 0.31}, {"kind": "number", "value": 0.3})
+    assert outputs_match({"kind": "matrix", "shape": [1, 2], "values": [[1, {"re": 0, "im": 1}]]},
+                         {"kind": "matrix", "shape": [1, 2], "values": [[1.0, {"re": 0.0, "im": 1.0}]]})
@@ -0,0 +1,89 @@
+import pytest
+
+import submission_catalog
+from feedback_search import stem, match_query
+
+
+@pytest.mark.parametrize("word, expected", [
+    ("определителя", "определител"),
+    ("определителей", "определител"),
+    ("матрицы", "матриц"),
+    ("производной", "производн"),
+    ("вычислении", "вычислен"),
+    ("собственные", "собствен"),
+    ("Переставлялись", "переставля"),
+    ("красивейший", "красив"),
+    ("ёлки", "елк"),
+    ("x2", "x2"),
+])
+def test_stem(word, expected):
+    assert stem(word) == expected
+
+
+def test_query_words_are_stemmed_prefixes():
+    assert match_query("ошибка в определителе") == '"ошибк"* AND "определител"*'
+
+
+def test_one_letter_and_stop_words_are_dropped():
+    assert match_query("Ошибки для матрицы A") == '"ошибк"* AND "матриц"*'
+    assert match_query("и в x") is None
+    assert match_query("...") is None
+
+
+def test_query_syntax_is_quoted():
+    assert match_query('ранг" OR NEAR(матрицы') == '"ранг"* AND "near"* AND "матриц"*'
+
+
+def analysis(summary, annotation=""):
+    return {
+        "grade": 5,
+        "confidence_score": 0.9,
+        "error_summary": summary,
+        "detailed_feedback": {"strengths": [], "weaknesses": [], "suggestions": []},
+        "cell_annotations": [{"cell_index": 3, "comments": [annotation]}] if annotation else []
+    }
+
+
+@pytest.fixture
+def indexed(shared_store):
+    for student_id, summary, annotation in [
+        ("s1", "Ошибка в вычислении определителя матрицы.", "Неверный знак определителя"),
+        ("s2", "Ранг матрицы определён верно.", ""),
+        ("s3", "Неверно найдена производная.", ""),
+    ]:
+        submission_catalog.record("t1", {
+            "student_id": student_id, "name": student_id, "submission_date": "2026-10-01 10:00:00",
+            "analysis_result": analysis(summary, annotation)
+        })
+    submission_catalog.record("t2", {
+        "student_id": "s9", "name": "s9", "submission_date": "2026-10-01 10:00:00",
+        "analysis_result": analysis("Определитель не найден.")
+    })
+
+
+def found(result):
+    return sorted((hit["task_id"], hit["document"]["student_id"]) for hit in result["hits"])
+
+
+def test_search_finds_other_word_forms(indexed):
+    assert found(submission_catalog.search("определитель")) == [("t1", "s1"), ("t2", "s9")]
+    assert found(submission_catalog.search("матрица ранг")) == [("t1", "s2")]
+    assert found(submission_catalog.search("ошибки в определителях")) == [("t1", "s1")]
+
+
+def test_search_by_task_and_snippets(indexed):
+    result = submission_catalog.search("определитель", ["t1"])
+    assert result["total"] == 1
+    snippets = result["hits"][0]["snippets"]
+    assert "<mark>определителя</mark>" in snippets["error_summary"]
+    assert "<mark>определителя</mark>" in snippets["cell_annotations"]
+    assert "detailed_feedback" not in snippets
+
+
+def test_search_ignores_feedback_it_replaced(indexed):
+    submission_catalog.record("t1", {
+        "student_id": "s3", "name": "s3", "submission_date": "2026-10-02 10:00:00",
+        "analysis_result": analysis("Интеграл вычислен верно.")
+    })
+    assert found(submission_catalog.search("производная")) == []
+    assert found(submission_catalog.search("интеграл")) == [("t1", "s3")]
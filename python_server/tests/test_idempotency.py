@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from idempotency import IdempotencyStore, fingerprint, NEW, REPLAY, PENDING, MISMATCH
+
+
+@pytest.fixture
+def store(shared_store):
+    return IdempotencyStore("analyze", ttl=60, pending_ttl=60)
+
+
+def test_first_request_claims_the_key(store):
+    assert store.begin("k1", fingerprint("a")) == (NEW, None)
+    assert store.begin("k1", fingerprint("a")) == (PENDING, None)
+
+
+def test_finished_response_is_replayed(store):
+    store.begin("k1", fingerprint("a"))
+    store.complete("k1", 200, {"grade": 8, "comment": "Верно"})
+    assert store.begin("k1", fingerprint("a")) == (REPLAY, {"status_code": 200, "body": {"grade": 8, "comment": "Верно"}})
+
+
+def test_key_reused_with_another_request(store):
+    store.begin("k1", fingerprint("a"))
+    assert store.begin("k1", fingerprint("b")) == (MISMATCH, None)
+    store.complete("k1", 200, {})
+    assert store.begin("k1", fingerprint("b")) == (MISMATCH, None)
+
+
+def test_abandoned_key_runs_again(store):
+    store.begin("k1", fingerprint("a"))
+    store.abandon("k1")
+    assert store.begin("k1", fingerprint("a")) == (NEW, None)
+
+
+def test_abandon_keeps_a_finished_response(store):
+    store.begin("k1", fingerprint("a"))
+    store.complete("k1", 200, {"grade": 8})
+    store.abandon("k1")
+    assert store.begin("k1", fingerprint("a"))[0] == REPLAY
+
+
+def test_namespaces_are_separate(store):
+    other = IdempotencyStore("batch", ttl=60, pending_ttl=60)
+    store.begin("k1", fingerprint("a"))
+    assert other.begin("k1", fingerprint("b")) == (NEW, None)
+
+
+def test_expired_records_are_forgotten(shared_store, monkeypatch):
+    store = IdempotencyStore("analyze", ttl=60, pending_ttl=10)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now)
+    store.begin("stuck", fingerprint("a"))
+    store.begin("done", fingerprint("a"))
+    store.complete("done", 200, {})
+
+    monkeypatch.setattr(time, "time", lambda: now + 30)
+    assert store.begin("stuck", fingerprint("b")) == (NEW, None)
+    assert store.begin("done", fingerprint("a"))[0] == REPLAY
+
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    assert store.begin("done", fingerprint("b")) == (NEW, None)
+
+
+def test_fingerprint_depends_on_every_part():
+    assert fingerprint("task", "notebook") == fingerprint("task", "notebook")
+    assert fingerprint("task", "notebook") != fingerprint("task", "notebook2")
+    assert fingerprint("ab", "c") != fingerprint("a", "bc")
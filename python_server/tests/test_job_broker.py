@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+import job_broker
+from job_broker import InProcessBroker, RedisBroker, QUEUED, RUNNING, DONE, FAILED, CANCELLED
+from priority_scheduler import INTERACTIVE, BATCH, BACKGROUND, WeightedRotation
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    redis = pytest.importorskip("redis")
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, "from_url", lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+    return server
+
+
+@pytest.fixture(params=["memory", "redis"])
+def broker(request):
+    if request.param == "memory":
+        return InProcessBroker()
+    request.getfixturevalue("redis_server")
+    return RedisBroker("redis://broker:6379/0")
+
+
+def test_claim_and_complete(broker):
+    broker.enqueue("j1", {"task_id": "t1"})
+    assert broker.status("j1")["status"] == QUEUED
+    assert broker.claim("w1", 0) == ("j1", {"task_id": "t1"})
+    assert broker.status("j1")["status"] == RUNNING
+    assert broker.status("j1")["worker"] == "w1"
+    broker.complete("j1", "w1", {"grade": 7})
+    job = broker.status("j1")
+    assert job["status"] == DONE and job["result"] == {"grade": 7}
+    assert broker.claim("w1", 0) is None
+
+
+def test_failed_job_keeps_its_error(broker):
+    broker.enqueue("j1", {})
+    broker.claim("w1", 0)
+    broker.fail("j1", "w1", {"status_code": 400, "detail": "Неверный формат"})
+    job = broker.status("j1")
+    assert job["status"] == FAILED and job["error"]["status_code"] == 400
+
+
+def test_only_queued_jobs_are_cancelled(broker):
+    broker.enqueue("j1", {})
+    broker.enqueue("j2", {})
+    assert broker.cancel("j1")
+    assert broker.status("j1")["status"] == CANCELLED
+    assert broker.claim("w1", 0)[0] == "j2"
+    assert not broker.cancel("j2")
+    assert broker.queue_depth() == 0
+
+
+def test_claims_follow_the_weights(broker):
+    broker._rotation = WeightedRotation({INTERACTIVE: 8, BATCH: 3, BACKGROUND: 1})
+    for i in range(8):
+        broker.enqueue(f"b{i}", {}, BATCH)
+        broker.enqueue(f"i{i}", {}, INTERACTIVE)
+    broker.enqueue("g0", {}, BACKGROUND)
+    assert broker.queue_depth(INTERACTIVE) == 8
+    claimed = [broker.claim("w1", 0)[0][0] for _ in range(12)]
+    assert claimed.count("i") == 8
+    assert claimed.count("b") + claimed.count("g") == 4
+    assert broker.queue_depth() == 5
+
+
+def test_unknown_broker_url():
+    with pytest.raises(ValueError):
+        job_broker.create_broker("amqp://broker")
+
+
+def test_restarted_worker_puts_back_its_jobs(redis_server):
+    broker = RedisBroker("redis://broker:6379/0")
+    broker.enqueue("j1", {"n": 1})
+    broker.enqueue("j2", {"n": 2})
+    broker.claim("w1", 0)
+    assert broker.recover("w1") == 1
+    assert broker.queue_depth() == 2
+    # The job put back is first in line
+    assert broker.claim("w1", 0) == ("j1", {"n": 1})
+
+
+def test_jobs_of_a_silent_worker_are_reaped(redis_server):
+    broker = RedisBroker("redis://broker:6379/0")
+    broker.enqueue("j1", {"n": 1})
+    broker.heartbeat("w1")
+    broker.heartbeat("w2")
+    broker.claim("w1", 0)
+
+    assert broker.reap("w2") == 0
+    broker.redis.delete(broker._heartbeat_key("w1"))
+    assert broker.reap("w2") == 1
+    assert broker.redis.smembers(RedisBroker.WORKERS_KEY) == {"w2"}
+    assert broker.claim("w2", 0) == ("j1", {"n": 1})
+    # A worker never reaps itself
+    broker.redis.delete(broker._heartbeat_key("w2"))
+    assert broker.reap("w2") == 0
+
+
+def test_heartbeat_expires(redis_server, monkeypatch):
+    monkeypatch.setattr(job_broker, "job_worker_heartbeat_ttl", 30)
+    broker = RedisBroker("redis://broker:6379/0")
+    broker.heartbeat("w1")
+    assert 0 < broker.redis.ttl(broker._heartbeat_key("w1")) <= 30
+
+
+def test_process_jobs_runs_the_handler():
+    broker = InProcessBroker()
+    broker.enqueue("j1", {"grade": 6})
+    broker.enqueue("j2", {"grade": None})
+
+    async def handler(payload):
+        if payload["grade"] is None:
+            raise ValueError("нет оценки")
+        return {"grade": payload["grade"] + 1}
+
+    async def run():
+        worker = asyncio.create_task(job_broker.process_jobs(broker, handler, "w1", concurrency=2))
+        while any(broker.status(job_id)["status"] in (QUEUED, RUNNING) for job_id in ("j1", "j2")):
+            await asyncio.sleep(0.01)
+        worker.cancel()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+    assert broker.status("j1")["result"] == {"grade": 7}
+    assert broker.status("j2")["error"] == {"status_code": 500, "detail": "Ошибка анализа: нет оценки"}
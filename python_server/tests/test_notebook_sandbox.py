@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+import notebook_executor
+from notebook_executor import execute_cells
+from notebook_runner import parse_srepr
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def code(*sources):
+    return [{"index": index, "type": "code", "content": source} for index, source in enumerate(sources)]
+
+
+@pytest.fixture(autouse=True)
+def sandbox():
+    pytest.importorskip("sympy")
+    if notebook_executor.sandbox_command() is None:
+        pytest.skip("prlimit/unshare not found")
+    run = execute_cells(code("1 + 1"))
+    if not run["ok"]:
+        pytest.skip(f"sandbox cannot be set up here: {run['error']}")
+
+
+def test_cells_share_a_namespace_and_report_values():
+    run = execute_cells(code(
+        "import sympy\nx = sympy.Symbol('x')",
+        "print('det'); sympy.Matrix([[1, x], [0, 2]]).det()",
+        "sympy.Matrix([[1, x], [0, 2]])",
+        "1 / 0"
+    ))
+    cells = run["cells"]
+    assert cells[0]["ok"] and cells[0]["output"] is None
+    assert cells[1]["output"] == {"kind": "number", "value": 2, "srepr": "Integer(2)"}
+    assert cells[1]["stdout"] == "det\n"
+    assert cells[2]["output"]["kind"] == "matrix" and cells[2]["output"]["values"] == [[1, "x"], [0, 2]]
+    assert not cells[3]["ok"] and cells[3]["error"].startswith("ZeroDivisionError")
+
+
+def assert_server_files_hidden(run):
+    assert run["cells"][0]["output"] == {"kind": "sequence", "values": [0, 0, 0]}
+
+
+def test_server_files_are_not_visible():
+    probe = f"[os.path.exists(p) for p in ({SERVER_DIR!r}, {os.path.join(SERVER_DIR, '.env')!r}, '/proc/1/environ')]"
+    assert_server_files_hidden(execute_cells(code("import os\n" + probe)))
+
+
+def test_server_files_are_not_visible_without_isolated_mode(monkeypatch):
+    # Before Python 3.11, -I leaves the script's directory on sys.path
+    command = notebook_executor.sandbox_command()
+    monkeypatch.setattr(notebook_executor, "sandbox_command", lambda: [part if part != "-I" else "-s" for part in command])
+    probe = f"[os.path.exists(p) for p in ({SERVER_DIR!r}, {os.path.join(SERVER_DIR, '.env')!r}, '/proc/1/environ')]"
+    assert_server_files_hidden(execute_cells(code("import os\n" + probe)))
+
+
+def test_no_network():
+    run = execute_cells(code("import socket\nsocket.create_connection(('1.1.1.1', 53), timeout=2)"))
+    assert not run["cells"][0]["ok"]
+    assert "OSError" in run["cells"][0]["error"] or "unreachable" in run["cells"][0]["error"]
+
+
+def test_cells_cannot_forge_the_result():
+    run = execute_cells(code(
+        "import os, sys\n"
+        "fd = int(sys.argv[sys.argv.index('--result-fd') + 1])\n"
+        "os.write(fd, b'{\"cells\": [{\"index\": 0, \"ok\": true, \"output\": null}]}')",
+        "print('{\"index\": 2, \"ok\": true, \"output\": {\"kind\": \"number\", \"value\": 10}}')\n"
+        "os._exit(0)",
+        "10"
+    ))
+    assert run["ok"]
+    cells = run["cells"]
+    assert not cells[0]["ok"] and "Bad file descriptor" in cells[0]["error"]
+    assert cells[1]["stdout"] == "" and not cells[1]["ok"]
+    assert cells[2] == {"index": 2, "ok": False, "output": None, "stdout": "", "error": "Выполнение прервано до этой ячейки"}
+
+
+@pytest.mark.parametrize("text", [
+    "__import__('os').system('id')",
+    "Symbol('x').__class__",
+    "Integer(1) + Integer(2)",
+    "Symbol('x; import os')",
+    "Function('f')(Symbol('x'))",
+    "Lambda((), open('/etc/passwd'))",
+    "Integer(" + "1" * 30000 + ")",
+])
+def test_parse_srepr_refuses_code(text):
+    with pytest.raises(ValueError):
+        parse_srepr(text)
+
+
+def test_parse_srepr_rebuilds_sympy_objects():
+    sympy = pytest.importorskip("sympy")
+    x = sympy.Symbol("x")
+    for value in (sympy.Rational(-3, 4) * x ** 2 + sympy.pi, sympy.Matrix([[1, x], [sympy.sqrt(2), 0]]), -sympy.oo):
+        assert parse_srepr(sympy.srepr(value)) == value
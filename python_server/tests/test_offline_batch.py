@@ -0,0 +1,96 @@
+import time
+import socket
+import threading
+
+import pytest
+import uvicorn
+
+import main_functional
+import offline_batch
+import local_batch_server
+from offline_batch import BatchClient, claim_ingestion, unfinished_batches
+from similarity_index import minhash_signature, code_cell_hashes
+
+
+@pytest.fixture(scope="module")
+def batch_api(tmp_path_factory):
+    """local_batch_server.py running on a free port, as the provider's batch API."""
+    local_batch_server.storage_dir = str(tmp_path_factory.mktemp("local_batch_data"))
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(local_batch_server.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join(5)
+
+
+@pytest.fixture
+def submitted(batch_api, shared_store, monkeypatch, sample_cells):
+    """Two submissions of the sample notebook sent as an offline batch; returns the batch state."""
+    monkeypatch.chdir(shared_store)
+    monkeypatch.setattr(offline_batch, "offline_batch_api_base", batch_api)
+    students = [
+        {"student_id": student_id, "name": name, "cells": sample_cells, "nb_repr": "{}",
+         "signature": minhash_signature(sample_cells), "cell_hashes": code_cell_hashes(sample_cells)}
+        for student_id, name in (("ivanov", "Иванов"), ("petrova", "Петрова"))
+    ]
+    return main_functional.submit_offline_batch("alg1", students, sample_cells, "{}", "0" * 64)
+
+
+def wait_until_completed(batch_id):
+    assert BatchClient().wait_for_batch(batch_id, poll_seconds=0.05, timeout=10)["status"] == "completed"
+
+
+def test_completed_batch_is_stored_once(submitted):
+    batch_id = submitted["batch_id"]
+    assert unfinished_batches(main_functional.OFFLINE_BATCH_DONE) == [("alg1", batch_id)]
+    wait_until_completed(batch_id)
+
+    state = main_functional.refresh_offline_batch("alg1", batch_id)
+    assert state["status"] == "stored" and state["stored"] == 2 and state["failed"] == {}
+    for student_id in ("ivanov", "petrova"):
+        submission = main_functional.load_submission("alg1", student_id)
+        assert submission["analysis_result"]["grade"] == 5
+        assert submission["analysis_source"] == {"type": "offline_batch", "batch_id": batch_id, "model": submitted["model"]}
+    assert unfinished_batches(main_functional.OFFLINE_BATCH_DONE) == []
+    # A later poll (of this or another process) finds the batch done and stores nothing again
+    assert main_functional.refresh_offline_batch("alg1", batch_id)["stored"] == 2
+
+
+def test_claim_of_a_crashed_process_is_taken_over_after_its_lease(submitted, monkeypatch):
+    batch_id = submitted["batch_id"]
+    wait_until_completed(batch_id)
+    # Another process claimed the results and died before storing them
+    monkeypatch.setattr(offline_batch, "offline_batch_ingest_lease", 0.2)
+    assert claim_ingestion("alg1", batch_id, main_functional.OFFLINE_BATCH_DONE)
+
+    assert main_functional.refresh_offline_batch("alg1", batch_id)["status"] != "stored"
+    assert main_functional.load_submission("alg1", "ivanov") is None
+    assert unfinished_batches(main_functional.OFFLINE_BATCH_DONE) == [("alg1", batch_id)]
+
+    time.sleep(0.3)
+    state = main_functional.refresh_offline_batch("alg1", batch_id)
+    assert state["status"] == "stored" and state["stored"] == 2
+    assert main_functional.load_submission("alg1", "ivanov") is not None
+
+
+def test_failed_store_is_released_for_the_next_poll(submitted, monkeypatch):
+    batch_id = submitted["batch_id"]
+    wait_until_completed(batch_id)
+    store = main_functional.store_offline_batch_results
+
+    def fail(*args):
+        raise RuntimeError("download interrupted")
+
+    monkeypatch.setattr(main_functional, "store_offline_batch_results", fail)
+    with pytest.raises(RuntimeError):
+        main_functional.refresh_offline_batch("alg1", batch_id)
+
+    # No lease to wait out: the next poll stores the results
+    monkeypatch.setattr(main_functional, "store_offline_batch_results", store)
+    assert main_functional.refresh_offline_batch("alg1", batch_id)["status"] == "stored"
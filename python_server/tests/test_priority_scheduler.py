@@ -0,0 +1,104 @@
+import asyncio
+from collections import Counter
+
+from priority_scheduler import WeightedRotation, PriorityScheduler, INTERACTIVE, BATCH, BACKGROUND, PRIORITY_CLASSES
+
+WEIGHTS = {INTERACTIVE: 8, BATCH: 3, BACKGROUND: 1}
+
+
+def max_gap(picks, candidate):
+    """Longest run of picks from one pick of the candidate to its next (or from the start to its first)."""
+    positions = [-1] + [position for position, pick in enumerate(picks) if pick == candidate]
+    return max(b - a for a, b in zip(positions, positions[1:]))
+
+
+def test_picks_follow_the_weights():
+    rotation = WeightedRotation(WEIGHTS)
+    picks = Counter(rotation.pick(PRIORITY_CLASSES) for _ in range(1200))
+    assert picks == {INTERACTIVE: 800, BATCH: 300, BACKGROUND: 100}
+
+
+def test_lowest_weight_is_picked_in_every_round():
+    rotation = WeightedRotation(WEIGHTS)
+    picks = [rotation.pick(PRIORITY_CLASSES) for _ in range(240)]
+    # A round is the sum of the weights (12 picks); the background class waits about one at most
+    assert max_gap(picks, BACKGROUND) <= 13
+
+
+def test_idle_candidate_does_not_cash_in_missed_turns():
+    rotation = WeightedRotation(WEIGHTS)
+    for _ in range(100):
+        assert rotation.pick([BATCH, BACKGROUND]) in (BATCH, BACKGROUND)
+    # Interactive calls arrive after a long batch-only stretch: they get their share, not a burst
+    picks = Counter(rotation.pick(PRIORITY_CLASSES) for _ in range(24))
+    assert picks[INTERACTIVE] == 16 and picks[BATCH] == 6 and picks[BACKGROUND] == 2
+
+
+def test_forgotten_candidate_restarts_level():
+    rotation = WeightedRotation()
+    for _ in range(10):
+        rotation.pick(["a"])
+    rotation.forget("a")
+    assert [rotation.pick(["a", "b"]) for _ in range(4)] in (["a", "b", "a", "b"], ["b", "a", "b", "a"])
+
+
+def grant_order(scheduler, requests):
+    """Queue the (priority, key) requests behind a held slot and return the order they are granted in."""
+    order = []
+
+    async def call(priority, key):
+        await scheduler.acquire(priority, key)
+        order.append((priority, key))
+        await asyncio.sleep(0)
+        scheduler.release(priority)
+
+    async def run():
+        await scheduler.acquire(INTERACTIVE)
+        calls = [asyncio.create_task(call(priority, key)) for priority, key in requests]
+        await asyncio.sleep(0)
+        scheduler.release(INTERACTIVE)
+        await asyncio.gather(*calls)
+
+    asyncio.run(run())
+    return order
+
+
+def test_interleaved_classes_share_the_slots_by_weight():
+    scheduler = PriorityScheduler(1, WEIGHTS, dict.fromkeys(PRIORITY_CLASSES, 1))
+    requests = [(priority, None) for _ in range(60) for priority in (BACKGROUND, BATCH, INTERACTIVE)]
+    order = [priority for priority, _ in grant_order(scheduler, requests)]
+    # While all three classes wait, each round of 12 grants is split 8:3:1
+    first_rounds = Counter(order[:48])
+    assert first_rounds == {INTERACTIVE: 32, BATCH: 12, BACKGROUND: 4}
+    assert max_gap(order[:48], BACKGROUND) <= 13
+    assert len(order) == 180
+
+
+def test_tasks_of_a_class_take_equal_turns():
+    scheduler = PriorityScheduler(1, WEIGHTS, dict.fromkeys(PRIORITY_CLASSES, 1))
+    # One task with many submissions queued before two small ones
+    requests = [(BATCH, "big")] * 20 + [(BATCH, "small-1")] * 3 + [(BATCH, "small-2")] * 3
+    order = [key for _, key in grant_order(scheduler, requests)]
+    assert Counter(order[:9]) == {"big": 3, "small-1": 3, "small-2": 3}
+
+
+def test_class_limit_leaves_slots_for_interactive_calls():
+    scheduler = PriorityScheduler(4, WEIGHTS, {INTERACTIVE: 4, BATCH: 3, BACKGROUND: 1})
+
+    async def run():
+        held = [asyncio.create_task(scheduler.acquire(BATCH, "t")) for _ in range(6)]
+        held += [asyncio.create_task(scheduler.acquire(BACKGROUND, "t")) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        assert scheduler.snapshot()["classes"][BATCH]["running"] == 3
+        assert scheduler.snapshot()["classes"][BACKGROUND]["running"] == 1
+        # The fourth slot is taken by the background call; the next free one goes to an interactive call
+        interactive = asyncio.create_task(scheduler.acquire(INTERACTIVE))
+        await asyncio.sleep(0)
+        scheduler.release(BATCH)
+        await asyncio.wait_for(interactive, 1)
+        assert scheduler.snapshot()["classes"][BATCH]["running"] == 2
+        for task in held:
+            task.cancel()
+        await asyncio.gather(*held, return_exceptions=True)
+
+    asyncio.run(run())
@@ -0,0 +1,61 @@
+import pytest
+from fastapi import FastAPI, UploadFile, File
+from fastapi.testclient import TestClient
+
+from request_limits import RequestBodyLimit
+
+LIMIT = 1024
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    received = []
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        received.append(len(await file.read()))
+        return {"bytes": received[-1]}
+
+    @app.post("/unlimited")
+    async def unlimited(file: UploadFile = File(...)):
+        return {"bytes": len(await file.read())}
+
+    app.add_middleware(RequestBodyLimit, limits={r"/upload": LIMIT})
+    client = TestClient(app)
+    client.received = received
+    return client
+
+
+def multipart(size):
+    boundary = "limit-test"
+    return (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="a.ipynb"\r\n\r\n'.encode()
+        + b"x" * size + f"\r\n--{boundary}--\r\n".encode()
+    ), {"content-type": f"multipart/form-data; boundary={boundary}"}
+
+
+def test_body_within_the_limit_reaches_the_endpoint(client):
+    response = client.post("/upload", files={"file": ("a.ipynb", b"x" * 100)})
+    assert response.status_code == 200 and response.json() == {"bytes": 100}
+
+
+def test_declared_length_over_the_limit_is_refused_before_reading(client):
+    response = client.post("/upload", files={"file": ("a.ipynb", b"x" * 2 * LIMIT)})
+    assert response.status_code == 413
+    assert str(LIMIT) in response.json()["detail"]
+    assert client.received == []
+
+
+def test_chunked_body_is_cut_off_at_the_limit(client):
+    body, headers = multipart(4 * LIMIT)
+    # A generator is sent with Transfer-Encoding: chunked and no Content-Length
+    chunks = (body[start:start + 256] for start in range(0, len(body), 256))
+    response = client.post("/upload", content=chunks, headers=headers)
+    assert response.status_code == 413
+    assert client.received == []
+
+
+def test_paths_without_a_limit_are_not_checked(client):
+    response = client.post("/unlimited", files={"file": ("a.ipynb", b"x" * 4 * LIMIT)})
+    assert response.status_code == 200 and response.json() == {"bytes": 4 * LIMIT}
@@ -0,0 +1,41 @@
+import os
+import sys
+import subprocess
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code, tmp_path, **env):
+    base_env = {key: value for key, value in os.environ.items() if key not in ("SERVER_WORKERS", "JOB_BROKER_URL")}
+    return subprocess.run(
+        [sys.executable, "-c", code], cwd=tmp_path, capture_output=True, text=True, timeout=60,
+        env={**base_env, "PYTHONPATH": SERVER_DIR, "LOG_FILE": str(tmp_path / "log.txt"), "LOG_FORMAT": "text", **env}
+    )
+
+
+def test_memory_broker_defaults_to_one_worker(tmp_path):
+    result = run_python("import serve; print(serve.server_workers)", tmp_path)
+    assert result.stdout.strip() == "1", result.stderr
+
+
+def test_several_workers_with_a_memory_broker_refuse_to_start(tmp_path):
+    result = run_python("import serve; serve.main()", tmp_path, SERVER_WORKERS="4", JOB_BROKER_URL="memory://")
+    assert result.returncode == 1
+    assert "JOB_BROKER_URL=memory://" in (tmp_path / "log.txt").read_text(encoding="utf-8")
+
+
+def test_held_listeners_write_after_release(tmp_path):
+    code = """
+import logging, threading
+import logging_setup
+logging_setup.hold_listeners()
+logging_setup.configure_logging()
+logging.getLogger("proofmate.test").warning("before fork")
+assert [t for t in threading.enumerate() if t is not threading.main_thread()] == []
+assert open(logging_setup.log_file).read() == ""
+logging_setup.release_listeners()
+logging_setup.stop_logging()
+assert "before fork" in open(logging_setup.log_file).read()
+"""
+    result = run_python(code, tmp_path)
+    assert result.returncode == 0, result.stderr
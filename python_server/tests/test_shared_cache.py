@@ -0,0 +1,44 @@
+import sqlite3
+
+import pytest
+
+import shared_cache
+from shared_cache import SharedCache, filesystem_type
+
+
+def test_values_round_trip_and_least_recently_used_are_evicted(shared_store):
+    cache = SharedCache("test", max_entries=2)
+    cache.set("a", {"grade": 8, "comment": "Верно"})
+    cache.set("b", b"\x00excel")
+    assert cache.get("a") == {"grade": 8, "comment": "Верно"}
+    cache.set("c", [1, 2])
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") == [1, 2]
+    assert SharedCache("other", 2).get("a") is None
+    assert cache.stats()["entries"] == 2
+
+
+@pytest.fixture
+def mounts(tmp_path, monkeypatch):
+    path = tmp_path / "mounts"
+    path.write_text(
+        "/dev/sda1 / ext4 rw,relatime 0 0\n"
+        "server:/export /srv/shared nfs4 rw,relatime 0 0\n"
+        "tmpfs /srv/shared/local\\040disk tmpfs rw 0 0\n"
+    )
+    monkeypatch.setattr(shared_cache, "MOUNTS_PATH", str(path))
+
+
+def test_filesystem_of_the_longest_mount_point(mounts):
+    assert filesystem_type("/srv/shared/cache.sqlite3") == "nfs4"
+    assert filesystem_type("/srv/shared/local disk/cache.sqlite3") == "tmpfs"
+    assert filesystem_type("/srv/sharedx") == "ext4"
+
+
+def test_store_on_a_network_filesystem_is_refused(shared_store, mounts, monkeypatch):
+    monkeypatch.setattr(shared_cache, "shared_cache_path", "/srv/shared/shared_cache.sqlite3")
+    monkeypatch.setattr(shared_cache.os, "makedirs", lambda *args, **kwargs: None)
+    with pytest.raises(sqlite3.OperationalError, match="network filesystem"):
+        shared_cache.connection()
+    # Users of the store treat it as unavailable, not as a failed request
+    assert SharedCache("test", 2).get("a") is None
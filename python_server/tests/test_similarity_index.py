@@ -0,0 +1,147 @@
+import json
+import asyncio
+import hashlib
+
+import pytest
+
+import similarity_index
+from similarity_index import (
+    SHINGLE_SIZE, normalize_code, code_cell_hashes, minhash_signature, estimate_similarity, changed_cells,
+    SubmissionIndex, get_submission_index, index_submission
+)
+
+SOLUTION = [
+    "from sympy import Matrix, symbols, simplify, expand, factor",
+    "a1, a2, a3 = symbols('a1 a2 a3')\nexpand((a1 + a2 + a3) ** 3 - (a1 - a2) ** 2)",
+    "u, v = symbols('u v')\nfactor(2*u**4 + 3*u**3*v - 2*u**2*v**2 - 2*u**2*v - 3*u*v**2 + 2*v**3)",
+    "expr = 2*u**4 + 3*u**3*v - 2*u**2*v**2\nexpr.collect(u)",
+    "powers = [(x**2, y**2, z**2) for x, y, z in [(1, 2, 3), (4, 5, 6)]]\npowers",
+    "powers[0] = (0, 0, 0)\npowers",
+    "A = Matrix(3, 4, lambda i, j: 3 * (4 * i + j + 1) + 1)\nA",
+    "A.row_del(1)\nA = A.col_insert(1, A.col(2))\nA",
+    "B = A.T * A\nB.det()",
+    "B.rank(), B.shape",
+]
+
+
+def cells(sources):
+    return [{"index": 2 * position + 1, "type": "code", "content": source} for position, source in enumerate(sources)]
+
+
+def jaccard(cells_a, cells_b):
+    def shingles(cells):
+        tokens = []
+        for cell in cells:
+            tokens.extend(normalize_code(cell["content"]))
+            tokens.append("<cell>")
+        return {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+    a, b = shingles(cells_a), shingles(cells_b)
+    return len(a & b) / len(a | b)
+
+
+@pytest.fixture
+def fresh_index(shared_store, monkeypatch):
+    monkeypatch.setattr(similarity_index, "_indices", {})
+    monkeypatch.setattr(similarity_index, "_synced_tasks", set())
+    return shared_store
+
+
+def test_comments_and_numbers_do_not_change_the_signature():
+    edited = [source.replace("3 * (4 * i", "5 * (4 * i") + "  # мой ответ" for source in SOLUTION]
+    assert estimate_similarity(minhash_signature(cells(SOLUTION)), minhash_signature(cells(edited))) == 1.0
+    assert code_cell_hashes(cells(SOLUTION))[6] != code_cell_hashes(cells(edited))[6]
+    assert code_cell_hashes(cells(SOLUTION))[0] == code_cell_hashes(cells(edited))[0]
+
+
+@pytest.mark.parametrize("kept", [9, 7, 4])
+def test_estimate_is_close_to_jaccard(kept):
+    base, other = cells(SOLUTION), cells(SOLUTION[:kept] + ["M = Matrix([[1, 2], [3, 4]])\nM.inv()"])
+    estimate = estimate_similarity(minhash_signature(base), minhash_signature(other))
+    assert abs(estimate - jaccard(base, other)) < 0.12
+
+
+def test_no_signature_without_code():
+    assert minhash_signature([{"index": 0, "type": "markdown", "content": "### Задание 1"}]) is None
+
+
+def test_changed_cells():
+    base = code_cell_hashes(cells(SOLUTION))
+    edited = SOLUTION[:3] + ["factor(u**2 - v**2)"] + SOLUTION[4:] + ["B.eigenvals()"]
+    assert changed_cells(base, code_cell_hashes(cells(edited))) == [7, 21]
+    assert changed_cells(base, base) == []
+
+
+def test_deleted_trailing_cells_are_changed():
+    base = code_cell_hashes(cells(SOLUTION))
+    truncated = code_cell_hashes(cells(SOLUTION[:9]))
+    assert estimate_similarity(minhash_signature(cells(SOLUTION)), minhash_signature(cells(SOLUTION[:9]))) >= 0.85
+    assert changed_cells(base, truncated) == [19]
+    assert changed_cells(base, []) == [index for index, _ in base]
+
+
+def test_query_finds_near_duplicates_above_threshold():
+    index = SubmissionIndex("t1")
+    base = cells(SOLUTION)
+    index.add("s1", minhash_signature(base), code_cell_hashes(base), "r1")
+    index.add("s2", minhash_signature(cells(SOLUTION[:4])), code_cell_hashes(cells(SOLUTION[:4])), "r1")
+    signature = minhash_signature(cells(SOLUTION[:9] + ["B.rank()"]))
+    assert [student for student, _ in index.query(signature, "r1", threshold=0.8)] == ["s1"]
+    assert index.query(signature, "r2", threshold=0.8) == []
+    assert index.query(signature, "r1", exclude="s1", threshold=0.8) == []
+    index.add("s1", minhash_signature(cells(SOLUTION[:4])), code_cell_hashes(cells(SOLUTION[:4])), "r1")
+    assert index.query(signature, "r1", threshold=0.8) == []
+
+
+def test_submissions_indexed_by_another_process_are_found(fresh_index, monkeypatch):
+    base = cells(SOLUTION)
+    index_submission("t1", str(fresh_index), "s1", minhash_signature(base), code_cell_hashes(base), "r1")
+    # Another process: its own in-memory indices, the same shared file
+    monkeypatch.setattr(similarity_index, "_indices", {})
+    index = get_submission_index("t1", str(fresh_index))
+    assert index.entries["s1"]["cell_hashes"] == code_cell_hashes(base)
+    assert index.query(minhash_signature(base), "r1", threshold=0.99)[0][0] == "s1"
+
+
+def test_sidecars_are_loaded_once(fresh_index):
+    base = cells(SOLUTION)
+    student_dir = fresh_index / "t1" / "s1"
+    student_dir.mkdir(parents=True)
+    similarity_index.save_similarity_sidecar(str(student_dir), minhash_signature(base), code_cell_hashes(base), "r1")
+    assert "s1" in get_submission_index("t1", str(fresh_index)).entries
+
+
+def notebook(sources):
+    return json.dumps({
+        "nbformat": 4, "nbformat_minor": 5, "metadata": {},
+        "cells": [{"cell_type": "code", "metadata": {}, "execution_count": None, "outputs": [], "source": source}
+                  for source in sources]
+    })
+
+
+def test_truncated_copy_does_not_inherit_the_analysis(fresh_index, monkeypatch):
+    import main_functional
+
+    monkeypatch.chdir(fresh_index)
+    monkeypatch.setattr(main_functional, "execution_enabled", False)
+    monkeypatch.setattr(main_functional, "near_duplicate_threshold", 0.8)
+    prompts = []
+
+    def complete(prompt, *args):
+        prompts.append(prompt)
+        return "Все задания решены верно.\n\nОценка: 9\nУверенность: 0.9"
+
+    monkeypatch.setattr(main_functional, "request_analysis_completion", complete)
+    reference = notebook(SOLUTION)
+
+    def analyze(student_id, name, sources):
+        content = notebook(sources)
+        return asyncio.run(main_functional.run_analysis(
+            "t1", student_id, name, content, hashlib.sha256(content.encode()).hexdigest(),
+            reference, hashlib.sha256(reference.encode()).hexdigest()
+        ))
+
+    analyze("ivanov", "Иванов", SOLUTION)
+    analyze("petrov", "Петров", SOLUTION[:9])
+    assert len(prompts) == 2
+    # A full analysis, not a delta on Иванов's: the prompt has the whole notebook
+    assert "Решение студента" in prompts[1]
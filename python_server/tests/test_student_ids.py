@@ -0,0 +1,22 @@
+from main_functional import derive_student_id
+
+
+def test_same_student_gets_the_same_id():
+    assert derive_student_id("Иванов Иван", "alg1") == derive_student_id("Иванов Иван", "alg1")
+
+
+def test_whole_name_is_kept():
+    student_id = derive_student_id("Иванова Мария", "alg1")
+    assert student_id.startswith("иванова_мария_")
+    assert derive_student_id("Иванова Анна", "alg1") != student_id
+
+
+def test_names_reduced_to_the_same_text_differ():
+    assert derive_student_id("Петров И.", "alg1") != derive_student_id("Петров И", "alg1")
+
+
+def test_id_is_safe_as_a_directory_name():
+    for name in ("../../etc", "a/b\\c", "", "   "):
+        student_id = derive_student_id(name, "alg1")
+        assert student_id and "/" not in student_id and "\\" not in student_id
+        assert student_id not in (".", "..")
@@ -0,0 +1,88 @@
+import pytest
+
+import submission_catalog
+
+
+def submission(student_id, grade, date="2026-10-01 10:00:00", confidence=0.9, weaknesses=()):
+    return {
+        "student_id": student_id,
+        "name": f"Студент {student_id}",
+        "submission_date": date,
+        "analysis_result": {
+            "grade": grade,
+            "confidence_score": confidence,
+            "error_summary": "",
+            "detailed_feedback": {"strengths": [], "weaknesses": list(weaknesses), "suggestions": []},
+            "cell_annotations": []
+        },
+        "cell_hashes": [[0, "abc"]]
+    }
+
+
+@pytest.fixture
+def catalog(shared_store, monkeypatch):
+    monkeypatch.setattr(submission_catalog, "_synced_tasks", set())
+    for number in range(10):
+        submission_catalog.record("t1", submission(f"s{number}", grade=number % 4))
+    return submission_catalog
+
+
+def walk(catalog, **kwargs):
+    """Every page of a listing, following the cursors."""
+    pages = []
+    cursor = None
+    while True:
+        page = catalog.query("t1", cursor=cursor, **kwargs)
+        pages.append([document["student_id"] for document in page["documents"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_pages_cover_every_row_once_in_sort_order(catalog):
+    pages = walk(catalog, sort="grade", limit=3)
+    rows = [student_id for page in pages for student_id in page]
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    assert sorted(rows) == sorted(f"s{number}" for number in range(10))
+    grades = {f"s{number}": number % 4 for number in range(10)}
+    assert [grades[student_id] for student_id in rows] == sorted(grades.values())
+
+
+def test_descending_sort_breaks_ties_by_student_id(catalog):
+    rows = [student_id for page in walk(catalog, sort="-grade", limit=4) for student_id in page]
+    assert rows[:4] == ["s7", "s3", "s6", "s2"]
+
+
+def test_rows_saved_meanwhile_do_not_shift_the_next_page(catalog):
+    first = catalog.query("t1", sort="grade", limit=5)
+    # Sorts before the cursor: a later page must neither repeat nor skip a row because of it
+    catalog.record("t1", submission("a0", grade=0))
+    second = catalog.query("t1", sort="grade", limit=5, cursor=first["next_cursor"])
+    seen = [document["student_id"] for document in first["documents"] + second["documents"]]
+    assert len(seen) == len(set(seen)) == 10
+    assert "a0" not in seen
+
+
+def test_cursor_of_another_sort_is_rejected(catalog):
+    cursor = catalog.query("t1", sort="grade", limit=2)["next_cursor"]
+    with pytest.raises(ValueError):
+        catalog.query("t1", sort="-date", cursor=cursor)
+    with pytest.raises(ValueError):
+        catalog.query("t1", sort="grade", cursor="not a cursor")
+
+
+def test_filters_and_total(catalog):
+    catalog.record("t1", submission("w1", grade=2, weaknesses=["Ошибка в Определителе"]))
+    page = catalog.query("t1", max_grade=1)
+    assert page["total"] == 3
+    assert {document["student_id"] for document in page["documents"]} == {"s0", "s4", "s8"}
+    assert [d["student_id"] for d in catalog.query("t1", weakness="определителе")["documents"]] == ["w1"]
+
+
+def test_older_version_does_not_overwrite_newer(catalog):
+    catalog.record("t1", submission("s1", grade=9, date="2026-10-02 10:00:00"))
+    catalog.record("t1", submission("s1", grade=5, date="2026-09-30 10:00:00"))
+    document = next(d for d in catalog.query("t1", limit=50)["documents"] if d["student_id"] == "s1")
+    assert document["analysis_result"]["grade"] == 9
+    # Resubmission internals stay out of the listed document
+    assert "cell_hashes" not in document
@@ -0,0 +1,31 @@
+from submission_packing import split_packed_response, STUDENT_DELIMITER
+
+
+def packed(*parts):
+    return "\n".join(f"{STUDENT_DELIMITER.format(number=number)}\n{text}" for number, text in parts)
+
+
+def test_well_formed_answer_is_split_per_student():
+    answer = "Разбор трёх решений:\n" + packed((1, "Оценка: 8"), (2, "Оценка: 5\nОшибка в знаке"), (3, "Оценка: 10"))
+    assert split_packed_response(answer, 3) == ["Оценка: 8", "Оценка: 5\nОшибка в знаке", "Оценка: 10"]
+
+
+def test_delimiter_variants_are_recognized():
+    answer = "  == студент 1 ==\nОценка: 7\n===== СТУДЕНТ 2 =====  \nОценка: 6"
+    assert split_packed_response(answer, 2) == ["Оценка: 7", "Оценка: 6"]
+
+
+def test_missing_delimiter_leaves_that_part_empty():
+    answer = packed((1, "Оценка: 8"), (3, "Оценка: 4"))
+    assert split_packed_response(answer, 3) == ["Оценка: 8", None, "Оценка: 4"]
+    assert split_packed_response("Оценка: 8, без разделителей", 2) == [None, None]
+
+
+def test_out_of_order_delimiters_go_to_their_students():
+    answer = packed((2, "Оценка: 6"), (1, "Оценка: 9"), (3, "Оценка: 3"))
+    assert split_packed_response(answer, 3) == ["Оценка: 9", "Оценка: 6", "Оценка: 3"]
+
+
+def test_repeated_unknown_and_empty_parts_are_ignored():
+    answer = packed((1, "Оценка: 8"), (1, "Оценка: 2"), (4, "Оценка: 5"), (2, ""), (0, "Оценка: 1"))
+    assert split_packed_response(answer, 3) == ["Оценка: 8", None, None]
@@ -0,0 +1,76 @@
+import pytest
+
+import notebook_executor
+import symbolic_checker
+from notebook_runner import compare_answer
+from test_execution_check import COMPUTED_TASKS, sample_run
+
+sympy = pytest.importorskip("sympy")
+x, y = sympy.symbols("x y")
+
+
+@pytest.mark.parametrize("student, reference, verdict", [
+    (x ** 2 + 1, x ** 2 + 1, "identical"),
+    ((x - 1) * (x + 1), x ** 2 - 1, "equivalent"),
+    (sympy.sin(x) ** 2 + sympy.cos(x) ** 2, sympy.Integer(1), "equivalent"),
+    (sympy.Matrix([[2 * x, 0], [0, 1]]), sympy.Matrix([[x + x, 0], [0, 1]]), "identical"),
+    (sympy.Matrix([[x * (x + 1)], [0]]), sympy.Matrix([[x ** 2 + x], [0]]), "equivalent"),
+    (x ** 2, x ** 3, "different"),
+    (x + y, x - y, "different"),
+    (sympy.Matrix([[1, 2]]), sympy.Matrix([[1], [2]]), "different"),
+    (sympy.Matrix([[1]]), sympy.Integer(1), "different"),
+])
+def test_verdicts(student, reference, verdict):
+    assert compare_answer(sympy.srepr(student), sympy.srepr(reference), 5) == verdict
+
+
+def test_unparsable_answer_is_unknown():
+    assert compare_answer("__import__('os')", sympy.srepr(x), 5) == "unknown"
+
+
+@pytest.fixture
+def sandbox(shared_store):
+    if notebook_executor.sandbox_command() is None:
+        pytest.skip("prlimit/unshare not found")
+    if not notebook_executor.execute_cells([{"index": 0, "type": "code", "content": "1 + 1"}])["ok"]:
+        pytest.skip("sandbox cannot be set up here")
+
+
+def test_sandboxed_verdicts_are_cached(sandbox, monkeypatch):
+    pairs = [(sympy.srepr((x - 1) * (x + 1)), sympy.srepr(x ** 2 - 1)), (sympy.srepr(x ** 2), sympy.srepr(x ** 3))]
+    assert symbolic_checker.compare_answers(pairs) == ["equivalent", "different"]
+
+    def no_sandbox(request):
+        raise AssertionError("cached verdicts are not decided again")
+
+    monkeypatch.setattr(symbolic_checker, "run_sandboxed", no_sandbox)
+    assert symbolic_checker.compare_answers(pairs) == ["equivalent", "different"]
+
+
+def test_task_verdicts_of_the_sample_notebook(sandbox, sample_cells):
+    reference = {label: sympy.srepr(x ** 2 - 1) for label in COMPUTED_TASKS}
+    student = dict(reference, **{
+        "Задание 5": sympy.srepr((x - 1) * (x + 1)),
+        "Задание 6": sympy.srepr(x ** 2 + 1)
+    })
+    check = symbolic_checker.check_task_answers(
+        sample_cells, sample_cells, sample_run(sample_cells, student), sample_run(sample_cells, reference)
+    )
+    verdicts = {task["task"]: task["verdict"] for task in check["tasks"]}
+    assert verdicts == {
+        "Задание 4": "identical", "Задание 5": "equivalent", "Задание 6": "different",
+        "Задание 9": "identical", "Задание 10": "identical"
+    }
+    assert check["verified_tasks"] == ["Задание 4", "Задание 9", "Задание 10"]
+    assert not check["all_identical"]
+
+
+def test_task_without_a_student_answer_is_missing(sample_cells, monkeypatch):
+    monkeypatch.setattr(symbolic_checker, "compare_answers", lambda pairs: ["identical"] * len(pairs))
+    run = sample_run(sample_cells)
+    student_run = sample_run(sample_cells)
+    # The only code cell of task 4 fails
+    student_run["cells"][10]["ok"] = False
+    check = symbolic_checker.check_task_answers(sample_cells, sample_cells, student_run, run)
+    assert {"task": "Задание 4", "cell_index": None, "verdict": "missing"} in check["tasks"]
+    assert "Задание 4" not in check["verified_tasks"] and not check["all_identical"]
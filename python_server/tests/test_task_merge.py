@@ -0,0 +1,63 @@
+import pytest
+
+from task_segmenter import align_tasks, globalize_cell_index, merge_task_analyses, PLACEHOLDER_ITEMS
+
+
+def analysis(grade, confidence, annotations, strengths=()):
+    return {
+        "error_summary": f"Оценка {grade}",
+        "detailed_feedback": {"strengths": list(strengths) or [PLACEHOLDER_ITEMS[0]], "weaknesses": [], "suggestions": []},
+        "confidence_score": confidence,
+        "grade": grade,
+        "cell_annotations": [{"cell_index": index, "comments": [comment]} for index, comment in annotations]
+    }
+
+
+@pytest.fixture
+def units(sample_cells):
+    return {unit["label"]: unit for unit in align_tasks(sample_cells, sample_cells)}
+
+
+def test_sections_follow_the_task_headers(units):
+    assert [cell["index"] for cell in units["Задание 1"]["student_cells"]] == [3, 4]
+    assert [cell["index"] for cell in units["Задание 10"]["student_cells"]] == [21, 22]
+    assert [cell["index"] for cell in units["Индивидуальное задание"]["student_cells"]] == [23, 24]
+    assert [cell["index"] for cell in units[None]["student_cells"]] == [0, 1, 2]
+
+
+def test_local_cell_numbers_map_to_global_indices(units):
+    cells = units["Задание 4"]["student_cells"]
+    # Global indices pass through; 0-based positions, then 1-based ones, are mapped
+    assert globalize_cell_index(10, cells) == 10
+    assert globalize_cell_index(0, cells) == 9
+    assert globalize_cell_index(2, cells) == 10
+    assert globalize_cell_index(99, cells) == 99
+    assert globalize_cell_index(5, []) == 5
+
+
+def test_merged_analysis_uses_global_indices(units):
+    labels = ["Задание 1", "Задание 4", "Индивидуальное задание"]
+    merged = merge_task_analyses(
+        [units[label] for label in labels],
+        [
+            analysis(10, 1.0, [(4, "Верно")], ["Аккуратный код"]),
+            analysis(6, 0.8, [(1, "Ответ не выведен"), (10, "Проверьте знак")]),
+            analysis(8, 0.6, [(2, "Нет обоснования")])
+        ]
+    )
+    assert merged["grade"] == 8
+    assert merged["confidence_score"] == pytest.approx(0.8)
+    assert merged["cell_annotations"] == [
+        {"cell_index": 4, "comments": ["Верно"]},
+        {"cell_index": 10, "comments": ["Ответ не выведен", "Проверьте знак"]},
+        {"cell_index": 24, "comments": ["Нет обоснования"]}
+    ]
+    assert merged["detailed_feedback"]["strengths"] == ["Задание 1: Аккуратный код"]
+    assert merged["error_summary"].splitlines()[1] == "Задание 4: Оценка 6"
+
+
+def test_tasks_without_analysis_are_left_out(units):
+    merged = merge_task_analyses([units["Задание 1"], units["Задание 2"]], [None, analysis(4, 0.5, [])])
+    assert merged["grade"] == 4 and merged["error_summary"] == "Задание 2: Оценка 4"
+    with pytest.raises(ValueError):
+        merge_task_analyses([units["Задание 1"]], [None])
@@ -0,0 +1,75 @@
+import json
+import asyncio
+import hashlib
+
+import pytest
+
+import main_functional
+import symbolic_checker
+from conftest import SAMPLE_NOTEBOOK
+from test_execution_check import COMPUTED_TASKS, sample_run
+
+LLM_ANSWER = """Решение в целом верное, но в нескольких заданиях есть неточности.
+
+Оценка: 6
+Уверенность: 0.8
+
+Сильные стороны:
+- Аккуратный код
+
+Слабые стороны:
+- Ячейка 4: ответ не выведен
+"""
+
+
+def notebook_text(cells):
+    with open(SAMPLE_NOTEBOOK, encoding="utf-8") as file:
+        notebook = json.load(file)
+    for cell in cells:
+        notebook["cells"][cell["index"]]["source"] = cell["content"]
+    return json.dumps(notebook, ensure_ascii=False)
+
+
+@pytest.fixture
+def pipeline(shared_store, monkeypatch, sample_cells):
+    """run_analysis with the checks enabled, a stubbed sandbox and a stubbed model that records its prompts."""
+    monkeypatch.chdir(shared_store)
+    monkeypatch.setattr(main_functional, "execution_enabled", True)
+    monkeypatch.setattr(main_functional, "execution_fast_path", True)
+    monkeypatch.setattr(main_functional, "execute_notebooks", lambda notebooks: [sample_run(sample_cells)] * 2)
+    monkeypatch.setattr(symbolic_checker, "compare_answers",
+                        lambda pairs: ["identical" if student == reference else "different" for student, reference in pairs])
+    prompts = []
+
+    def complete(prompt, *args):
+        prompts.append(prompt)
+        return LLM_ANSWER
+
+    monkeypatch.setattr(main_functional, "request_analysis_completion", complete)
+    content = notebook_text(sample_cells)
+
+    def analyze():
+        content_hash = hashlib.sha256(content.encode()).hexdigest()
+        return asyncio.run(main_functional.run_analysis("alg1", "kuznetsov", "Кузнецов", content, content_hash, content, content_hash))
+
+    return analyze, prompts
+
+
+def test_matching_submission_with_unchecked_tasks_goes_to_the_model(pipeline):
+    analyze, prompts = pipeline
+    result = analyze()
+    assert prompts, "tasks without a checkable answer must be graded by the model"
+    assert not (result["grade"] == 10.0 and result["confidence_score"] == 1.0)
+    # Verified tasks are graded locally, their statements are not sent
+    assert not any("Раскройте скобки" in prompt for prompt in prompts)
+    assert any("Задание 7" in prompt and "Powers" in prompt for prompt in prompts)
+    assert "Задание 4: Результаты совпадают с эталонными" in result["detailed_feedback"]["strengths"]
+
+
+def test_symbolic_check_lists_unchecked_tasks(sample_cells, monkeypatch):
+    monkeypatch.setattr(symbolic_checker, "compare_answers", lambda pairs: ["identical"] * len(pairs))
+    run = sample_run(sample_cells)
+    check = symbolic_checker.check_task_answers(sample_cells, sample_cells, run, run)
+    assert check["verified_tasks"] == COMPUTED_TASKS
+    assert "Задание 8" in check["unchecked_tasks"] and "Задание 4" not in check["unchecked_tasks"]
+    assert not check["all_identical"]
@@ -0,0 +1,124 @@
+import os
+import json
+import logging
+from collections import deque
+from typing import List, Dict, Any, Iterable, Optional
+
+logger = logging.getLogger("proofmate.topic_classifier")
+
+DEFAULT_TAXONOMY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "topic_taxonomy.json")
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton: finds every keyword occurrence in a single pass over the text.
+    Keywords are expected to be lowercase already.
+    """
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = []
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for keyword in keywords:
+            if not keyword:
+                continue
+            self._add(keyword, len(self.keywords))
+            self.keywords.append(keyword)
+
+        self._build_failure_links()
+
+    def _add(self, keyword: str, keyword_id: int):
+        state = 0
+        for char in keyword:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = next_state
+            state = next_state
+        self.output[state].append(keyword_id)
+
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                # Inherit matches that end at the failure state
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def find_all(self, text: str) -> set:
+        """Return the ids of all keywords occurring in the text."""
+        goto, fail, output = self.goto, self.fail, self.output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+def load_taxonomy(path: Optional[str] = None) -> Dict[str, Any]:
+    """Load the weighted topic taxonomy from a JSON config file."""
+    path = path or os.getenv("TOPIC_TAXONOMY_PATH", DEFAULT_TAXONOMY_PATH)
+    with open(path, "r", encoding="utf-8") as f:
+        taxonomy = json.load(f)
+    logger.info(f"Loaded topic taxonomy with {len(taxonomy.get('topics', {}))} topics from {path}")
+    return taxonomy
+
+
+class TopicClassifier:
+    """Weighted keyword classifier: each distinct keyword found adds its weight to its topic."""
+
+    def __init__(self, taxonomy: Dict[str, Any]):
+        self.default_topic = taxonomy.get("default_topic", "general_mathematics")
+        self.topics = list(taxonomy.get("topics", {}).keys())
+
+        # The same keyword may be listed under several topics
+        self.keyword_weights = {}
+        for topic, keywords in taxonomy.get("topics", {}).items():
+            for keyword, weight in keywords.items():
+                self.keyword_weights.setdefault(keyword.lower(), []).append((topic, float(weight)))
+
+        self.automaton = KeywordAutomaton(self.keyword_weights.keys())
+
+    def score(self, texts: Iterable[str]) -> Dict[str, float]:
+        """Score every topic against the given texts (lowercased once, scanned once)."""
+        content = " ".join(texts).lower()
+        scores = {topic: 0.0 for topic in self.topics}
+        for keyword_id in self.automaton.find_all(content):
+            for topic, weight in self.keyword_weights[self.automaton.keywords[keyword_id]]:
+                scores[topic] += weight
+        return scores
+
+    def classify(self, texts: Iterable[str]) -> str:
+        """Return the best scoring topic, or the default topic when nothing matched."""
+        scores = self.score(texts)
+        if not scores or all(value <= 0 for value in scores.values()):
+            return self.default_topic
+        return max(scores.items(), key=lambda x: x[1])[0]
+
+    def classify_batch(self, submissions: List[Iterable[str]]) -> List[str]:
+        """Classify a whole set of submissions, each given as its cell texts."""
+        return [self.classify(texts) for texts in submissions]
+
+
+_classifier = None
+
+def get_topic_classifier() -> TopicClassifier:
+    """Return the shared classifier, building it from the configured taxonomy on first use."""
+    global _classifier
+    if _classifier is None:
+        _classifier = TopicClassifier(load_taxonomy())
+    return _classifier
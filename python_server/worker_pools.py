@@ -0,0 +1,94 @@
+import os
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+from logging_setup import process_log_queue, init_worker_logging, log_context, call_with_log_context
+
+logger = logging.getLogger("proofmate.worker_pools")
+
+# Blocking file I/O runs in threads, CPU-heavy parsing and report building in processes
+io_workers = int(os.getenv("IO_WORKERS", "8"))
+cpu_workers = int(os.getenv("CPU_WORKERS", str(max((os.cpu_count() or 2) - 1, 1))))
+# Jobs waiting for or running in a pool; callers beyond the limit wait before submitting
+io_queue_size = int(os.getenv("IO_QUEUE_SIZE", "64"))
+cpu_queue_size = int(os.getenv("CPU_QUEUE_SIZE", "16"))
+
+
+class BoundedPool:
+    """An executor whose queue of submitted jobs is bounded: callers wait for a slot instead of piling up work."""
+
+    def __init__(self, name, create_executor, queue_size, wrap_call):
+        self.name = name
+        self._create_executor = create_executor
+        self._wrap_call = wrap_call
+        self._executor = None
+        self._queue_size = queue_size
+        self._slots = None
+        self._slots_loop = None
+        self._pending = 0
+
+    def _ensure_started(self):
+        if self._executor is None:
+            self._executor = self._create_executor()
+            logger.info(f"Started {self.name} pool")
+        # The semaphore belongs to the running event loop
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self._queue_size)
+            self._slots_loop = loop
+
+    async def run(self, func, *args, **kwargs):
+        self._ensure_started()
+        self._pending += 1
+        try:
+            async with self._slots:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, self._wrap_call(func, *args, **kwargs))
+        finally:
+            self._pending -= 1
+
+    def pending(self) -> int:
+        """Jobs submitted or waiting for a queue slot."""
+        return self._pending
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        self._slots = None
+
+
+def in_current_context(func, *args, **kwargs):
+    """Threads run the call in a copy of the caller's context, so its log records keep the request IDs."""
+    return partial(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def with_log_context(func, *args, **kwargs):
+    """Processes cannot share the context; the request IDs travel with the (picklable) call."""
+    return partial(call_with_log_context, log_context(), func, *args, **kwargs)
+
+
+io_pool = BoundedPool(
+    "io", lambda: ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="proofmate-io"),
+    io_queue_size, in_current_context
+)
+cpu_pool = BoundedPool(
+    "cpu", lambda: ProcessPoolExecutor(max_workers=cpu_workers, initializer=init_worker_logging, initargs=(process_log_queue(),)),
+    cpu_queue_size, with_log_context
+)
+
+
+async def run_io(func, *args, **kwargs):
+    """Run blocking disk work (open, json.dump, os.makedirs, ...) off the event loop."""
+    return await io_pool.run(func, *args, **kwargs)
+
+
+async def run_cpu(func, *args, **kwargs):
+    """Run CPU-heavy work in a worker process; func and its arguments must be picklable."""
+    return await cpu_pool.run(func, *args, **kwargs)
+
+
+def shutdown_pools():
+    io_pool.shutdown()
+    cpu_pool.shutdown()